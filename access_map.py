@@ -0,0 +1,203 @@
+import os
+import sys
+import json
+import sqlite3
+import threading
+
+USER_VIDEOS_JSON_PATH = "data/user_videos.json"
+ACCESS_DB_PATH = "data/access.db"
+# Staff see cohort-wide views over every video (comma-separated emails)
+STAFF_EMAILS = frozenset(e.strip() for e in os.environ.get("SCOPE_STAFF_EMAILS", "").split(",") if e.strip())
+
+
+class AccessMap:
+    """
+    Which users can see which videos, backed by an SQLite table with one row per
+    (email, video) grant. One index serves "videos of a user" and another the
+    reverse "users of a video", so both are index lookups that stay fast as users
+    and shared videos grow, and either list can be read one page at a time.
+    The legacy data/user_videos.json is imported the first time the table is opened and
+    again whenever the file changes (see _sync_legacy).
+    """
+
+    def __init__(self, db_path=ACCESS_DB_PATH, legacy_json=USER_VIDEOS_JSON_PATH):
+        self.db_path = db_path
+        self.legacy_json = legacy_json
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+        self._synced_signature = None
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        if not self._initialized:
+            self._initialize(conn)
+        self._sync_legacy(conn)
+        return conn
+
+    def _initialize(self, conn):
+        with self._init_lock:
+            if self._initialized:
+                return
+            with conn:
+                # rowid keeps grant order, which is the order users see their videos in
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS access ("
+                    " email TEXT NOT NULL,"
+                    " video TEXT NOT NULL,"
+                    " granted_at REAL NOT NULL DEFAULT (strftime('%s', 'now')),"
+                    " display_name TEXT,"
+                    " PRIMARY KEY (email, video))"
+                )
+                # Uploads are stored under their content hash: the row keeps the name the user gave
+                if "display_name" not in [row[1] for row in conn.execute("PRAGMA table_info(access)")]:
+                    conn.execute("ALTER TABLE access ADD COLUMN display_name TEXT")
+                # (email, rowid) order lets a user's page be read without sorting
+                conn.execute("CREATE INDEX IF NOT EXISTS access_by_email ON access (email)")
+                conn.execute("CREATE INDEX IF NOT EXISTS access_by_video ON access (video, email)")
+                conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self._initialized = True
+
+    def _sync_legacy(self, conn):
+        """
+        Re-imports the legacy JSON when its mtime or size differs from the last import.
+        Grants added to the file since then are granted and grants removed from it are
+        revoked; grants made or revoked with grant()/revoke() are otherwise left alone.
+        """
+        try:
+            stat = os.stat(self.legacy_json) if self.legacy_json else None
+        except FileNotFoundError:
+            stat = None
+        signature = f"{stat.st_mtime_ns}:{stat.st_size}" if stat else None
+        if signature is None or signature == self._synced_signature:
+            return
+        with self._init_lock:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'legacy_json_signature'").fetchone()
+            if row is None or row[0] != signature:
+                self._migrate(conn, self.legacy_json, signature)
+            self._synced_signature = signature
+
+    def _migrate(self, conn, json_path, signature=None):
+        with open(json_path, "r") as f:
+            data = json.load(f)
+        grants = list(dict.fromkeys((email, video) for email, videos in data.items() for video in videos))
+        with conn:
+            if signature is None:
+                conn.executemany("INSERT OR IGNORE INTO access (email, video) VALUES (?, ?)", grants)
+            else:
+                # Apply only the difference to the previous import of the legacy file
+                row = conn.execute("SELECT value FROM meta WHERE key = 'legacy_json_grants'").fetchone()
+                previous = {tuple(grant) for grant in json.loads(row[0])} if row else set()
+                current = set(grants)
+                conn.executemany("DELETE FROM access WHERE email = ? AND video = ?", previous - current)
+                conn.executemany("INSERT OR IGNORE INTO access (email, video) VALUES (?, ?)",
+                                 [grant for grant in grants if grant not in previous])
+                conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", [
+                    ("legacy_json_grants", json.dumps(grants)),
+                    ("legacy_json_signature", signature),
+                ])
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('legacy_json_migrated', ?)",
+                (os.path.abspath(json_path),),
+            )
+        return len(grants)
+
+    def migrate_from_json(self, json_path=None):
+        """
+        Imports every grant of a user_videos.json-style file (email -> [videos]).
+        Existing grants are kept. Returns the number of grants read.
+        """
+        return self._migrate(self._conn(), json_path or self.legacy_json)
+
+    def videos_for(self, email, offset=0, limit=None):
+        """
+        Videos a user can see, in the order they were granted, optionally one page of them.
+        """
+        rows = self._conn().execute(
+            "SELECT video FROM access WHERE email = ? ORDER BY rowid LIMIT ? OFFSET ?",
+            (email, -1 if limit is None else limit, offset),
+        )
+        return [row[0] for row in rows]
+
+    def count_videos(self, email):
+        return self._conn().execute("SELECT COUNT(*) FROM access WHERE email = ?", (email,)).fetchone()[0]
+
+    def users_for(self, video, offset=0, limit=None):
+        """
+        Users who can see a video, by email, optionally one page of them.
+        """
+        rows = self._conn().execute(
+            "SELECT email FROM access WHERE video = ? ORDER BY email LIMIT ? OFFSET ?",
+            (video, -1 if limit is None else limit, offset),
+        )
+        return [row[0] for row in rows]
+
+    def is_staff(self, email):
+        return email in STAFF_EMAILS
+
+    def has_access(self, email, video):
+        return self._conn().execute(
+            "SELECT 1 FROM access WHERE email = ? AND video = ?", (email, video)
+        ).fetchone() is not None
+
+    def display_names(self, email):
+        """
+        {video: name} of a user's videos that were given a display name (uploads).
+        """
+        rows = self._conn().execute(
+            "SELECT video, display_name FROM access WHERE email = ? AND display_name IS NOT NULL", (email,))
+        return dict(rows.fetchall())
+
+    def grant(self, email, video, display_name=None):
+        """
+        Gives a user access to a video, shown to that user as display_name if given
+        (which also renames a video the user already had). Returns False if it
+        already had access.
+        """
+        conn = self._conn()
+        with conn:
+            cursor = conn.execute("INSERT OR IGNORE INTO access (email, video, display_name) VALUES (?, ?, ?)",
+                                  (email, video, display_name))
+            granted = cursor.rowcount > 0
+            if not granted and display_name:
+                conn.execute("UPDATE access SET display_name = ? WHERE email = ? AND video = ?",
+                             (display_name, email, video))
+        return granted
+
+    def revoke(self, email, video):
+        """
+        Removes a user's access to a video. Returns False if it had none.
+        """
+        conn = self._conn()
+        with conn:
+            cursor = conn.execute("DELETE FROM access WHERE email = ? AND video = ?", (email, video))
+        return cursor.rowcount > 0
+
+
+access_map = AccessMap()
+
+
+if __name__ == "__main__":
+    # python access_map.py migrate [path/to/user_videos.json]
+    # python access_map.py grant|revoke <email> <video>
+    # python access_map.py videos <email> | users <video>
+    command, args = (sys.argv[1], sys.argv[2:]) if len(sys.argv) > 1 else ("", [])
+    if command == "migrate":
+        source = args[0] if args else USER_VIDEOS_JSON_PATH
+        print(f"Imported {access_map.migrate_from_json(source)} grants from {source} into {ACCESS_DB_PATH}")
+    elif command in ("grant", "revoke") and len(args) == 2:
+        changed = getattr(access_map, command)(*args)
+        print(f"{command}: {args[0]} {args[1]}" + ("" if changed else " (no change)"))
+    elif command == "videos" and len(args) == 1:
+        print("\n".join(access_map.videos_for(args[0])))
+    elif command == "users" and len(args) == 1:
+        print("\n".join(access_map.users_for(args[0])))
+    else:
+        print("usage: python access_map.py migrate [user_videos.json] | grant|revoke <email> <video>"
+              " | videos <email> | users <video>")
@@ -0,0 +1,501 @@
+import os
+import json
+import math
+import time
+import shutil
+import threading
+import numpy as np
+import cv2
+
+from face_tracking import FaceTracker
+from metrics import registry
+
+FEATURE_DIR = "data/features"
+ANALYZER_VERSION = "0.2.0"
+
+# Frames are decoded once, downscaled to this width and shared by every extractor
+ANALYSIS_WIDTH = 320
+
+# Face box as fractions of the frame (x0, y0, x1, y1), used when no face detector is
+# available. The sample recordings are webcam sessions with the student centred in the frame.
+FACE_BOX = (0.25, 0.10, 0.75, 0.80)
+# Tracked face box per frame, as fractions of the frame
+FACE_COLUMNS = ("face.x", "face.y", "face.w", "face.h")
+
+# Frames per model call and OpenCV worker threads, overridable per call
+DEFAULT_BATCH_SIZE = int(os.environ.get("SCOPE_BATCH_SIZE", "32"))
+DEFAULT_NUM_THREADS = int(os.environ.get("SCOPE_NUM_THREADS", "0"))  # 0 = OpenCV default
+
+# Length of the windows of the streaming analysis (see extract_features_windowed)
+WINDOW_SECONDS = float(os.environ.get("SCOPE_WINDOW_SECONDS", "30"))
+
+
+def face_region(faces, top, bottom):
+    """
+    Returns the horizontal band [top, bottom), given as fractions of the face
+    height, of a (N, S, S) batch of face crops.
+    """
+    size = faces.shape[-2]
+    return faces[..., int(size * top):int(size * bottom), :]
+
+
+class Extractor:
+    """
+    Base class for per-modality extractors. The engine decodes each frame once, groups
+    frames into NumPy batches and calls every registered extractor once per batch.
+    process_batch() receives (N, H, W, 3) BGR and (N, H, W) grayscale frames plus the
+    (N, S, S) grayscale face crops of the shared face tracker, and returns one
+    length-N array per column.
+
+    placeholder marks an extractor that is not a trained model: its output is
+    labelled as placeholder data and never stored as a video's report.
+    """
+
+    name = ""
+    columns = ()
+    placeholder = False
+
+    def load_model(self):
+        """
+        Loads this modality's model weights. Called at most once per process, on first
+        use of self.model; the instance is then shared by every extractor of that
+        modality in the process (see get_model).
+        """
+        return None
+
+    @property
+    def model(self):
+        return get_model(self.name, self.load_model)
+
+    def reset(self, fps):
+        pass
+
+    def get_state(self):
+        """
+        Arrays this extractor carries from one batch into the next, saved with window
+        checkpoints so that a resumed analysis continues where it stopped.
+        """
+        return {}
+
+    def set_state(self, state):
+        pass
+
+    def process_batch(self, frames, grays, faces):
+        raise NotImplementedError
+
+
+EXTRACTORS = {}
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def get_model(name, loader):
+    """
+    The model registered as `name`, created with loader() on first use and shared by
+    every video analyzed in this process afterwards. Job workers are long-lived, so
+    each loads a model once, not once per job.
+    """
+    if name not in _models:
+        with _models_lock:
+            if name not in _models:
+                start = time.perf_counter()
+                _models[name] = loader()
+                registry.observe("model_load_seconds", time.perf_counter() - start, model=name)
+    return _models[name]
+
+
+def register_extractor(cls):
+    EXTRACTORS[cls.name] = cls
+    return cls
+
+
+def uses_placeholders(modalities=None):
+    """
+    Whether any of the extractors (all by default) is a placeholder, not a trained model.
+    """
+    return any(EXTRACTORS[name].placeholder for name in (modalities or EXTRACTORS))
+
+
+# The extractors below are placeholders: image statistics of the face regions that
+# let the pipeline run end to end, not trained AU, VA, blink and gaze models. A
+# trained model is registered the same way with placeholder = False, its weights
+# loaded in load_model() and used through self.model.
+
+def _edge_energy(regions):
+    diffs = np.abs(np.diff(regions.astype(np.float32), axis=1))
+    return np.minimum(diffs.mean(axis=(1, 2)) / 32.0, 1.0)
+
+
+@register_extractor
+class AUExtractor(Extractor):
+    name = "au"
+    placeholder = True
+    columns = ("au03", "au05", "au22")
+
+    def process_batch(self, frames, grays, faces):
+        return {
+            "au03": _edge_energy(face_region(faces, 0.20, 0.35)),
+            "au05": _edge_energy(face_region(faces, 0.30, 0.45)),
+            "au22": _edge_energy(face_region(faces, 0.65, 0.85)),
+        }
+
+
+@register_extractor
+class VAExtractor(Extractor):
+    name = "va"
+    placeholder = True
+    columns = ("valence", "arousal")
+
+    def reset(self, fps):
+        self._previous = None
+
+    def get_state(self):
+        return {} if self._previous is None else {"previous": self._previous}
+
+    def set_state(self, state):
+        self._previous = state.get("previous")
+
+    def process_batch(self, frames, grays, faces):
+        faces = faces.astype(np.float32)
+        # Motion against the previous frame, carried across batch boundaries
+        previous = faces[:1] if self._previous is None else self._previous[None]
+        shifted = np.concatenate([previous, faces[:-1]])
+        motion = np.abs(faces - shifted).mean(axis=(1, 2))
+        self._previous = faces[-1]
+        half = faces.shape[1] // 2
+        upper = faces[:, :half].mean(axis=(1, 2))
+        lower = faces[:, half:].mean(axis=(1, 2))
+        return {
+            "valence": np.tanh((lower - upper) / 32.0),
+            "arousal": np.tanh(motion / 8.0) * 2.0 - 1.0,
+        }
+
+
+@register_extractor
+class BlinkExtractor(Extractor):
+    name = "blink"
+    placeholder = True
+    columns = ("eye_openness",)
+
+    def process_batch(self, frames, grays, faces):
+        eyes = face_region(faces, 0.30, 0.45).astype(np.float32)
+        # Open eyes show dark pupils against bright sclera and skin: high contrast
+        return {"eye_openness": np.minimum(eyes.std(axis=(1, 2)) / 64.0, 1.0)}
+
+
+@register_extractor
+class GazeExtractor(Extractor):
+    name = "gaze"
+    placeholder = True
+    columns = ("gaze_x", "gaze_y")
+
+    def process_batch(self, frames, grays, faces):
+        eyes = face_region(faces, 0.30, 0.45).astype(np.float32)
+        weights = np.clip(eyes.mean(axis=(1, 2), keepdims=True) - eyes, 0, None)
+        totals = np.maximum(weights.sum(axis=(1, 2)), 1e-6)
+        h, w = eyes.shape[1:]
+        xs = np.linspace(-1.0, 1.0, w, dtype=np.float32)
+        ys = np.linspace(-1.0, 1.0, h, dtype=np.float32)
+        return {
+            "gaze_x": (weights.sum(axis=1) * xs).sum(axis=1) / totals,
+            "gaze_y": (weights.sum(axis=2) * ys).sum(axis=1) / totals,
+        }
+
+
+def warm_up(modalities=None):
+    """
+    Loads the models of the extractors and runs them once on a blank batch so that
+    model loading and first-call overhead are paid before the first real video.
+    """
+    extractors = [EXTRACTORS[name]() for name in (modalities or EXTRACTORS)]
+    for extractor in extractors:
+        extractor.model
+    frames = np.zeros((1, 240, ANALYSIS_WIDTH, 3), dtype=np.uint8)
+    grays = np.zeros((1, 240, ANALYSIS_WIDTH), dtype=np.uint8)
+    faces, _ = FaceTracker(FACE_BOX).crops(grays)
+    for extractor in extractors:
+        extractor.reset(30.0)
+        extractor.process_batch(frames, grays, faces)
+    return extractors
+
+
+def iter_frame_batches(capture, batch_size, stride=1, scene_threshold=None, max_frames=None):
+    """
+    Reads frames from an open cv2.VideoCapture, downscaled to ANALYSIS_WIDTH, and
+    yields (frame_indices, frames, grays) NumPy batches of up to batch_size frames.
+    With stride > 1 only every stride-th frame is decoded. With scene_threshold set,
+    only frames whose thumbnail differs from the last kept frame by more than the
+    threshold (mean absolute difference, 0-255) are kept, plus the first frame.
+    With max_frames set, stops after that many frames of the stream, leaving the
+    capture positioned on the next one.
+    """
+    indices, frames = [], []
+    last_thumbnail = None
+    frame_index = -1
+    while True:
+        frame_index += 1
+        if max_frames is not None and frame_index >= max_frames:
+            ok = False
+        elif frame_index % stride:
+            # grab() advances without converting the frame, which is the bulk of the cost
+            ok = capture.grab()
+            if ok:
+                continue
+        else:
+            ok, frame = capture.read()
+        if ok:
+            scale = ANALYSIS_WIDTH / frame.shape[1]
+            if scale < 1:
+                frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            keep = True
+            if scene_threshold is not None:
+                thumbnail = cv2.resize(frame, (32, 24), interpolation=cv2.INTER_AREA).astype(np.int16)
+                keep = last_thumbnail is None or np.abs(thumbnail - last_thumbnail).mean() > scene_threshold
+                if keep:
+                    last_thumbnail = thumbnail
+            if keep:
+                indices.append(frame_index)
+                frames.append(frame)
+        if frames and (len(frames) == batch_size or not ok):
+            grays = np.stack([cv2.cvtColor(f, cv2.COLOR_BGR2GRAY) for f in frames])
+            yield np.asarray(indices, dtype=np.int32), np.stack(frames), grays
+            indices, frames = [], []
+        if not ok:
+            return
+
+
+def run_extractors(extractors, frames, grays, faces, columns, timer=None):
+    for extractor in extractors:
+        start = time.perf_counter()
+        outputs = extractor.process_batch(frames, grays, faces)
+        if timer is not None:
+            timer.add(f"extract.{extractor.name}", time.perf_counter() - start)
+        for column in extractor.columns:
+            columns[f"{extractor.name}.{column}"].append(np.asarray(outputs[column], dtype=np.float32))
+
+
+def extract_features(video_path, modalities=None, progress=None, batch_size=None, num_threads=None,
+                     stride=1, scene_threshold=None, timer=None):
+    """
+    Decodes video_path once and feeds NumPy batches of frames to the extractors of
+    the requested modalities (all registered ones by default), one call per batch.
+    stride and scene_threshold subsample the frame stream (see iter_frame_batches).
+    If a run_timings.RunTimer is given, decode and per-modality time are added to it.
+    Returns a dict of per-frame column arrays keyed "<modality>.<column>", plus
+    "frame_index", "timestamp", "fps", "total_frames" and "analyzer_version".
+    """
+    extractors, tracker, capture, fps, total_frames = _open(video_path, modalities, num_threads)
+    try:
+        columns, frame_indices = _extract_pass(
+            capture, extractors, tracker, max(1, batch_size or DEFAULT_BATCH_SIZE), stride=stride,
+            scene_threshold=scene_threshold, timer=timer,
+            on_batch=None if progress is None else
+            lambda indices: progress(min((indices[-1] + 1) / total_frames, 1.0), "Decoding and extracting features"),
+        )
+    finally:
+        capture.release()
+    return _assemble(columns, frame_indices, fps, total_frames)
+
+
+def _open(video_path, modalities, num_threads):
+    num_threads = DEFAULT_NUM_THREADS if num_threads is None else num_threads
+    if num_threads > 0:
+        cv2.setNumThreads(num_threads)
+    extractors = [EXTRACTORS[name]() for name in (modalities or EXTRACTORS)]
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        raise ValueError(f"Cannot open video: {video_path}")
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+    total_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT)) or 1
+    for extractor in extractors:
+        extractor.reset(fps)
+    # One tracker per video, shared by every modality
+    return extractors, FaceTracker(FACE_BOX), capture, fps, total_frames
+
+
+def _empty_columns(extractors):
+    return {name: [] for name in [f"{e.name}.{c}" for e in extractors for c in e.columns] + list(FACE_COLUMNS)}
+
+
+def _extract_pass(capture, extractors, tracker, batch_size, stride=1, scene_threshold=None, max_frames=None,
+                  timer=None, on_batch=None):
+    columns = _empty_columns(extractors)
+    frame_indices = []
+    decode_start = time.perf_counter()
+    for indices, frames, grays in iter_frame_batches(capture, batch_size, stride, scene_threshold, max_frames):
+        if timer is not None:
+            timer.add("decode", time.perf_counter() - decode_start)
+        faces, boxes = tracker.crops(grays, timer)
+        height, width = grays.shape[1:]
+        for column, values in zip(FACE_COLUMNS, (boxes / [width, height, width, height]).T):
+            columns[column].append(values.astype(np.float32))
+        run_extractors(extractors, frames, grays, faces, columns, timer)
+        frame_indices.append(indices)
+        if on_batch is not None:
+            on_batch(indices)
+        decode_start = time.perf_counter()
+    return columns, frame_indices
+
+
+def _assemble(columns, frame_indices, fps, total_frames):
+    features = {
+        name: np.concatenate(parts) if parts else np.zeros(0, dtype=np.float32)
+        for name, parts in columns.items()
+    }
+    features["frame_index"] = np.concatenate(frame_indices) if frame_indices else np.zeros(0, dtype=np.int32)
+    features["timestamp"] = (features["frame_index"] / fps).astype(np.float32)
+    features["fps"] = np.float32(fps)
+    features["total_frames"] = np.int32(max(total_frames, features["frame_index"][-1] + 1 if frame_indices else 0))
+    features["analyzer_version"] = np.str_(ANALYZER_VERSION)
+    return features
+
+
+def concat_features(parts):
+    """
+    Joins feature dicts of consecutive stretches of one video (e.g. analysis windows).
+    """
+    features = {
+        name: np.concatenate([part[name] for part in parts]) if np.ndim(value) else value
+        for name, value in parts[0].items()
+    }
+    features["total_frames"] = np.int32(max(int(part["total_frames"]) for part in parts))
+    return features
+
+
+def window_dir(video_filename, feature_dir=FEATURE_DIR):
+    return feature_path(video_filename, feature_dir)[:-len(".npz")] + ".windows"
+
+
+def _carry_state(extractors, tracker):
+    """
+    What carries from one window into the next (the face track, the VA extractor's
+    previous frame) as "carry.<owner>.<name>" arrays, stored in the window checkpoint.
+    """
+    state = {f"carry.tracker.{name}": value for name, value in tracker.get_state().items()}
+    for extractor in extractors:
+        state.update({f"carry.{extractor.name}.{name}": value for name, value in extractor.get_state().items()})
+    return state
+
+
+def _restore_carry_state(carry, extractors, tracker):
+    def owned(owner):
+        prefix = f"carry.{owner}."
+        return {name[len(prefix):]: value for name, value in carry.items() if name.startswith(prefix)}
+    tracker.set_state(owned("tracker"))
+    for extractor in extractors:
+        extractor.set_state(owned(extractor.name))
+
+
+def _load_windows(checkpoint_dir, settings):
+    """
+    Finished windows checkpointed by an earlier run with the same settings, in order,
+    and the carry-over state saved with the last of them. Checkpoints of other
+    settings or analyzer versions are discarded.
+    """
+    state_path = os.path.join(checkpoint_dir, "state.json")
+    try:
+        with open(state_path, "r") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = None
+    if state != settings:
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)
+        os.makedirs(checkpoint_dir)
+        with open(state_path, "w") as f:
+            json.dump(settings, f)
+        return [], {}
+    windows, carry = [], {}
+    while os.path.exists(os.path.join(checkpoint_dir, f"{len(windows):05d}.npz")):
+        with np.load(os.path.join(checkpoint_dir, f"{len(windows):05d}.npz")) as data:
+            carry = {name: data[name] for name in data.files if name.startswith("carry.")}
+            windows.append({name: data[name] for name in data.files if not name.startswith("carry.")})
+    return windows, carry
+
+
+def extract_features_windowed(video_path, window_seconds=None, on_window=None, progress=None, batch_size=None,
+                              num_threads=None, timer=None, feature_dir=FEATURE_DIR):
+    """
+    Full-rate extract_features in consecutive windows of window_seconds. Every finished
+    window is checkpointed to <feature_dir>/<video_id>.windows/ and
+    on_window(windows, total_windows) is called with the feature dicts of all windows
+    so far, so results for the start of a long recording are available after one
+    window. A rerun after an interruption resumes after the last checkpointed window.
+    Returns the features of the whole video, as extract_features does.
+    """
+    window_seconds = window_seconds or WINDOW_SECONDS
+    batch_size = max(1, batch_size or DEFAULT_BATCH_SIZE)
+    extractors, tracker, capture, fps, total_frames = _open(video_path, None, num_threads)
+    frames_per_window = max(1, int(round(window_seconds * fps)))
+    total_windows = max(1, math.ceil(total_frames / frames_per_window))
+    checkpoint_dir = window_dir(video_path, feature_dir)
+    windows, carry = _load_windows(checkpoint_dir, {
+        "analyzer_version": ANALYZER_VERSION, "window_seconds": window_seconds,
+        "fps": fps, "total_frames": total_frames, "carry_state": True,
+    })
+    try:
+        if windows:
+            capture.set(cv2.CAP_PROP_POS_FRAMES, len(windows) * frames_per_window)
+            _restore_carry_state(carry, extractors, tracker)
+            if on_window is not None:
+                on_window(windows, total_windows)
+        # A window shorter than frames_per_window is the end of the video
+        while not windows or len(windows[-1]["frame_index"]) == frames_per_window:
+            index, start_frame = len(windows), len(windows) * frames_per_window
+            message = f"Analyzing window {index + 1} of {total_windows}"
+            columns, frame_indices = _extract_pass(
+                capture, extractors, tracker, batch_size, max_frames=frames_per_window, timer=timer,
+                on_batch=None if progress is None else
+                lambda indices: progress(min((start_frame + indices[-1] + 1) / total_frames, 1.0), message),
+            )
+            if not frame_indices:
+                break
+            window = _assemble(columns, [indices + start_frame for indices in frame_indices], fps, total_frames)
+            path = os.path.join(checkpoint_dir, f"{index:05d}.npz")
+            np.savez_compressed(path + ".tmp.npz", **window, **_carry_state(extractors, tracker))
+            os.replace(path + ".tmp.npz", path)
+            windows.append(window)
+            if on_window is not None:
+                on_window(windows, total_windows)
+    finally:
+        capture.release()
+    if not windows:
+        return _assemble(_empty_columns(extractors), [], fps, total_frames)
+    return concat_features(windows)
+
+
+def clear_windows(video_filename, feature_dir=FEATURE_DIR):
+    """
+    Removes the window checkpoints of a video once its full feature file is saved.
+    """
+    shutil.rmtree(window_dir(video_filename, feature_dir), ignore_errors=True)
+
+
+def feature_path(video_filename, feature_dir=FEATURE_DIR, mode="full"):
+    video_id = os.path.splitext(os.path.basename(video_filename))[0]
+    suffix = "" if mode == "full" else f".{mode}"
+    return os.path.join(feature_dir, f"{video_id}{suffix}.npz")
+
+
+def save_features(video_filename, features, feature_dir=FEATURE_DIR, mode="full"):
+    """
+    Writes all columns of one video into a single compressed columnar .npz file.
+    Subsampled runs (mode "fast" or "keyframes") are kept next to the full-rate file.
+    """
+    os.makedirs(feature_dir, exist_ok=True)
+    path = feature_path(video_filename, feature_dir, mode)
+    tmp_path = path + ".tmp.npz"
+    np.savez_compressed(tmp_path, **features)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_features(video_filename, feature_dir=FEATURE_DIR, mode="full"):
+    """
+    Returns the stored feature columns of a video, or None if it has not been analyzed.
+    """
+    path = feature_path(video_filename, feature_dir, mode)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
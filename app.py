@@ -1,15 +1,29 @@
 import streamlit as st
 import json
-import pandas as pd
 import os
-import time
-from utils import get_user_videos, analyze_video, read_report_text, read_full_report
+from utils import get_user_videos, count_user_videos, generate_report, read_full_report
+from run_timings import RunTimer, query_runs
+from jobs import get_job_queue, start_workers, PRELOAD_MODELS, ACTIVE_STATES, DONE
+from uploads import store_upload
+from report_sink import save_report_row
+from media_server import media_url
+from access_map import access_map
+from metrics import start_flusher
+# renditions、streaming、va_plot、overlays 依赖 NumPy/OpenCV，在用到时才导入，
+# 首屏（登录页）不加载分析相关模块
 
 
 # =================== 页面设置 ====================
 # st.set_page_config(page_title="SCOPE: Cognitive State Analysis", layout="wide")
 st.set_page_config(page_title="SCOPE: Cognitive State Analysis", layout="centered")
 
+# 定期写出本进程的指标（/metrics 与 JSONL 导出）
+start_flusher()
+
+# SCOPE_PRELOAD_MODELS=1：启动时拉起分析进程并在其中预加载模型（每个进程一次，不阻塞页面）
+if PRELOAD_MODELS:
+    start_workers()
+
 # =================== 初始化状态 ====================
 if 'email' not in st.session_state:
     st.session_state.email = ""
@@ -19,8 +33,169 @@ if 'analyzed_video_path' not in st.session_state:
     st.session_state.analyzed_video_path = None
 if 'report_text' not in st.session_state:
     st.session_state.report_text = ""
+if 'report_placeholder' not in st.session_state:
+    st.session_state.report_placeholder = False
 if 'show_analysis_tabs' not in st.session_state:
     st.session_state.show_analysis_tabs = False
+if 'analysis_jobs' not in st.session_state:
+    st.session_state.analysis_jobs = {}
+if 'modality_cache' not in st.session_state:
+    st.session_state.modality_cache = {}
+# 视频列表按页加载
+VIDEO_PAGE_SIZE = 50
+# 预览生成失败后，这段时间内不再重新提交
+DERIVATIVES_RETRY_SECONDS = 600
+if 'video_list_limit' not in st.session_state:
+    st.session_state.video_list_limit = VIDEO_PAGE_SIZE
+
+# =================== 媒体地址 ====================
+def media_source(filename, video, version=None):
+    """
+    What st.video/st.image should load for a file of `video` in videos/: a signed
+    media-server URL (checked against the user's access), or the local file when the
+    browser cannot reach the media server.
+    """
+    url = media_url(filename, video, st.session_state.email, st.context.headers.get("Host"))
+    if url is None:
+        return os.path.join("videos", filename)
+    return f"{url}&v={version}" if version is not None else url
+
+# =================== 占位提取器的输出 ====================
+def is_placeholder(entry):
+    """
+    Whether a report entry was generated (it carries analyzer_version) while the
+    extractors are placeholders rather than trained models. Curated entries are not.
+    """
+    from analysis import uses_placeholders
+
+    return "analyzer_version" in entry and uses_placeholders()
+
+def placeholder_notice():
+    from report_synthesis import PLACEHOLDER_NOTICE
+
+    st.warning(PLACEHOLDER_NOTICE, icon="⚠️")
+
+# =================== 分析任务进度（轮询，不阻塞会话线程） ====================
+@st.fragment(run_every=1.0)
+def job_progress(job_id):
+    job = get_job_queue().status(job_id)
+    if job is None or job["status"] not in ACTIVE_STATES:
+        # 任务结束后刷新整个页面以显示结果
+        st.rerun()
+    else:
+        st.progress(job["progress"], text=job["message"] or job["status"].capitalize())
+
+# =================== 分析过程中的初步结果（按时间窗口增量更新） ====================
+@st.fragment(run_every=2.0)
+def preliminary_view(video, fast_job_id):
+    from streaming import load_partial
+    from analysis import uses_placeholders
+
+    partial = load_partial(video)
+    if partial is not None and uses_placeholders():
+        placeholder_notice()
+    if partial is not None:
+        # 已完成的时间窗口：滚动报告、VA 曲线和逐窗口统计
+        st.info(f"Partial result from {partial['completed']} of {partial['total']} windows. "
+                "It is updated as each window finishes.")
+        st.image(media_source(partial["va_plot"], video, version=partial["completed"]),
+                 caption="Valence-Arousal Over Time (so far)")
+        st.text_area("Running report", partial["report"]["text_report"], height=200)
+        st.dataframe(partial["windows"], hide_index=True)
+        return
+    fast_job = get_job_queue().status(fast_job_id)
+    if fast_job is not None and fast_job["status"] == DONE:
+        preliminary = generate_report(os.path.join("videos", video), mode="fast")
+        if is_placeholder(preliminary):
+            placeholder_notice()
+        sampling = preliminary.get("sampling", {})
+        st.info(f"Preliminary result from {sampling.get('frames_analyzed')} of "
+                f"{sampling.get('frames_total')} frames. It will be replaced by the full analysis when it finishes.")
+        st.markdown(f"**AU:** {preliminary.get('AU_report', '')}")
+        st.markdown(f"**VA:** {preliminary.get('VA_report', '')}")
+        st.markdown(f"**Eye Blink:** {preliminary.get('Eyeblink_report', '')}")
+        st.markdown(f"**Gaze:** {preliminary.get('Gaze_reprot', '')}")
+
+# =================== 分模态按需加载 ====================
+# 标题, 报告中的素材字段, 默认素材文件名, 报告字段, 无报告时的提示, 素材类型
+MODALITIES = {
+    "AU Analysis": ("#### Facial Action Unit (AU) Analysis", "AU_video", "{video_id}_AU.mp4",
+                    "AU_report", "No AU report available.", "video"),
+    "VA Plot": ("#### Valence-Arousal (VA) Analysis", "VA_plot", "{video_id}_VA_plot.png",
+                "VA_report", "No VA report available.", "image"),
+    "Eye Blink": ("#### Eye Blink Detection", "Eyeblink_video", "eyeblink_{video_id}.mp4",
+                  "Eyeblink_report", "No blink report available.", "video"),
+    "Gaze Tracking": ("#### Gaze Tracking", "Gaze_tracking", "gaze_{video_id}.mp4",
+                      "Gaze_reprot", "No gaze report available.", "video"),
+}
+# 浏览器端叠加层的类型
+OVERLAY_KINDS = {"AU Analysis": "au", "Eye Blink": "blink", "Gaze Tracking": "gaze"}
+
+def load_modality(video, modality):
+    """
+    Fetches one modality's artifact name and report text, memoized for this session.
+    """
+    from va_plot import va_plot_for
+    from overlays import overlay_for, load_track
+
+    key = (video, modality)
+    if key not in st.session_state.modality_cache:
+        _, artifact_field, default_artifact, report_field, no_report, kind = MODALITIES[modality]
+        video_report = read_full_report(video)
+        if not video_report:
+            # 没有存储的报告：由逐帧特征现场生成（占位提取器的结果只展示、不存储）
+            video_report = generate_report(os.path.join("videos", video))
+        artifact = video_report.get(artifact_field, default_artifact.format(video_id=video.split(".")[0]))
+        from_features = "analyzer_version" in video_report or not os.path.exists(f"videos/{artifact}")
+        if artifact_field == "VA_plot" and from_features:
+            # 由存储的逐帧特征绘制（有缓存）；人工整理的报告保留原图
+            artifact = va_plot_for(video) or artifact
+        # 视频模态：在原视频上由逐帧特征绘制叠加层，不再为每个模态编码一个视频
+        overlay = overlay_for(video) if kind == "video" and from_features else None
+        st.session_state.modality_cache[key] = {
+            "artifact": artifact if os.path.exists(f"videos/{artifact}") else None,
+            "overlay": load_track(overlay) if overlay else None,
+            "report": video_report.get(report_field, no_report),
+            "placeholder": is_placeholder(video_report),
+        }
+    return st.session_state.modality_cache[key]
+
+def forget_modalities(video):
+    for key in [k for k in st.session_state.modality_cache if k[0] == video]:
+        del st.session_state.modality_cache[key]
+
+@st.fragment
+def analysis_view(video):
+    from renditions import preview_for
+    from overlays import overlay_html, player_height
+
+    # 只渲染当前选中的模态；切换模态只重跑这个片段
+    modality = st.radio("Modality", list(MODALITIES), horizontal=True, label_visibility="collapsed")
+    title, _, _, _, _, kind = MODALITIES[modality]
+    loaded = load_modality(video, modality)
+    st.markdown(title)
+    if loaded["placeholder"]:
+        placeholder_notice()
+    if loaded["overlay"] is not None:
+        preview = preview_for(video)
+        source = preview if preview and not st.toggle("Full quality", key=f"full_quality_{video}_{modality}") else video
+        url = media_url(source, video, st.session_state.email, st.context.headers.get("Host"))
+        if url is None:
+            # 浏览器访问不到媒体服务器时无法叠加绘制，只播放原视频
+            st.video(os.path.join("videos", source))
+            st.caption("Overlays need the media server: set SCOPE_MEDIA_URL to the address the browser reaches it at.")
+        else:
+            st.iframe(overlay_html(url, loaded["overlay"], OVERLAY_KINDS[modality]),
+                      height=player_height(loaded["overlay"]))
+    elif loaded["artifact"] and kind == "video":
+        preview = preview_for(loaded["artifact"])
+        if preview and not st.toggle("Full quality", key=f"full_quality_{video}_{modality}"):
+            st.video(media_source(preview, video))
+        else:
+            st.video(media_source(loaded["artifact"], video))
+    elif loaded["artifact"]:
+        st.image(media_source(loaded["artifact"], video), caption="Valence-Arousal Over Time")
+    st.markdown(loaded["report"])
 
 # =================== 页面标题 ====================
 # st.title("SCOPE: Student Cognitive Observation and Perception for Extrapolation")
@@ -79,6 +254,8 @@ if 'uploaded_filename' not in st.session_state:
     st.session_state.uploaded_filename = None
 if 'upload_status' not in st.session_state:
     st.session_state.upload_status = ""
+if 'upload_duplicate' not in st.session_state:
+    st.session_state.upload_duplicate = False
 
 # =================== 上传区域始终可见 ====================
 # st.markdown("Upload a video for analysis")
@@ -86,96 +263,131 @@ if 'upload_status' not in st.session_state:
 uploaded_file = st.file_uploader("Choose a .mp4 file to upload", type=["mp4"], key="video_uploader")
 
 if uploaded_file is not None and st.session_state.uploaded_filename != uploaded_file.name:
-    # 保存上传文件
-    save_path = os.path.join("videos", uploaded_file.name)
-    with open(save_path, "wb") as f:
-        f.write(uploaded_file.getbuffer())
-    
-    # 设置上传状态
+    # 分块保存上传文件（按内容哈希命名，相同内容只保存一次）
+    stored_filename, _, is_duplicate = store_upload(uploaded_file, uploaded_file.name)
+    save_path = os.path.join("videos", stored_filename)
+
+    # 提交分析任务并设置上传状态（已分析过的相同视频直接复用结果）
     st.session_state.uploaded_filename = uploaded_file.name
-    st.session_state.upload_status = "waiting_for_gpu"
+    st.session_state.upload_duplicate = is_duplicate
+    if email:
+        # 上传者可以在自己的视频列表中看到该视频
+        access_map.grant(email, stored_filename, uploaded_file.name)
+    st.session_state.upload_job_id = get_job_queue().submit(save_path, reuse_done=True)
+    st.session_state.upload_status = "queued"
 
 # =================== 状态提示区 ====================
-if st.session_state.upload_status == "waiting_for_gpu":
-    st.markdown(""" Your video has been uploaded. We are currently waiting for GPU resource allocation. Please be patient...
-    """)
+if st.session_state.upload_status == "queued":
+    upload_job = get_job_queue().status(st.session_state.upload_job_id)
+    if st.session_state.upload_duplicate:
+        st.info(f"{st.session_state.uploaded_filename} has already been uploaded; the existing copy and analysis are reused.")
+    if upload_job is not None and upload_job["status"] in ACTIVE_STATES:
+        st.markdown(""" Your video has been uploaded and queued for analysis. You can keep using the app while it runs.
+        """)
+        job_progress(upload_job["id"])
+    elif upload_job is not None and upload_job["status"] == DONE:
+        st.success(f"Analysis of {st.session_state.uploaded_filename} is complete.")
+    else:
+        st.error(f"Analysis of {st.session_state.uploaded_filename} failed: {upload_job['error'] if upload_job else 'job not found'}")
 
 if email:
+    if st.session_state.email != email:
+        st.session_state.video_list_limit = VIDEO_PAGE_SIZE
     st.session_state.email = email
-    video_list = get_user_videos(email)
+    video_count = count_user_videos(email)
 
-    if not video_list:
+    if not video_count:
         st.warning("Use test@buffalo.edu to view a sample video. For more videos, please contact the admin.")
     else:
-        video_list_with_blank = [""] + video_list
-        selected_video = st.selectbox("Select a video", video_list)
+        # 只加载已展开的几页
+        video_list = get_user_videos(email, limit=st.session_state.video_list_limit)
+        # 上传的视频按内容哈希存储，列表中显示上传时的文件名
+        display_names = access_map.display_names(email)
+        selected_video = st.selectbox("Select a video", video_list,
+                                      format_func=lambda video: display_names.get(video, video))
+        if video_count > len(video_list):
+            st.caption(f"Showing {len(video_list)} of {video_count} videos.")
+            if st.button("Load more videos"):
+                st.session_state.video_list_limit += VIDEO_PAGE_SIZE
+                st.rerun()
 
         if selected_video:
+            from renditions import preview_for, sprite_path, derivative_sources
+
             st.session_state.selected_video = selected_video
             video_id = selected_video.split(".")[0]
             video_path = os.path.join("videos", selected_video)
-            st.video(video_path)
+            # 默认播放低码率预览，需要时再加载原始文件
+            preview = preview_for(selected_video)
+            full_quality = st.toggle("Full quality", key=f"full_quality_{selected_video}")
+            if preview and not full_quality:
+                st.video(media_source(preview, selected_video))
+            else:
+                st.video(media_source(selected_video, selected_video))
+            if os.path.exists(sprite_path(selected_video)):
+                st.image(media_source(os.path.relpath(sprite_path(selected_video), "videos"), selected_video))
+            # 源视频及其派生视频中有缺预览的就提交；派生视频列表变化时不复用旧任务
+            sources = derivative_sources(selected_video)
+            if any(preview_for(filename) is None for filename in sources):
+                get_job_queue().submit(video_path, reuse_done=True, retry_after=DERIVATIVES_RETRY_SECONDS,
+                                       task="derivatives", sources=sources)
 
             # Step 3: 分析按钮
             if st.button("Analyze Video"):
-                with st.spinner("Analyzing video..."):
-                    progress_bar = st.progress(0)
-                    for i in range(100):
-                        time.sleep(0.03)
-                        progress_bar.progress(i + 1)
-                    analyzed_video_path = analyze_video(video_path)
-                    st.session_state.analyzed_video_path = analyzed_video_path
+                # 同时提交快速预分析（抽帧）和按时间窗口的完整分析
+                st.session_state.analysis_jobs[selected_video] = {
+                    "fast": get_job_queue().submit(video_path, mode="fast"),
+                    "full": get_job_queue().submit(video_path, mode="stream"),
+                }
+
+            # 轮询分析任务状态，完成后显示结果
+            video_jobs = st.session_state.analysis_jobs.get(selected_video)
+            if video_jobs:
+                job = get_job_queue().status(video_jobs["full"])
+                if job is not None and job["status"] in ACTIVE_STATES:
+                    st.markdown("Analyzing video...")
+                    job_progress(job["id"])
+                    preliminary_view(selected_video, video_jobs["fast"])
+                elif job is not None and job["status"] == DONE:
+                    st.session_state.analyzed_video_path = job["result"]
                     st.session_state.show_analysis_tabs = True
-                st.success("Video analysis complete!")
+                    forget_modalities(selected_video)
+                    del st.session_state.analysis_jobs[selected_video]
+                    st.success("Video analysis complete!")
+                    last_runs = query_runs(kind="analyze.stream", video=selected_video, limit=1)
+                    if last_runs:
+                        with st.expander(f"Stage timings ({last_runs[0]['total_seconds']:.2f} s total)"):
+                            st.table({stage: f"{seconds * 1000:.1f} ms" for stage, seconds in last_runs[0]["stages"].items()})
+                else:
+                    del st.session_state.analysis_jobs[selected_video]
+                    st.error(f"Video analysis failed: {job['error'] if job else 'job not found'}")
 
-            # Step 3.5: Tabs 展示（改为动态读取 report.json 内容）
+            # Step 3.5: 分模态展示（按需加载，每次只渲染一个模态）
             if st.session_state.show_analysis_tabs:
                 st.markdown("### Choose a modality to explore detailed analysis:")
-                tabs = st.tabs(["AU Analysis", "VA Plot", "Eye Blink", "Gaze Tracking"])
-
-                video_report = read_full_report(st.session_state.selected_video)
-                video_id = st.session_state.selected_video.split(".")[0]
-
-                with tabs[0]:
-                    st.markdown("#### Facial Action Unit (AU) Analysis")
-                    au_video = video_report.get("AU_video", f"{video_id}_AU.mp4")
-                    au_report = video_report.get("AU_report", "No AU report available.")
-                    st.video(f"videos/{au_video}")
-                    st.markdown(au_report)
-
-                with tabs[1]:
-                    st.markdown("#### Valence-Arousal (VA) Analysis")
-                    va_plot = video_report.get("VA_plot", f"{video_id}_VA_plot.png")
-                    va_report = video_report.get("VA_report", "No VA report available.")
-                    st.image(f"videos/{va_plot}", caption="Valence-Arousal Over Time")
-                    st.markdown(va_report)
-
-                with tabs[2]:
-                    st.markdown("#### Eye Blink Detection")
-                    blink_video = video_report.get("Eyeblink_video", f"eyeblink_{video_id}.mp4")
-                    blink_report = video_report.get("Eyeblink_report", "No blink report available.")
-                    st.video(f"videos/{blink_video}")
-                    st.markdown(blink_report)
-
-                with tabs[3]:
-                    st.markdown("#### Gaze Tracking")
-                    gaze_video = video_report.get("Gaze_tracking", f"gaze_{video_id}.mp4")
-                    gaze_report = video_report.get("Gaze_reprot", "No gaze report available.")
-                    st.video(f"videos/{gaze_video}")
-                    st.markdown(gaze_report)
+                analysis_view(st.session_state.selected_video)
 
             # Step 4: 报告生成
             if st.button("Generate Report"):
                 with st.spinner("Generating report..."):
-                    progress_bar = st.progress(0)
-                    for i in range(100):
-                        time.sleep(0.01)
-                        progress_bar.progress(i + 1)
-                    report_text = read_report_text(st.session_state.selected_video)
+                    timer = RunTimer("generate_report", st.session_state.selected_video)
+                    with timer.stage("report_lookup"):
+                        # 没有存储的报告时由逐帧特征生成（占位数据，不可保存）
+                        entry = read_full_report(st.session_state.selected_video) or \
+                            generate_report(os.path.join("videos", st.session_state.selected_video))
+                    timer.save()
+                    report_text = entry.get("text_report", "No report found for this video.")
                     st.session_state.report_text = report_text
+                    st.session_state.report_placeholder = is_placeholder(entry)
 
                 st.success("✅ Report generated successfully!")
-      
+                st.caption(f"Report lookup took {timer.stages['report_lookup'] * 1000:.1f} ms")
+                if st.session_state.report_placeholder:
+                    from report_synthesis import PLACEHOLDER_NOTICE
+
+                    placeholder_notice()
+                    report_text = report_text.removeprefix(PLACEHOLDER_NOTICE).strip()
+
                 highlight_line = report_text.split('\n')[0].strip()
                 st.info(f"Here's the analysis summary below:\n\n**{highlight_line}**")
 
@@ -188,16 +400,16 @@ if email:
             if st.button("💾 Save Report to CSV"):
                 if not st.session_state.analyzed_video_path or not st.session_state.report_text:
                     st.error("Please analyze the video and generate the report before saving.")
+                elif st.session_state.report_placeholder:
+                    st.warning("This report comes from placeholder extractors, not trained models, and is not saved.")
                 else:
-                    df = pd.DataFrame([{
-                        "email": st.session_state.email,
-                        "original_video": st.session_state.selected_video,
-                        "analyzed_video": os.path.basename(st.session_state.analyzed_video_path),
-                        "report": st.session_state.report_text
-                    }])
-                    csv_path = "data/output_report.csv"
-                    if os.path.exists(csv_path):
-                        df.to_csv(csv_path, mode='a', header=False, index=False)
+                    saved = save_report_row(
+                        st.session_state.email,
+                        st.session_state.selected_video,
+                        os.path.basename(st.session_state.analyzed_video_path),
+                        st.session_state.report_text,
+                    )
+                    if saved:
+                        st.success("✅ Data saved successfully!")
                     else:
-                        df.to_csv(csv_path, index=False)
-                    st.success("✅ Data saved successfully!")
\ No newline at end of file
+                        st.info("This report has already been saved.")
\ No newline at end of file
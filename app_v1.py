@@ -3,8 +3,8 @@ import json
 import pandas as pd
 import os
 from utils import get_user_videos, analyze_video, generate_report
-import time
 from utils import read_report_text
+from run_timings import RunTimer
 
 st.set_page_config(page_title="Video Analysis and Report Generator", layout="centered")
 
@@ -35,21 +35,18 @@ if email:
         if st.button("Analyze Video"):
             with st.spinner("Analyzing video..."):
                 progress_bar = st.progress(0)
-                for i in range(100):
-                    time.sleep(0.01)  # total ~1 second
-                    progress_bar.progress(i + 1)
-                analyzed_video_path = analyze_video(video_path)
+                analyzed_video_path = analyze_video(
+                    video_path, progress=lambda fraction, message="": progress_bar.progress(fraction, text=message))
             st.success("Video analysis complete!")
             st.video(analyzed_video_path)
 
         # Step 4: Generate report
         if st.button("Generate Report"):
             with st.spinner("Generating report..."):
-                progress_bar = st.progress(0)
-                for i in range(100):
-                    time.sleep(0.01)
-                    progress_bar.progress(i + 1)
-                report_text = read_report_text(st.session_state.selected_video)
+                timer = RunTimer("generate_report", st.session_state.selected_video)
+                with timer.stage("report_lookup"):
+                    report_text = read_report_text(st.session_state.selected_video)
+                timer.save()
 
             st.success("✅ Report generated successfully!")
             st.info("🧾 Here's the analysis summary below:")
@@ -2,8 +2,8 @@ import streamlit as st
 import json
 import pandas as pd
 import os
-import time
 from utils import get_user_videos, analyze_video, read_report_text
+from run_timings import RunTimer
 
 # =================== 页面设置 ====================
 st.set_page_config(page_title="Video Analysis and Report Generator", layout="wide")
@@ -82,10 +82,8 @@ if email:
             if st.button("Analyze Video"):
                 with st.spinner("Analyzing video..."):
                     progress_bar = st.progress(0)
-                    for i in range(100):
-                        time.sleep(0.03)
-                        progress_bar.progress(i + 1)
-                    analyzed_video_path = analyze_video(video_path)
+                    analyzed_video_path = analyze_video(
+                        video_path, progress=lambda fraction, message="": progress_bar.progress(fraction, text=message))
                     st.session_state.analyzed_video_path = analyzed_video_path
                 st.success("Video analysis complete!")
 
@@ -133,11 +131,10 @@ Brief glances away occurred during quiz segments, possibly reflecting momentary
             # ========== Step 4: 生成报告 ==========
             if st.button("Generate Report"):
                 with st.spinner("Generating report..."):
-                    progress_bar = st.progress(0)
-                    for i in range(100):
-                        time.sleep(0.01)
-                        progress_bar.progress(i + 1)
-                    report_text = read_report_text(st.session_state.selected_video)
+                    timer = RunTimer("generate_report", st.session_state.selected_video)
+                    with timer.stage("report_lookup"):
+                        report_text = read_report_text(st.session_state.selected_video)
+                    timer.save()
                     st.session_state.report_text = report_text
 
                 st.success("✅ Report generated successfully!")
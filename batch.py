@@ -0,0 +1,124 @@
+"""
+Headless batch analysis of many videos over a process pool.
+
+    python batch.py --user ludong@buffalo.edu
+    python batch.py videos/1100021003.mp4 videos/4100321001.mp4 --workers 4
+
+Every video gets a job in the job store, so a batch that crashes can simply be
+started again: videos with a finished full analysis are skipped and the batch's own
+interrupted jobs are re-run. Jobs a running server (or another batch) is still working
+on are left to it.
+"""
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from jobs import JobStore, run_job, ACTIVE_STATES, DONE, STALE_SECONDS
+
+VIDEO_DIR = "videos"
+# Job params of a full-rate analysis: the batch's own jobs, and the app's streaming
+# analysis, which stores the same result. Fast, keyframe and derivatives jobs are not.
+FULL_ANALYSIS_PARAMS = ({}, {"mode": "stream"})
+
+
+def _init_worker(num_threads):
+    # One OpenCV thread per process: the pool provides the parallelism
+    import cv2
+    from analysis import warm_up
+
+    cv2.setNumThreads(num_threads)
+    try:
+        warm_up()
+    except Exception as e:
+        # An exception here would break the whole pool; the first job reports it instead
+        print(f"Model preload failed, models load on first use: {type(e).__name__}: {e}", file=sys.stderr)
+
+
+def _run(job_id, video_path, db_path):
+    start = time.perf_counter()
+    run_job(job_id, video_path, {}, db_path)
+    return job_id, video_path, time.perf_counter() - start
+
+
+def resolve_videos(videos=None, user=None):
+    """
+    Returns the video paths to analyze: explicit paths/filenames, or all videos
+    assigned to a user in data/user_videos.json.
+    """
+    paths = []
+    if user:
+        from utils import get_user_videos
+        paths.extend(os.path.join(VIDEO_DIR, name) for name in get_user_videos(user))
+    for video in videos or []:
+        paths.append(video if os.path.dirname(video) else os.path.join(VIDEO_DIR, video))
+    # Keep order, drop duplicates (several users can share a video)
+    return list(dict.fromkeys(paths))
+
+
+def run_batch(video_paths, workers=None, num_threads=1, store=None, on_result=None):
+    """
+    Analyzes video_paths on a pool of worker processes and yields
+    (video_path, status, seconds) in completion order. Videos with a finished full
+    analysis are "skipped" and those another process is analyzing right now are
+    "active"; the batch's own jobs left queued or running by a crash are re-run.
+    """
+    store = store or JobStore()
+    pending = []
+    for video_path in video_paths:
+        if any(store.find(video_path, (DONE,), params) is not None for params in FULL_ANALYSIS_PARAMS):
+            yield video_path, "skipped", 0.0
+            continue
+        active = [job for job in (store.find(video_path, ACTIVE_STATES, params) for params in FULL_ANALYSIS_PARAMS)
+                  if job is not None]
+        if any(time.time() - job["updated_at"] < STALE_SECONDS for job in active):
+            yield video_path, "active", 0.0
+            continue
+        stale = next((job for job in active if job["params"] == {}), None)
+        if stale is not None:
+            store.requeue(stale["id"], "Resumed by batch")
+            pending.append((stale["id"], video_path))
+        else:
+            pending.append((store.create(video_path), video_path))
+    if not pending:
+        return
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(
+        max_workers=min(workers, len(pending)),
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(num_threads,),
+    ) as pool:
+        futures = [pool.submit(_run, job_id, video_path, store.db_path) for job_id, video_path in pending]
+        for future in as_completed(futures):
+            job_id, video_path, seconds = future.result()
+            yield video_path, store.get(job_id)["status"], seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("videos", nargs="*", help="video paths or filenames in videos/")
+    parser.add_argument("--user", help="analyze every video assigned to this email")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--threads", type=int, default=1, help="OpenCV threads per worker")
+    args = parser.parse_args()
+
+    video_paths = resolve_videos(args.videos, args.user)
+    if not video_paths:
+        parser.error("no videos given (pass video paths or --user)")
+
+    start = time.perf_counter()
+    analyzed = 0
+    for video_path, status, seconds in run_batch(video_paths, args.workers, args.threads):
+        analyzed += status == DONE
+        print(f"{status:>8}  {seconds:6.2f}s  {video_path}", flush=True)
+    elapsed = time.perf_counter() - start
+    print(f"{analyzed} videos analyzed in {elapsed:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
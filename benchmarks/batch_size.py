@@ -0,0 +1,124 @@
+"""
+Frames/sec of the feature extractors against batch size on the sample videos.
+
+    python benchmarks/batch_size.py --batch-sizes 1 8 32 64 --threads 1
+
+Frames are decoded once up front so the numbers measure extractor throughput only;
+the end-to-end column also includes decoding. Face localization is reported first:
+the cost of one detector call and of detection plus tracking per frame for several
+--detect-every values (with the fixed-box fallback every frame is a detection).
+"""
+import os
+import re
+import sys
+import time
+import argparse
+
+import numpy as np
+import cv2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from analysis import EXTRACTORS, FACE_BOX, iter_frame_batches, run_extractors, extract_features  # noqa: E402
+from face_tracking import FaceTracker, get_detector  # noqa: E402
+
+# Original recordings only, not the derived *_AU / eyeblink_ / gaze_ renders
+SOURCE_VIDEO = re.compile(r"^\d+(_L\d+)?\.mp4$")
+
+
+def decode_all(video_path):
+    capture = cv2.VideoCapture(video_path)
+    try:
+        _, frames, grays = zip(*iter_frame_batches(capture, 1))
+    finally:
+        capture.release()
+    grays = np.concatenate(grays)
+    faces, _ = FaceTracker(FACE_BOX).crops(grays)
+    return np.concatenate(frames), grays, faces
+
+
+def detector_ms(detector, grays, repeat):
+    """
+    Milliseconds per frame of one detector call.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for gray in grays:
+            detector.detect(gray)
+        best = min(best, time.perf_counter() - start)
+    return best / len(grays) * 1000
+
+
+def localization_ms(grays, detect_every, repeat):
+    """
+    Milliseconds per frame of detection plus tracking plus cropping, and the share
+    of frames on which the detector ran.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        tracker = FaceTracker(FACE_BOX, detect_every=detect_every)
+        start = time.perf_counter()
+        tracker.crops(grays)
+        best = min(best, time.perf_counter() - start)
+    return best / len(grays) * 1000, tracker.detections / len(grays)
+
+
+def extractor_fps(frames, grays, faces, batch_size, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        extractors = [cls() for cls in EXTRACTORS.values()]
+        for extractor in extractors:
+            extractor.reset(30.0)
+        columns = {f"{e.name}.{c}": [] for e in extractors for c in e.columns}
+        start = time.perf_counter()
+        for i in range(0, len(frames), batch_size):
+            run_extractors(extractors, frames[i:i + batch_size], grays[i:i + batch_size],
+                           faces[i:i + batch_size], columns)
+        best = min(best, time.perf_counter() - start)
+    return len(frames) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--videos-dir", default="videos")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8, 16, 32, 64, 128])
+    parser.add_argument("--detect-every", type=int, nargs="+", default=[1, 5, 10, 30])
+    parser.add_argument("--threads", type=int, default=0, help="OpenCV threads (0 = library default)")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.threads > 0:
+        cv2.setNumThreads(args.threads)
+    videos = sorted(f for f in os.listdir(args.videos_dir) if SOURCE_VIDEO.match(f))
+    decoded = [decode_all(os.path.join(args.videos_dir, v)) for v in videos]
+    total_frames = sum(len(frames) for frames, _, _ in decoded)
+    print(f"{len(videos)} videos, {total_frames} frames, OpenCV threads: {cv2.getNumThreads()}")
+
+    all_grays = [grays for _, grays, _ in decoded]
+    detector = get_detector(FACE_BOX)
+    detect_cost = sum(detector_ms(detector, grays, args.repeat) * len(grays) for grays in all_grays) / total_frames
+    print(f"Face detector: {detector.name}, {detect_cost:.3f} ms/frame")
+    print(f"{'detect every':>12} {'localize ms/frame':>18} {'detector runs':>14}")
+    for detect_every in args.detect_every:
+        costs = [localization_ms(grays, detect_every, args.repeat) for grays in all_grays]
+        ms = sum(c[0] * len(g) for c, g in zip(costs, all_grays)) / total_frames
+        runs = sum(c[1] * len(g) for c, g in zip(costs, all_grays)) / total_frames
+        print(f"{detect_every:>12} {ms:>18.3f} {runs:>13.0%}")
+    print()
+
+    print(f"{'batch':>6} {'extract fps':>12} {'end-to-end fps':>15}")
+
+    for batch_size in args.batch_sizes:
+        rates = [extractor_fps(frames, grays, faces, batch_size, args.repeat) for frames, grays, faces in decoded]
+        weights = [len(frames) for frames, _, _ in decoded]
+        extract_rate = total_frames / sum(w / r for w, r in zip(weights, rates))
+
+        start = time.perf_counter()
+        for video in videos:
+            extract_features(os.path.join(args.videos_dir, video), batch_size=batch_size)
+        end_to_end_rate = total_frames / (time.perf_counter() - start)
+        print(f"{batch_size:>6} {extract_rate:>12.1f} {end_to_end_rate:>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
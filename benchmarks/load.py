@@ -0,0 +1,199 @@
+"""
+Headless load test of the Streamlit app: N concurrent sessions, each driven through
+login, video selection, analysis, report generation and CSV save with Streamlit's
+testing harness (streamlit.testing.v1.AppTest).
+
+    python benchmarks/load.py --sessions 8
+    python benchmarks/load.py --sessions 8 --save-baseline
+
+The app runs against a scratch copy of the working tree (code and videos linked,
+data/report.json and data/user_videos.json copied) so the load test never writes to
+the real report store or output CSV. Sessions analyze the sample videos round-robin,
+so with more sessions than videos later ones hit the result cache. Results go to
+data/benchmarks/load.json with p50/p95/p99 latency per step and are compared against
+the stored baseline; the exit status is 1 if anything regressed.
+
+AppTest parses the script again on every run and CPython's parser is not safe to
+call from several threads at once, so the script reruns of different sessions take
+turns (time spent waiting counts towards the step). The analysis jobs they submit
+run concurrently in the job workers, as on a live server.
+"""
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from results import summarize, write_results, update_baseline, report, BASELINE_PATH, TOLERANCE  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OUTPUT_PATH = os.path.join(ROOT, "data", "benchmarks", "load.json")
+STEPS = ("login", "select", "analyze", "generate", "save")
+# Original recordings only, not the derived *_AU / eyeblink_ / gaze_ renders
+SOURCE_VIDEO = re.compile(r"^\d+(_L\d+)?\.mp4$")
+
+_rerun_lock = threading.Lock()
+
+
+def scratch_tree(directory, emails, videos):
+    """
+    Links the app's code and source videos into directory and gives every load-test
+    user access to every video. Returns the path of the app script there.
+    """
+    for name in os.listdir(ROOT):
+        if name.endswith(".py") or name == "pages":
+            os.symlink(os.path.join(ROOT, name), os.path.join(directory, name))
+    os.makedirs(os.path.join(directory, "data"))
+    os.makedirs(os.path.join(directory, "videos"))
+    for name in ("report.json", "user_videos.json"):
+        shutil.copy2(os.path.join(ROOT, "data", name), os.path.join(directory, "data", name))
+    for name in os.listdir(os.path.join(ROOT, "videos")):
+        if os.path.isfile(os.path.join(ROOT, "videos", name)):
+            os.symlink(os.path.join(ROOT, "videos", name), os.path.join(directory, "videos", name))
+    users_path = os.path.join(directory, "data", "user_videos.json")
+    with open(users_path, "r") as f:
+        users = json.load(f)
+    users.update({email: list(videos) for email in emails})
+    with open(users_path, "w") as f:
+        json.dump(users, f)
+    return os.path.join(directory, "app.py")
+
+
+def _button(at, label):
+    return next(button for button in at.button if button.label == label)
+
+
+def _check(at, step):
+    if len(at.exception):
+        raise RuntimeError(f"{step}: {at.exception[0].value}")
+    if len(at.error):
+        raise RuntimeError(f"{step}: {at.error[0].value}")
+
+
+def run_session(app_path, email, video, timeout, poll_seconds):
+    """
+    One user's visit. Returns {step: seconds} for the steps it completed.
+    """
+    from streamlit.testing.v1 import AppTest
+
+    timings = {}
+
+    def rerun(action):
+        with _rerun_lock:
+            return action()
+
+    def step(name, action):
+        start = time.perf_counter()
+        result = action()
+        timings[name] = time.perf_counter() - start
+        _check(result, name)
+        return result
+
+    at = AppTest.from_file(app_path, default_timeout=timeout)
+    rerun(at.run)
+    step("login", lambda: rerun(lambda: at.text_input[0].input(email).run()))
+    step("select", lambda: rerun(lambda: at.selectbox[0].set_value(video).run()))
+
+    def analyze():
+        rerun(lambda: _button(at, "Analyze Video").click().run())
+        deadline = time.perf_counter() + timeout
+        while not any("analysis complete" in s.value.lower() for s in at.success):
+            if time.perf_counter() > deadline:
+                raise TimeoutError(f"analyze: no result after {timeout} s")
+            _check(at, "analyze")
+            time.sleep(poll_seconds)
+            rerun(at.run)
+        return at
+
+    step("analyze", analyze)
+    step("generate", lambda: rerun(lambda: _button(at, "Generate Report").click().run()))
+    step("save", lambda: rerun(lambda: _button(at, "💾 Save Report to CSV").click().run()))
+    return timings
+
+
+def wait_for_jobs(timeout):
+    """
+    Waits for the jobs the sessions queued in the background (e.g. preview
+    renditions) to finish, so the scratch tree is not removed under them.
+    """
+    from jobs import JobStore, ACTIVE_STATES
+
+    store = JobStore()
+    deadline = time.perf_counter() + timeout
+    while store.list(ACTIVE_STATES) and time.perf_counter() < deadline:
+        time.sleep(0.5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=4, help="concurrent app sessions")
+    parser.add_argument("--timeout", type=float, default=300.0, help="seconds per step")
+    parser.add_argument("--poll", type=float, default=0.5, help="seconds between reruns while analysis runs")
+    parser.add_argument("--output", default=OUTPUT_PATH)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch tree for inspection")
+    args = parser.parse_args()
+
+    videos = sorted(f for f in os.listdir(os.path.join(ROOT, "videos")) if SOURCE_VIDEO.match(f))
+    emails = [f"load{i}@bench.edu" for i in range(args.sessions)]
+    directory = tempfile.mkdtemp(prefix="scope-load-")
+    app_path = scratch_tree(directory, emails, videos)
+    # The app resolves data/ and videos/ relative to the working directory
+    os.chdir(directory)
+    sys.path.insert(0, directory)
+
+    timings, failures = [], []
+    lock = threading.Lock()
+
+    def worker(i):
+        try:
+            result = run_session(app_path, emails[i], videos[i % len(videos)], args.timeout, args.poll)
+            error = None
+        except Exception as e:
+            result, error = {}, f"session {i}: {e}"
+        with lock:
+            timings.append(result)
+            if error:
+                failures.append(error)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(args.sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    suffix = f"[sessions={args.sessions}]"
+    results = {
+        f"load.{name}{suffix}": summarize([t[name] for t in timings if name in t])
+        for name in STEPS
+    }
+    completed = [sum(t.values()) for t in timings if len(t) == len(STEPS)]
+    results[f"load.session{suffix}"] = summarize(completed, total_seconds=wall)
+    wait_for_jobs(args.timeout)
+    os.chdir(ROOT)
+    if not args.keep:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    write_results(args.output, results, benchmark="load", sessions=args.sessions, wall_seconds=round(wall, 2),
+                  failures=failures, videos=videos)
+    print(f"{len(completed)} of {args.sessions} sessions completed in {wall:.1f} s; results written to {args.output}")
+    for failure in failures:
+        print(f"  FAILED {failure}")
+    print()
+    regressions = report(results, args.baseline, args.tolerance)
+    if args.save_baseline:
+        print(f"Baseline updated: {update_baseline(results, args.baseline)}")
+    sys.exit(1 if failures or (regressions and not args.save_baseline) else 0)
+
+
+if __name__ == "__main__":
+    main()
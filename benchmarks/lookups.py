@@ -0,0 +1,141 @@
+"""
+Micro-benchmarks of the report and user lookups and of CSV report saving.
+
+    python benchmarks/lookups.py --sizes 10 1000 100000
+    python benchmarks/lookups.py --save-baseline      # store this run as benchmarks/baseline.json
+
+For every size a synthetic report.json with that many entries (cloned from
+data/report.json) and a matching user_videos.json are written to a scratch directory
+and imported into fresh stores. Timed: the first open (legacy JSON import),
+read_full_report and get_user_videos (a full list and the app's first page).
+save_report_row is timed on a scratch CSV, for new and for duplicate rows.
+Every benchmark runs --rounds times and the fastest round is kept.
+Results go to data/benchmarks/lookups.json with p50/p95/p99 latencies, and are
+compared against the stored baseline; the exit status is 1 if anything regressed.
+"""
+import os
+import sys
+import json
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import utils  # noqa: E402
+from report_store import ReportDB  # noqa: E402
+from access_map import AccessMap  # noqa: E402
+from report_sink import ReportSink  # noqa: E402
+from results import (  # noqa: E402
+    summarize, time_calls, best_of, write_results, update_baseline, report, BASELINE_PATH, TOLERANCE,
+)
+
+OUTPUT_PATH = "data/benchmarks/lookups.json"
+# Users that see every video, as a teacher of the whole cohort would
+HEAVY_USER = "teacher@bench.edu"
+VIDEOS_PER_USER = 10
+PAGE_SIZE = 50
+# Untimed calls before each lookup benchmark (connections, page cache)
+WARMUP_CALLS = 50
+# Fresh stores opened per size for the first-open benchmarks, fewer for large sizes
+OPEN_REPEATS = 5
+
+
+def synthetic_corpus(directory, size, template):
+    """
+    Writes report.json and user_videos.json with `size` videos. Every video belongs to
+    one student account (VIDEOS_PER_USER videos each) and to HEAVY_USER.
+    """
+    videos = [f"{1000000 + i // VIDEOS_PER_USER:07d}{i % VIDEOS_PER_USER:03d}.mp4" for i in range(size)]
+    reports = {video: dict(template, text_report=f"{template.get('text_report', '')} #{i}")
+               for i, video in enumerate(videos)}
+    users = {HEAVY_USER: list(videos)}
+    for i, video in enumerate(videos):
+        users.setdefault(f"student{i // VIDEOS_PER_USER}@bench.edu", []).append(video)
+    report_path = os.path.join(directory, "report.json")
+    users_path = os.path.join(directory, "user_videos.json")
+    with open(report_path, "w") as f:
+        json.dump(reports, f)
+    with open(users_path, "w") as f:
+        json.dump(users, f)
+    return videos, sorted(users), report_path, users_path
+
+
+def bench_lookups(directory, size, lookups, template, rng):
+    videos, users, report_path, users_path = synthetic_corpus(directory, size, template)
+    open_reports, open_access = [], []
+    for i in range(max(1, min(OPEN_REPEATS, 100000 // max(size, 1) // 20))):
+        utils.report_db = ReportDB(os.path.join(directory, f"reports{i}.db"), legacy_json=report_path)
+        utils.access_map = AccessMap(os.path.join(directory, f"access{i}.db"), legacy_json=users_path)
+        open_reports += time_calls(len, [(utils.report_db,)])
+        open_access += time_calls(utils.access_map.count_videos, [(HEAVY_USER,)])
+    results = {
+        f"open_reports[n={size}]": summarize(open_reports),
+        f"open_access[n={size}]": summarize(open_access),
+    }
+    students = [user for user in users if user != HEAVY_USER]
+    video_sample = [(rng.choice(videos),) for _ in range(lookups)]
+    student_sample = [(rng.choice(students),) for _ in range(lookups)]
+    results[f"read_full_report[n={size}]"] = summarize(
+        time_calls(utils.read_full_report, video_sample, WARMUP_CALLS))
+    results[f"get_user_videos[n={size}]"] = summarize(
+        time_calls(utils.get_user_videos, student_sample, WARMUP_CALLS))
+    results[f"get_user_videos.all[n={size}]"] = summarize(
+        time_calls(utils.get_user_videos, [(HEAVY_USER,)] * max(1, lookups // 20), 5))
+    results[f"get_user_videos.page[n={size}]"] = summarize(
+        time_calls(lambda email: utils.get_user_videos(email, 0, PAGE_SIZE), [(HEAVY_USER,)] * lookups,
+                   WARMUP_CALLS))
+    return results
+
+
+def bench_csv(directory, rows, template):
+    sink = ReportSink(os.path.join(directory, "output_report.csv"), os.path.join(directory, "output_report.parquet"),
+                      compact_every=rows + 1)
+    text = template.get("text_report", "report")
+    new_rows = [(f"student{i % 100}@bench.edu", f"{i:010d}.mp4", f"{i:010d}.mp4", f"{text} #{i}")
+                for i in range(rows)]
+    new = time_calls(sink.append, new_rows)
+    duplicate = time_calls(sink.append, new_rows[:max(1, rows // 10)])
+    return {
+        f"save_report.new[rows={rows}]": summarize(new),
+        f"save_report.duplicate[rows={rows}]": summarize(duplicate),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 100000])
+    parser.add_argument("--lookups", type=int, default=2000, help="timed calls per lookup benchmark")
+    parser.add_argument("--csv-rows", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=OUTPUT_PATH)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument("--save-baseline", action="store_true")
+    args = parser.parse_args()
+
+    with open("data/report.json", "r") as f:
+        template = next(iter(json.load(f).values()))
+    rng = random.Random(args.seed)
+    rounds = []
+    for _ in range(max(1, args.rounds)):
+        results = {}
+        for size in args.sizes:
+            with tempfile.TemporaryDirectory(prefix="scope-bench-") as directory:
+                results.update(bench_lookups(directory, size, args.lookups, template, rng))
+        with tempfile.TemporaryDirectory(prefix="scope-bench-") as directory:
+            results.update(bench_csv(directory, args.csv_rows, template))
+        rounds.append(results)
+    results = best_of(rounds)
+
+    write_results(args.output, results, benchmark="lookups", sizes=args.sizes, lookups=args.lookups,
+                  rounds=args.rounds)
+    print(f"Results written to {args.output}\n")
+    regressions = report(results, args.baseline, args.tolerance)
+    if args.save_baseline:
+        print(f"Baseline updated: {update_baseline(results, args.baseline)}")
+    sys.exit(1 if regressions and not args.save_baseline else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Latency summaries, JSON result files and baseline comparison shared by the benchmarks.
+
+A result file maps benchmark names to summaries:
+
+    {"meta": {...}, "results": {"read_full_report[n=1000]": {"p50_ms": ..., "p95_ms": ..., ...}}}
+
+compare() checks the p50/p95/p99 latencies (and throughputs) of a run against a stored
+baseline of the same shape. A benchmark regressed when a GATED_KEYS metric got worse
+by more than a tolerance (and by more than MIN_DELTA_MS).
+"""
+import os
+import sys
+import json
+import time
+import platform
+
+import numpy as np
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+# Default regression threshold, as a fraction of the baseline value
+TOLERANCE = 0.25
+# Latency changes smaller than this are timer and scheduler noise, whatever their ratio
+MIN_DELTA_MS = 0.05
+LATENCY_KEYS = ("p50_ms", "p95_ms", "p99_ms")
+THROUGHPUT_KEYS = ("per_second",)
+# Metrics that count as regressions; tail percentiles and throughput are compared and
+# shown but too sensitive to the rest of the machine to fail a run on
+GATED_KEYS = ("p50_ms",)
+
+
+def summarize(seconds, total_seconds=None):
+    """
+    p50/p95/p99/mean/max latency in milliseconds of a list of per-call durations,
+    plus calls per second over total_seconds (the sum of the durations by default).
+    """
+    samples = np.asarray(seconds, dtype=np.float64) * 1000
+    if not len(samples):
+        return {"count": 0}
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    total = total_seconds if total_seconds is not None else samples.sum() / 1000
+    return {
+        "count": int(len(samples)),
+        "p50_ms": round(float(p50), 4),
+        "p95_ms": round(float(p95), 4),
+        "p99_ms": round(float(p99), 4),
+        "mean_ms": round(float(samples.mean()), 4),
+        "max_ms": round(float(samples.max()), 4),
+        "per_second": round(len(samples) / total, 1) if total > 0 else None,
+    }
+
+
+def time_calls(function, arguments, warmup=0):
+    """
+    Calls function(*args) for every args tuple and returns the per-call durations in
+    seconds. The first `warmup` calls are made but not timed.
+    """
+    arguments = list(arguments)
+    for args in arguments[:warmup]:
+        function(*args)
+    durations = []
+    for args in arguments:
+        start = time.perf_counter()
+        function(*args)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def best_of(rounds):
+    """
+    Merges the results of repeated rounds, keeping for every benchmark the round with
+    the lowest p50: like timeit, the fastest round is the least disturbed by the rest
+    of the machine, which keeps baseline comparisons stable.
+    """
+    best = {}
+    for results in rounds:
+        for name, summary in results.items():
+            if name not in best or summary.get("p50_ms", 0) < best[name].get("p50_ms", 0):
+                best[name] = summary
+    return best
+
+
+def write_results(path, results, **meta):
+    meta.update({
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "argv": sys.argv[1:],
+    })
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=2)
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def load_results(path):
+    with open(path, "r") as f:
+        return json.load(f)["results"]
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """
+    Rows of (benchmark, metric, baseline, current, change) for every metric present
+    in both, and the list of gated ones that regressed by more than tolerance.
+    """
+    rows, regressions = [], []
+    for name, summary in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for key in LATENCY_KEYS + THROUGHPUT_KEYS:
+            if not summary.get(key) or not base.get(key):
+                continue
+            change = summary[key] / base[key] - 1
+            row = (name, key, base[key], summary[key], change)
+            rows.append(row)
+            # Latency regresses upwards, throughput downwards
+            if key in LATENCY_KEYS:
+                worse = change if summary[key] - base[key] > MIN_DELTA_MS else 0.0
+            else:
+                worse = -change if 1 / summary[key] - 1 / base[key] > MIN_DELTA_MS / 1000 else 0.0
+            if key in GATED_KEYS and worse > tolerance:
+                regressions.append(row)
+    return rows, regressions
+
+
+def update_baseline(results, path=BASELINE_PATH):
+    """
+    Merges a run's results into the stored baseline (other benchmarks are kept).
+    """
+    baseline = load_results(path) if os.path.exists(path) else {}
+    baseline.update(results)
+    return write_results(path, baseline)
+
+
+def report(results, baseline_path=BASELINE_PATH, tolerance=TOLERANCE):
+    """
+    Prints the run's summaries and its comparison against the baseline.
+    Returns the number of regressions.
+    """
+    print(f"{'benchmark':<44} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'per s':>10}")
+    for name, summary in results.items():
+        print(f"{name:<44} {summary.get('p50_ms', 0):>10.3f} {summary.get('p95_ms', 0):>10.3f} "
+              f"{summary.get('p99_ms', 0):>10.3f} {summary.get('per_second') or 0:>10.1f}")
+    if not os.path.exists(baseline_path):
+        print(f"No baseline at {baseline_path}; run with --save-baseline to store one.")
+        return 0
+    rows, regressions = compare(results, load_results(baseline_path), tolerance)
+    if rows:
+        print(f"\nAgainst baseline {baseline_path} (tolerance {tolerance:.0%}):")
+        for name, key, base, current, change in rows:
+            flag = "  REGRESSION" if (name, key, base, current, change) in regressions else ""
+            print(f"{name:<44} {key:<12} {base:>10.3f} -> {current:>10.3f} ({change:+.1%}){flag}")
+    return len(regressions)
@@ -0,0 +1,170 @@
+"""
+Cold-start report: how long a fresh server process takes to show the first page, and
+how long the first analysis takes with a cold and with a warm worker pool.
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --runs 5 --save-baseline
+
+Every measurement runs in a fresh interpreter against a scratch copy of the working
+tree (see load.py), so nothing is imported or cached from an earlier run:
+
+  startup.import[app]        importing the modules app.py imports at top level
+  startup.first_page         the first run of app.py (the login page) under AppTest
+  startup.first_page[preload]  the same with SCOPE_PRELOAD_MODELS=1
+  startup.first_job[cold]    submit to done of a fast analysis, workers not started
+  startup.first_job[warm]    the same after LocalWorkers.start() with preload
+
+The slowest top-level imports (python -X importtime) are listed as well. Results go
+to data/benchmarks/startup.json and are compared against the stored baseline; the
+exit status is 1 if anything regressed or the first page took over FIRST_PAGE_BUDGET_MS.
+"""
+import os
+import re
+import ast
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from results import summarize, write_results, update_baseline, report, BASELINE_PATH, TOLERANCE  # noqa: E402
+from load import ROOT, SOURCE_VIDEO, scratch_tree  # noqa: E402
+
+OUTPUT_PATH = os.path.join(ROOT, "data", "benchmarks", "startup.json")
+FIRST_PAGE_BUDGET_MS = 1000
+SLOWEST_IMPORTS = 10
+
+_FIRST_PAGE = """
+import json, time
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file("app.py", default_timeout=120)
+start = time.perf_counter()
+at.run()
+print(json.dumps({"seconds": time.perf_counter() - start, "errors": [str(e.value) for e in at.exception]}))
+"""
+
+_FIRST_JOB = """
+import sys, json, time
+from jobs import JobQueue, JobStore, LocalWorkers, DONE, ACTIVE_STATES
+
+if __name__ == "__main__":
+    warm = sys.argv[1] == "warm"
+    queue = JobQueue(JobStore(), LocalWorkers(max_workers=1, preload=warm))
+    if warm:
+        queue.workers.start(block=True)
+    start = time.perf_counter()
+    job_id = queue.submit(sys.argv[2], mode="fast")
+    while queue.status(job_id)["status"] in ACTIVE_STATES:
+        time.sleep(0.02)
+    job = queue.status(job_id)
+    print(json.dumps({"seconds": time.perf_counter() - start, "errors": [] if job["status"] == DONE else [job["error"]]}))
+    queue.workers.shutdown()
+"""
+
+
+def app_imports():
+    """
+    Top-level modules app.py imports, in order.
+    """
+    with open(os.path.join(ROOT, "app.py"), "r") as f:
+        tree = ast.parse(f.read())
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            modules.append(node.module)
+    return list(dict.fromkeys(modules))
+
+
+def run_fresh(directory, code, *args, env=None, timeout=600):
+    """
+    Runs code in a fresh interpreter in directory; returns its stdout and stderr.
+    """
+    result = subprocess.run([sys.executable, *code, *args], cwd=directory, capture_output=True, text=True,
+                            timeout=timeout, env=dict(os.environ, PYTHONPATH=directory, **(env or {})))
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "failed")
+    return result.stdout, result.stderr
+
+
+def measured(directory, code, *args, env=None):
+    stdout, _ = run_fresh(directory, code, *args, env=env)
+    outcome = json.loads(stdout.strip().splitlines()[-1])
+    if outcome["errors"]:
+        raise RuntimeError(outcome["errors"][0])
+    return outcome["seconds"]
+
+
+def import_times(directory, modules):
+    """
+    Seconds to import modules, and the slowest top-level imports as (module, seconds).
+    """
+    _, stderr = run_fresh(directory, ["-X", "importtime", "-c", "; ".join(f"import {m}" for m in modules)])
+    tops = []
+    for line in stderr.splitlines():
+        # Unindented names are top-level imports; of those, skip the interpreter's own (site, encodings)
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \| (\S.*)$", line)
+        if match and match.group(2) in modules:
+            tops.append((match.group(2), int(match.group(1)) / 1e6))
+    return sum(seconds for _, seconds in tops), sorted(tops, key=lambda t: -t[1])[:SLOWEST_IMPORTS]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3, help="fresh processes per measurement")
+    parser.add_argument("--no-jobs", action="store_true", help="skip the first-job measurements")
+    parser.add_argument("--output", default=OUTPUT_PATH)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument("--save-baseline", action="store_true")
+    args = parser.parse_args()
+
+    video = next(os.path.join("videos", f) for f in sorted(os.listdir(os.path.join(ROOT, "videos")))
+                 if SOURCE_VIDEO.match(f))
+    modules = app_imports()
+    samples = {name: [] for name in ("import[app]", "first_page", "first_page[preload]")}
+    if not args.no_jobs:
+        samples.update({"first_job[cold]": [], "first_job[warm]": []})
+    slowest = {}
+    for _ in range(max(1, args.runs)):
+        # A new tree per round: empty stores, no result cache, no compiled pages
+        directory = tempfile.mkdtemp(prefix="scope-bench-")
+        try:
+            scratch_tree(directory, [], [])
+            total, tops = import_times(directory, modules)
+            samples["import[app]"].append(total)
+            for name, seconds in tops:
+                slowest[name] = min(seconds, slowest.get(name, seconds))
+            samples["first_page"].append(measured(directory, ["-c", _FIRST_PAGE]))
+            samples["first_page[preload]"].append(
+                measured(directory, ["-c", _FIRST_PAGE], env={"SCOPE_PRELOAD_MODELS": "1"}))
+            if not args.no_jobs:
+                for state in ("cold", "warm"):
+                    # Separate stores, so the warm job cannot hit the cold job's cache
+                    shutil.rmtree(os.path.join(directory, "data", "cache"), ignore_errors=True)
+                    samples[f"first_job[{state}]"].append(measured(directory, ["-c", _FIRST_JOB], state, video))
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    results = {f"startup.{name}": summarize(seconds) for name, seconds in samples.items()}
+
+    write_results(args.output, results, benchmark="startup", runs=args.runs, video=video,
+                  slowest_imports={name: round(seconds * 1000, 1) for name, seconds in slowest.items()})
+    print(f"Results written to {args.output}\n")
+    print("Slowest top-level imports of app.py (ms):")
+    for name, seconds in sorted(slowest.items(), key=lambda t: -t[1])[:SLOWEST_IMPORTS]:
+        print(f"  {name:<40} {seconds * 1000:>8.1f}")
+    print()
+    regressions = report(results, args.baseline, args.tolerance)
+    first_page = results["startup.first_page"]["p50_ms"]
+    over_budget = first_page > FIRST_PAGE_BUDGET_MS
+    print(f"\nFirst page p50 {first_page:.0f} ms (budget {FIRST_PAGE_BUDGET_MS} ms){'  OVER BUDGET' if over_budget else ''}")
+    if args.save_baseline:
+        print(f"Baseline updated: {update_baseline(results, args.baseline)}")
+    sys.exit(1 if over_budget or (regressions and not args.save_baseline) else 0)
+
+
+if __name__ == "__main__":
+    main()
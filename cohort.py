@@ -0,0 +1,264 @@
+"""
+Cohort-level analytics over every stored report.
+
+build_tables() flattens the report store into a columnar table with one row per
+analyzed session, saved as one .npy file per column under data/cohort/. Queries
+open the columns memory-mapped, so a question only reads the columns it touches,
+and aggregate them with vectorized group-bys (np.bincount over integer codes)
+instead of looping over reports.
+
+    python cohort.py        # (re)build the tables and print the per-student summary
+"""
+import os
+import re
+import json
+import time
+import shutil
+
+import numpy as np
+
+from report_store import report_db
+from analysis import load_features
+from report_synthesis import AU_NAMES, temporal_statistics
+
+COHORT_DIR = "data/cohort"
+# Bumped when the columns change, so tables of an older layout are rebuilt
+TABLE_VERSION = 2
+
+# Recordings are named <student id (7 digits)><session number (3 digits)>.mp4, e.g.
+# 1100021003.mp4 is session 3 of student 1100021. Any other name counts as session 0
+# of a student named after the file.
+_SESSION_NAME = re.compile(r"^(\d{7})(\d{3})$")
+
+# Numbers quoted in curated text reports, for entries without stored statistics
+_AU_ACTIVE = re.compile(r"AU(\d+)\b[^\n]*?Active in ([\d.]+)%")
+_GAZE_PERCENT = re.compile(r"~\s*([\d.]+)\s*%")
+
+AU_COLUMNS = {column: column.split(".")[1] for column in AU_NAMES}
+# curated is 1 for hand-written entries (imported from report.json), 0 for generated ones
+NUMERIC_COLUMNS = (
+    "session", "updated_at", "curated", "duration_seconds", "engagement", "blink_rate",
+    "valence_mean", "arousal_mean", "valence_fluctuation",
+) + tuple(AU_COLUMNS.values())
+
+
+def student_session(video_filename):
+    stem = os.path.splitext(os.path.basename(video_filename))[0]
+    match = _SESSION_NAME.match(stem)
+    if match is None:
+        return stem, 0
+    return match.group(1), int(match.group(2))
+
+
+def session_row(video_filename, entry, updated_at):
+    """
+    Flattens one report entry into the numeric table columns (NaN where unknown).
+    Generated entries written before reports carried statistics are filled from the
+    stored features. Curated entries only from the percentages quoted in their text:
+    features of the same video come from the analyzer, not from whoever wrote the report.
+    """
+    row = dict.fromkeys(NUMERIC_COLUMNS, np.nan)
+    row["session"] = student_session(video_filename)[1]
+    row["updated_at"] = updated_at
+    row["curated"] = float("analyzer_version" not in entry)
+    stats = entry.get("statistics")
+    if stats is None and not row["curated"]:
+        features = load_features(video_filename)
+        stats = temporal_statistics(features) if features is not None else None
+    if stats is not None:
+        row["duration_seconds"] = stats["duration_seconds"]
+        row["engagement"] = stats["gaze"].get("on_content_ratio", np.nan)
+        row["blink_rate"] = stats["blink"].get("rate_per_minute", np.nan)
+        row["valence_mean"] = stats["va"].get("valence_mean", np.nan)
+        row["arousal_mean"] = stats["va"].get("arousal_mean", np.nan)
+        row["valence_fluctuation"] = stats["va"].get("valence_fluctuation", np.nan)
+        for column, name in AU_COLUMNS.items():
+            row[name] = stats["au"].get(column, {}).get("active_pct", np.nan)
+        return row
+    text = "\n".join(str(entry.get(field) or "") for field in ("AU_report", "text_report"))
+    for number, percent in _AU_ACTIVE.findall(text):
+        name = f"au{int(number):02d}"
+        if name in row and np.isnan(row[name]):
+            row[name] = float(percent)
+    gaze = _GAZE_PERCENT.search(str(entry.get("Gaze_reprot") or ""))
+    if gaze:
+        row["engagement"] = float(gaze.group(1)) / 100
+    return row
+
+
+def build_tables(table_dir=COHORT_DIR, db=report_db, force=False):
+    """
+    Rebuilds the session table from the report store if it changed since the last
+    build (or always with force=True). Each build goes to a new directory and the
+    manifest is switched atomically, so readers never see a half-written table.
+    The previous build is kept until the next one replaces it, for readers that
+    read the old manifest just before the switch. Returns the manifest.
+    """
+    manifest_path = os.path.join(table_dir, "manifest.json")
+    signature = db.signature()
+    previous = None
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+        if not force and manifest["signature"] == signature and manifest.get("version") == TABLE_VERSION:
+            return manifest
+        previous = manifest["build"]
+
+    videos, students, rows = [], [], []
+    for video, entry, updated_at in db.iter_entries():
+        videos.append(video)
+        students.append(student_session(video)[0])
+        rows.append(session_row(video, entry, updated_at))
+
+    build = str(time.time_ns())
+    build_dir = os.path.join(table_dir, build)
+    os.makedirs(build_dir)
+    student_names, student_codes = np.unique(np.asarray(students, dtype=str), return_inverse=True)
+    columns = {
+        "video": np.asarray(videos, dtype=str),
+        "student_code": student_codes.astype(np.int32),
+    }
+    for name in NUMERIC_COLUMNS:
+        columns[name] = np.asarray([row[name] for row in rows], dtype=np.float64)
+    for name, values in columns.items():
+        np.save(os.path.join(build_dir, f"{name}.npy"), values)
+    # Vocabulary of student_code, not row-aligned
+    np.save(os.path.join(build_dir, "students.npy"), student_names)
+
+    manifest = {"build": build, "rows": len(videos), "signature": signature, "built_at": time.time(),
+                "version": TABLE_VERSION}
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    for name in os.listdir(table_dir):
+        # Open tables have every column mapped (see CohortTable), and unlinking a
+        # file does not invalidate existing memory maps of it
+        if name not in (build, previous) and os.path.isdir(os.path.join(table_dir, name)):
+            shutil.rmtree(os.path.join(table_dir, name), ignore_errors=True)
+    return manifest
+
+
+class CohortTable:
+    """
+    Read-only view of one build of the session table. Every column is memory-mapped
+    when the table is opened (mapping reads no data, pages are read on access), so
+    the table stays usable after later builds delete its directory.
+    """
+
+    def __init__(self, table_dir=COHORT_DIR):
+        with open(os.path.join(table_dir, "manifest.json"), "r") as f:
+            self.manifest = json.load(f)
+        self.build_dir = os.path.join(table_dir, self.manifest["build"])
+        self._columns = {
+            os.path.splitext(name)[0]: np.load(os.path.join(self.build_dir, name), mmap_mode="r")
+            for name in os.listdir(self.build_dir) if name.endswith(".npy")
+        }
+
+    def __len__(self):
+        return self.manifest["rows"]
+
+    def __getitem__(self, name):
+        return self._columns[name]
+
+    @property
+    def students(self):
+        return self["students"]
+
+    def mask(self, videos=None, students=None):
+        """
+        Boolean row selector for a set of videos (e.g. a class) and/or students.
+        """
+        selected = np.ones(len(self), dtype=bool)
+        if videos is not None:
+            selected &= np.isin(self["video"], list(videos))
+        if students is not None:
+            selected &= np.isin(self["student_code"], np.flatnonzero(np.isin(self.students, list(students))))
+        return selected
+
+    def group_by_student(self, columns, mask=None):
+        """
+        Per-student session count and mean of each column (NaNs ignored), as a dict
+        of arrays aligned with "student". Students without selected rows are dropped.
+        """
+        codes = np.asarray(self["student_code"])
+        mask = np.ones(len(codes), dtype=bool) if mask is None else mask
+        sizes = np.bincount(codes[mask], minlength=len(self.students))
+        present = sizes > 0
+        result = {"student": np.asarray(self.students)[present], "sessions": sizes[present]}
+        for column in columns:
+            values = np.asarray(self[column])
+            valid = mask & np.isfinite(values)
+            counts = np.bincount(codes[valid], minlength=len(self.students))
+            sums = np.bincount(codes[valid], weights=values[valid], minlength=len(self.students))
+            with np.errstate(invalid="ignore", divide="ignore"):
+                result[column] = (sums / counts)[present]
+        return result
+
+    def student_summary(self, mask=None):
+        """
+        Per-student averages plus the engagement trend: the least-squares slope of
+        engagement against session number, per session (NaN with fewer than two).
+        """
+        summary = self.group_by_student(("engagement", "blink_rate", "valence_mean", "arousal_mean", "curated"), mask)
+        codes = np.asarray(self["student_code"])
+        x, y = np.asarray(self["session"]), np.asarray(self["engagement"])
+        valid = np.isfinite(y) if mask is None else mask & np.isfinite(y)
+        sums = {
+            name: np.bincount(codes[valid], weights=weights, minlength=len(self.students))
+            for name, weights in (("n", None), ("x", x[valid]), ("y", y[valid]),
+                                  ("xx", x[valid] ** 2), ("xy", x[valid] * y[valid]))
+        }
+        denominator = sums["n"] * sums["xx"] - sums["x"] ** 2
+        with np.errstate(invalid="ignore", divide="ignore"):
+            slope = np.where(denominator > 0, (sums["n"] * sums["xy"] - sums["x"] * sums["y"]) / denominator, np.nan)
+        present = np.isin(np.asarray(self.students), summary["student"])
+        summary["engagement_trend"] = slope[present]
+        return summary
+
+    def engagement_trend(self, student, mask=None):
+        """
+        (session numbers, engagement, valence, arousal) of one student's sessions, in session order.
+        """
+        selected = self.mask(students=[student])
+        rows = np.flatnonzero(selected if mask is None else selected & mask)
+        rows = rows[np.argsort(np.asarray(self["session"])[rows], kind="stable")]
+        return {
+            "video": np.asarray(self["video"])[rows],
+            "session": np.asarray(self["session"])[rows],
+            "engagement": np.asarray(self["engagement"])[rows],
+            "valence_mean": np.asarray(self["valence_mean"])[rows],
+            "arousal_mean": np.asarray(self["arousal_mean"])[rows],
+        }
+
+    def au_prevalence(self, mask=None, active_pct=10.0):
+        """
+        Per AU: mean % of active frames over the selected sessions and the share of
+        sessions in which the AU is active in at least active_pct % of frames.
+        """
+        prevalence = {}
+        for column, name in AU_COLUMNS.items():
+            values = np.asarray(self[name]) if mask is None else np.asarray(self[name])[mask]
+            values = values[np.isfinite(values)]
+            prevalence[AU_NAMES[column]] = {
+                "mean_active_pct": float(values.mean()) if len(values) else np.nan,
+                "sessions_active": float((values >= active_pct).mean()) if len(values) else np.nan,
+                "sessions": int(len(values)),
+            }
+        return prevalence
+
+
+def load_table(table_dir=COHORT_DIR, db=report_db):
+    """
+    The current session table, rebuilt first if the report store has changed.
+    """
+    build_tables(table_dir, db)
+    return CohortTable(table_dir)
+
+
+if __name__ == "__main__":
+    table = load_table()
+    summary = table.student_summary()
+    print(f"{len(table)} sessions, {len(summary['student'])} students")
+    for i, student in enumerate(summary["student"]):
+        print(f"{student:<20} sessions={summary['sessions'][i]:<4} engagement={summary['engagement'][i]:.2f} "
+              f"trend={summary['engagement_trend'][i]:+.3f}/session")
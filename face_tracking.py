@@ -0,0 +1,188 @@
+"""
+Detect-then-track face localization shared by every extractor.
+
+A full face detector runs on the first frame, every DETECT_EVERY analyzed frames and
+whenever tracking is lost. In between, the face is followed by template matching in
+a small search window around its last position. The engine cuts one fixed-size face
+crop per frame from the tracked box, and the AU, VA, blink and gaze extractors all
+read those crops instead of locating the face themselves.
+
+Detector backends, the first available one is used:
+  - YuNet (cv2.FaceDetectorYN) when SCOPE_FACE_MODEL points to its .onnx weights
+  - the Haar cascade bundled with OpenCV 4.x
+  - a fixed box (the framing of the webcam recordings), so the pipeline runs without a model;
+    it is applied to every frame, as tracking would only let the box drift
+"""
+import os
+import time
+
+import numpy as np
+import cv2
+
+FACE_CROP_SIZE = 96
+DETECT_EVERY = int(os.environ.get("SCOPE_DETECT_EVERY", "10"))
+FACE_MODEL = os.environ.get("SCOPE_FACE_MODEL", "")
+# Below this normalized cross-correlation the tracked face is considered lost
+TRACK_MIN_SCORE = 0.5
+# The search window extends this fraction of the face size beyond the last box
+TRACK_MARGIN = 0.25
+# Matching runs on copies scaled so the face template is at most this wide
+TRACK_TEMPLATE_WIDTH = 40
+
+_HAAR_CASCADE = "haarcascade_frontalface_default.xml"
+
+
+class FixedBoxDetector:
+    name = "fixed"
+
+    def __init__(self, box):
+        self.box = box
+
+    def detect(self, gray):
+        h, w = gray.shape
+        x0, y0, x1, y1 = self.box
+        return int(w * x0), int(h * y0), int(w * (x1 - x0)), int(h * (y1 - y0))
+
+
+class HaarDetector:
+    name = "haar"
+
+    def __init__(self):
+        self._cascade = cv2.CascadeClassifier(os.path.join(cv2.data.haarcascades, _HAAR_CASCADE))
+
+    def detect(self, gray):
+        faces = self._cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(40, 40))
+        if not len(faces):
+            return None
+        return tuple(int(v) for v in max(faces, key=lambda f: f[2] * f[3]))
+
+
+class YuNetDetector:
+    name = "yunet"
+
+    def __init__(self, model_path, score_threshold=0.7):
+        self._detector = cv2.FaceDetectorYN.create(model_path, "", (320, 320), score_threshold)
+
+    def detect(self, gray):
+        h, w = gray.shape
+        self._detector.setInputSize((w, h))
+        _, faces = self._detector.detect(cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR))
+        if faces is None or not len(faces):
+            return None
+        # Columns: box (4), five landmarks (10), score
+        x, y, fw, fh = faces[np.argmax(faces[:, 14])][:4]
+        x, y = max(int(x), 0), max(int(y), 0)
+        return x, y, max(min(int(fw), w - x), 1), max(min(int(fh), h - y), 1)
+
+
+_detectors = {}
+
+
+def get_detector(fallback_box):
+    """
+    The best available detector, created once per process (loading weights is slow).
+    """
+    if "default" not in _detectors:
+        if FACE_MODEL and hasattr(cv2, "FaceDetectorYN"):
+            _detectors["default"] = YuNetDetector(FACE_MODEL)
+        elif hasattr(cv2, "CascadeClassifier") and os.path.exists(
+                os.path.join(getattr(getattr(cv2, "data", None), "haarcascades", ""), _HAAR_CASCADE)):
+            _detectors["default"] = HaarDetector()
+        else:
+            _detectors["default"] = FixedBoxDetector(fallback_box)
+    return _detectors["default"]
+
+
+class FaceTracker:
+    """
+    Per-video face tracker. crops() returns one (crop_size, crop_size) grayscale face
+    crop and (x, y, w, h) box per frame. Keep one instance for the whole video so the
+    track carries across batches.
+    """
+
+    def __init__(self, fallback_box, detector=None, detect_every=DETECT_EVERY, crop_size=FACE_CROP_SIZE):
+        self.fallback = FixedBoxDetector(fallback_box)
+        self.detector = detector or get_detector(fallback_box)
+        # A fixed box costs nothing to "detect" and must not wander with the image
+        self.detect_every = 1 if isinstance(self.detector, FixedBoxDetector) else max(1, detect_every)
+        self.crop_size = crop_size
+        self.reset()
+
+    def reset(self):
+        self._box = None
+        self._template = None
+        self._scale = 1.0
+        self._since_detect = 0
+        self.detections = 0
+        self.tracked = 0
+        self.lost = 0
+
+    def get_state(self):
+        """
+        The track as arrays (empty before the first frame), so that it can be saved
+        with a window checkpoint and restored with set_state().
+        """
+        if self._box is None:
+            return {}
+        return {"box": np.asarray(self._box), "template": self._template,
+                "scale": np.float64(self._scale), "since_detect": np.int64(self._since_detect)}
+
+    def set_state(self, state):
+        if "box" in state:
+            self._box = tuple(int(v) for v in state["box"])
+            self._template = state["template"]
+            self._scale = float(state["scale"])
+            self._since_detect = int(state["since_detect"])
+
+    def _set_template(self, gray, box):
+        x, y, w, h = box
+        self._scale = min(1.0, TRACK_TEMPLATE_WIDTH / w)
+        self._template = cv2.resize(gray[y:y + h, x:x + w], None, fx=self._scale, fy=self._scale,
+                                    interpolation=cv2.INTER_AREA)
+
+    def _track(self, gray):
+        x, y, w, h = self._box
+        margin = int(max(w, h) * TRACK_MARGIN)
+        height, width = gray.shape
+        sx0, sy0 = max(x - margin, 0), max(y - margin, 0)
+        region = gray[sy0:min(y + h + margin, height), sx0:min(x + w + margin, width)]
+        region = cv2.resize(region, None, fx=self._scale, fy=self._scale, interpolation=cv2.INTER_AREA)
+        if region.shape[0] < self._template.shape[0] or region.shape[1] < self._template.shape[1]:
+            return None
+        scores = cv2.matchTemplate(region, self._template, cv2.TM_CCOEFF_NORMED)
+        _, score, _, (dx, dy) = cv2.minMaxLoc(scores)
+        if score < TRACK_MIN_SCORE:
+            return None
+        nx = min(max(sx0 + int(round(dx / self._scale)), 0), width - w)
+        ny = min(max(sy0 + int(round(dy / self._scale)), 0), height - h)
+        return nx, ny, w, h
+
+    def update(self, gray):
+        box = None
+        if self._box is not None and self._since_detect < self.detect_every:
+            box = self._track(gray)
+            if box is None:
+                self.lost += 1
+            else:
+                self.tracked += 1
+        if box is None:
+            self.detections += 1
+            box = self.detector.detect(gray) or self._box or self.fallback.detect(gray)
+            # The template is only refreshed on detection, so tracking errors don't accumulate
+            self._set_template(gray, box)
+            self._since_detect = 0
+        self._box = box
+        self._since_detect += 1
+        return box
+
+    def crops(self, grays, timer=None):
+        start = time.perf_counter()
+        faces = np.empty((len(grays), self.crop_size, self.crop_size), dtype=np.uint8)
+        boxes = np.empty((len(grays), 4), dtype=np.int32)
+        for i, gray in enumerate(grays):
+            x, y, w, h = boxes[i] = self.update(gray)
+            faces[i] = cv2.resize(gray[y:y + h, x:x + w], (self.crop_size, self.crop_size),
+                                  interpolation=cv2.INTER_AREA)
+        if timer is not None:
+            timer.add("face_tracking", time.perf_counter() - start)
+        return faces, boxes
@@ -0,0 +1,378 @@
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+import multiprocessing
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import metrics
+
+JOB_DB_PATH = "data/jobs.db"
+# Load the models in every worker when it starts, instead of on its first job
+PRELOAD_MODELS = os.environ.get("SCOPE_PRELOAD_MODELS", "0") == "1"
+# Tasks that run on their own low-priority pool, so they never hold up analyses
+BACKGROUND_TASKS = ("derivatives",)
+BACKGROUND_NICENESS = 10
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+ACTIVE_STATES = (QUEUED, RUNNING)
+# An active job without a checkable owner (another host, rows from before owners
+# were recorded) counts as abandoned once it has not been updated for this long
+STALE_SECONDS = 300
+
+_HOST = socket.gethostname()
+
+
+def _process_start(pid):
+    # Start time in clock ticks since boot (Linux), which tells a reused pid apart
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            return f.read().rsplit(")", 1)[1].split()[19]
+    except (OSError, IndexError):
+        return ""
+
+
+def process_owner():
+    """
+    host:pid:start of this process, recorded as the owner of the jobs it dispatches.
+    """
+    return f"{_HOST}:{os.getpid()}:{_process_start(os.getpid())}"
+
+
+def is_orphaned(job, now=None):
+    """
+    Whether an active job was left behind: its owner on this host has exited, or it
+    cannot be checked and the job has not been updated for STALE_SECONDS.
+    """
+    host, pid, start = (job.get("owner") or "::").rsplit(":", 2)
+    if host != _HOST or not pid:
+        return (now or time.time()) - job["updated_at"] >= STALE_SECONDS
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return bool(start) and _process_start(int(pid)) != start
+
+
+class JobStore:
+    """
+    Persistent job states shared by the UI process and the workers.
+    Workers write state and progress here; the UI only polls it.
+    """
+
+    def __init__(self, db_path=JOB_DB_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS jobs ("
+                    " id TEXT PRIMARY KEY,"
+                    " video TEXT NOT NULL,"
+                    " params TEXT NOT NULL DEFAULT '{}',"
+                    " status TEXT NOT NULL,"
+                    " progress REAL NOT NULL DEFAULT 0,"
+                    " message TEXT NOT NULL DEFAULT '',"
+                    " result TEXT,"
+                    " error TEXT,"
+                    " created_at REAL NOT NULL,"
+                    " updated_at REAL NOT NULL,"
+                    " owner TEXT)"
+                )
+                if "owner" not in [row["name"] for row in conn.execute("PRAGMA table_info(jobs)")]:
+                    conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+                conn.execute("CREATE INDEX IF NOT EXISTS jobs_video ON jobs (video, status)")
+            self._local.conn = conn
+        return conn
+
+    def _set(self, job_id, **fields):
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        conn = self._conn()
+        with conn:
+            conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def create(self, video, params=None):
+        """
+        Creates a queued job owned by this process, which is expected to dispatch it.
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT INTO jobs (id, video, params, status, created_at, updated_at, owner)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, video, json.dumps(params or {}, sort_keys=True), QUEUED, now, now, process_owner()),
+            )
+        return job_id
+
+    def get(self, job_id):
+        row = self._conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    def find(self, video, statuses, params=None):
+        """
+        Returns the most recent job for a video in one of the given states, or None.
+        """
+        placeholders = ", ".join("?" for _ in statuses)
+        query = f"SELECT id FROM jobs WHERE video = ? AND status IN ({placeholders})"
+        args = [video, *statuses]
+        if params is not None:
+            query += " AND params = ?"
+            args.append(json.dumps(params, sort_keys=True))
+        row = self._conn().execute(query + " ORDER BY created_at DESC LIMIT 1", args).fetchone()
+        return self.get(row["id"]) if row else None
+
+    def list(self, statuses):
+        placeholders = ", ".join("?" for _ in statuses)
+        rows = self._conn().execute(
+            f"SELECT id FROM jobs WHERE status IN ({placeholders}) ORDER BY created_at", statuses
+        ).fetchall()
+        return [self.get(row["id"]) for row in rows]
+
+    def requeue(self, job_id, message=""):
+        # The requeueing process dispatches the job again, so it becomes its owner
+        self._set(job_id, status=QUEUED, progress=0.0, message=message, owner=process_owner())
+
+    def mark_running(self, job_id):
+        self._set(job_id, status=RUNNING, progress=0.0, message="Starting analysis")
+
+    def set_progress(self, job_id, fraction, message=""):
+        self._set(job_id, progress=max(0.0, min(1.0, float(fraction))), message=message)
+
+    def mark_done(self, job_id, result):
+        self._set(job_id, status=DONE, progress=1.0, message="Done", result=json.dumps(result))
+
+    def mark_failed(self, job_id, error):
+        self._set(job_id, status=FAILED, message="Failed", error=error)
+
+
+def run_job(job_id, video_path, params, db_path):
+    """
+    Entry point executed inside a worker. Reports progress and the final state
+    through the job store so that any process can poll it. params["task"] selects
+    "analyze" (default, utils.analyze_video) or "derivatives" (preview renditions).
+    """
+    params = dict(params)
+    task = params.pop("task", "analyze")
+    # Imported here so the worker process, not the UI process, pays for the analysis stack
+    if task == "derivatives":
+        from renditions import generate_video_derivatives as run_task
+    else:
+        from utils import analyze_video as run_task
+
+    store = JobStore(db_path)
+    store.mark_running(job_id)
+    try:
+        with metrics.timed("job", task=task):
+            result = run_task(
+                video_path,
+                progress=lambda fraction, message="": store.set_progress(job_id, fraction, message),
+                **params,
+            )
+        store.mark_done(job_id, result)
+        metrics.count("jobs_total", task=task, status=DONE)
+    except Exception as e:
+        store.mark_failed(job_id, f"{type(e).__name__}: {e}")
+        metrics.count("jobs_total", task=task, status=FAILED)
+    finally:
+        # Workers live in their own processes: publish their metrics after every job
+        metrics.flush()
+
+
+def _init_worker(preload, niceness=0):
+    if niceness:
+        os.nice(niceness)
+    # Workers outlive their jobs: the models a worker loads (here with preload,
+    # otherwise on its first job) serve every later job of that process
+    if preload:
+        from analysis import warm_up
+
+        try:
+            warm_up()
+        except Exception as e:
+            # An exception here would break the whole pool; the first job reports it instead
+            print(f"Model preload failed, models load on first use: {type(e).__name__}: {e}", file=sys.stderr)
+        metrics.flush()
+
+
+def _ready():
+    return os.getpid()
+
+
+def _check_worker_lost(job_id, db_path, future):
+    # run_job records its own failures: an exception here means the worker process
+    # died (out of memory, crash) and the job would otherwise stay active forever
+    if future.cancelled() or future.exception() is None:
+        return
+    store = JobStore(db_path)
+    job = store.get(job_id)
+    if job is not None and job["status"] in ACTIVE_STATES:
+        store.mark_failed(job_id, f"Worker process died: {type(future.exception()).__name__}")
+
+
+class LocalWorkers:
+    """
+    Runs jobs in a local process pool, outside the Streamlit server process.
+    Any object with the same submit(job_id, video_path, params, db_path) method,
+    e.g. one that posts the job to a remote GPU host, can be used instead.
+    """
+
+    def __init__(self, max_workers=None, preload=None, niceness=0):
+        self.max_workers = max_workers or int(os.environ.get("SCOPE_ANALYSIS_WORKERS", "2"))
+        self.preload = PRELOAD_MODELS if preload is None else preload
+        self.niceness = niceness
+        self._executor = None
+        self._started = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None:
+            # spawn, not fork: the server process has live threads and sockets
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.preload, self.niceness),
+            )
+        return self._executor
+
+    def submit(self, job_id, video_path, params, db_path):
+        with self._lock:
+            try:
+                future = self._get_executor().submit(run_job, job_id, video_path, params, db_path)
+            except BrokenProcessPool:
+                # A worker died and took the pool with it: replace the pool
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+                self._started = None
+                future = self._get_executor().submit(run_job, job_id, video_path, params, db_path)
+        future.add_done_callback(partial(_check_worker_lost, job_id, db_path))
+
+    def start(self, block=False):
+        """
+        Starts all worker processes now rather than on the first jobs, loading the
+        models in each with preload. Returns at once unless block is set.
+        """
+        with self._lock:
+            if self._started is None:
+                executor = self._get_executor()
+                self._started = [executor.submit(_ready) for _ in range(self.max_workers)]
+            started = self._started
+        if block:
+            wait(started)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+                self._started = None
+
+
+class JobQueue:
+    """
+    Analysis jobs run on `workers`; BACKGROUND_TASKS (preview renditions) on
+    `background_workers`, by default one low-priority process.
+    """
+
+    def __init__(self, store=None, workers=None, background_workers=None):
+        self.store = store or JobStore()
+        self.workers = workers or LocalWorkers()
+        self.background_workers = background_workers or LocalWorkers(
+            int(os.environ.get("SCOPE_BACKGROUND_WORKERS", "1")), preload=False, niceness=BACKGROUND_NICENESS)
+
+    def submit(self, video_path, reuse_done=False, retry_after=None, **params):
+        """
+        Queues an analysis of video_path and returns the job id immediately.
+        A video that is already queued or running is not submitted twice; with
+        reuse_done, a finished analysis of the same video is returned as well. With
+        retry_after, so is a job that failed less than retry_after seconds ago, so a
+        task that keeps failing is not started again on every rerun of the page.
+        """
+        statuses = ACTIVE_STATES + (DONE,) if reuse_done else ACTIVE_STATES
+        if retry_after is not None:
+            statuses += (FAILED,)
+        existing = self.store.find(video_path, statuses, params)
+        if existing is not None and (existing["status"] != FAILED or time.time() - existing["updated_at"] < retry_after):
+            return existing["id"]
+        job_id = self.store.create(video_path, params)
+        self._dispatch(job_id, video_path, params)
+        return job_id
+
+    def _dispatch(self, job_id, video_path, params):
+        """
+        Hands a created job to the workers. If that fails the job is marked failed,
+        so no queued row is left that nothing will run (and that later submits of the
+        same video would wait on).
+        """
+        workers = self.background_workers if params.get("task") in BACKGROUND_TASKS else self.workers
+        try:
+            workers.submit(job_id, video_path, params, self.store.db_path)
+        except Exception as e:
+            self.store.mark_failed(job_id, f"Could not start job: {type(e).__name__}: {e}")
+
+    def status(self, job_id):
+        return self.store.get(job_id)
+
+    def recover(self):
+        """
+        Re-submits jobs left queued or running by a process that has exited (see
+        is_orphaned). Jobs of live processes, e.g. another server or a batch run,
+        are left to them.
+        """
+        jobs = [job for job in self.store.list(ACTIVE_STATES) if is_orphaned(job)]
+        for job in jobs:
+            self.store.requeue(job["id"], "Re-queued after restart")
+            self._dispatch(job["id"], job["video"], job["params"])
+        return len(jobs)
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """
+    Returns the process-wide job queue, recovering unfinished jobs on first use.
+    """
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue()
+            _job_queue.recover()
+        return _job_queue
+
+
+def start_workers(block=False):
+    """
+    Starts the job workers of this process ahead of the first job (see
+    LocalWorkers.start). Other worker backends are started by their own host.
+    """
+    workers = get_job_queue().workers
+    if hasattr(workers, "start"):
+        workers.start(block)
@@ -0,0 +1,376 @@
+"""
+Near-real-time analysis of a live session.
+
+A reader thread pulls frames from a source (a camera, an RTSP stream, or a video file
+replayed at wall-clock speed for testing) into a small bounded queue. An analyzer
+thread takes the newest frames in batches and runs the shared face tracker and the
+AU, VA, blink and gaze extractors on them. When analysis falls behind, frames are
+dropped instead of queued: the oldest frame is discarded when the queue is full, and
+a frame that waited longer than max_latency is skipped. Latency therefore stays
+bounded and the indicators follow the live session at a lower frame rate.
+
+Every refresh_seconds the rolling engagement and confusion indicators over the last
+window_seconds are appended to the session history, together with the end-to-end
+latency (frame captured to features extracted) and the drop rate. Both are also
+recorded in the process metrics (live_frame_latency_seconds, live_frames_total).
+
+In the app a user can only start a session on a source of allowed_sources(): the
+cameras and streams the admin lists in SCOPE_LIVE_SOURCES, or a replay of one of the
+user's own videos. Each user has at most one session. A session stops itself when the
+page that watches it stops calling touch() for LIVE_LEASE_SECONDS (the tab was closed
+or reloaded) or after LIVE_MAX_SECONDS.
+
+    python live.py videos/1100021003.mp4     # replay a file in real time, print indicators
+    python live.py 0                         # first camera
+    python live.py rtsp://camera.local/stream
+"""
+import os
+import sys
+import time
+import threading
+from collections import deque
+
+import numpy as np
+import cv2
+
+from analysis import ANALYSIS_WIDTH, EXTRACTORS, FACE_BOX, run_extractors
+from face_tracking import FaceTracker
+from report_synthesis import AU_ACTIVE_THRESHOLD, on_content_mask
+from access_map import access_map
+from metrics import registry
+
+VIDEO_DIR = "videos"
+
+LIVE_REFRESH_SECONDS = float(os.environ.get("SCOPE_LIVE_REFRESH_SECONDS", "1.0"))
+LIVE_WINDOW_SECONDS = float(os.environ.get("SCOPE_LIVE_WINDOW_SECONDS", "10"))
+# Frames that waited longer than this for the analyzer are skipped
+LIVE_MAX_LATENCY = float(os.environ.get("SCOPE_LIVE_MAX_LATENCY", "0.5"))
+LIVE_QUEUE_SIZE = 8
+LIVE_BATCH_SIZE = 8
+# Latency percentiles are computed over this many most recent frames
+LATENCY_SAMPLES = 1000
+# Indicator snapshots kept in the session history
+HISTORY_SIZE = 600
+# Cameras and streams users may open, comma-separated ("0,rtsp://camera.local/stream")
+LIVE_SOURCES = [s.strip() for s in os.environ.get("SCOPE_LIVE_SOURCES", "").split(",") if s.strip()]
+# A session nobody has looked at for this long is stopped
+LIVE_LEASE_SECONDS = float(os.environ.get("SCOPE_LIVE_LEASE_SECONDS", "30"))
+LIVE_MAX_SECONDS = float(os.environ.get("SCOPE_LIVE_MAX_SECONDS", "3600"))
+
+# Confusion heuristic: brow lowerer active while valence is negative
+CONFUSION_AU = "au.au03"
+
+RUNNING = "running"
+FINISHED = "finished"
+STOPPED = "stopped"
+FAILED = "failed"
+
+
+class CaptureSource:
+    """
+    A camera device or network stream, read as fast as it delivers frames.
+    """
+
+    def __init__(self, target):
+        self.target = target
+        self.capture = cv2.VideoCapture(target)
+        if not self.capture.isOpened():
+            raise ValueError(f"Cannot open frame source: {target}")
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS) or 30.0
+
+    def read(self):
+        ok, frame = self.capture.read()
+        return frame if ok else None
+
+    def close(self):
+        self.capture.release()
+
+
+class ReplaySource(CaptureSource):
+    """
+    A video file delivered at wall-clock speed (times `speed`), standing in for a
+    camera. Frames are released when they are due, so a slow analyzer sees drops
+    exactly as it would on a live feed.
+    """
+
+    def __init__(self, path, speed=1.0):
+        super().__init__(path)
+        self.speed = speed
+        self._start = None
+        self._index = 0
+
+    def read(self):
+        frame = super().read()
+        if frame is None:
+            return None
+        if self._start is None:
+            self._start = time.perf_counter()
+        delay = self._start + self._index / (self.fps * self.speed) - time.perf_counter()
+        self._index += 1
+        if delay > 0:
+            time.sleep(delay)
+        return frame
+
+
+def open_source(spec, speed=1.0):
+    """
+    Frame source for a camera index ("0"), a stream URL (rtsp://, http://) or a video file.
+    """
+    spec = str(spec).strip()
+    if spec.isdigit():
+        return CaptureSource(int(spec))
+    if "://" in spec:
+        return CaptureSource(spec)
+    if not os.path.exists(spec):
+        raise ValueError(f"No such video file: {spec}")
+    return ReplaySource(spec, speed)
+
+
+class LiveSession:
+    """
+    Runs the extractors on a live frame source in background threads. indicators()
+    and history are safe to read from the UI thread at any time.
+    """
+
+    def __init__(self, source, window_seconds=LIVE_WINDOW_SECONDS, max_latency=LIVE_MAX_LATENCY,
+                 queue_size=LIVE_QUEUE_SIZE, batch_size=LIVE_BATCH_SIZE, refresh_seconds=LIVE_REFRESH_SECONDS,
+                 lease_seconds=None, max_seconds=None):
+        self.source = source
+        self.lease_seconds = lease_seconds
+        self.max_seconds = max_seconds
+        self._touched = time.monotonic()
+        self.window_seconds = window_seconds
+        self.max_latency = max_latency
+        self.queue_size = max(1, queue_size)
+        self.batch_size = max(1, batch_size)
+        self.refresh_seconds = refresh_seconds
+        self.status = RUNNING
+        self.error = None
+        self.history = deque(maxlen=HISTORY_SIZE)
+        self.captured = 0
+        self.analyzed = 0
+        self.dropped = 0
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._source_done = False
+        self._stop = threading.Event()
+        # (seconds since start, on content, confused) per analyzed frame, for the rolling window
+        self._rolling = deque()
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._lock = threading.Lock()
+        self._threads = []
+        self.started_at = None
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        for target, name in ((self._read_loop, "reader"), (self._analyze_loop, "analyzer"),
+                             (self._publish_loop, "publisher")):
+            thread = threading.Thread(target=target, name=f"scope-live-{name}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self.status == RUNNING:
+            self.status = STOPPED
+
+    def touch(self):
+        """
+        Renews the session's lease; the watching page calls this on every refresh.
+        """
+        self._touched = time.monotonic()
+
+    def _expired(self):
+        now = time.monotonic()
+        if self.lease_seconds is not None and now - self._touched > self.lease_seconds:
+            return True
+        return self.max_seconds is not None and self.started_at is not None \
+            and time.perf_counter() - self.started_at > self.max_seconds
+
+    def join(self, timeout=None):
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _drop(self, count, reason):
+        self.dropped += count
+        registry.count("live_frames_total", count, result="dropped", reason=reason)
+
+    def _read_loop(self):
+        try:
+            while not self._stop.is_set():
+                frame = self.source.read()
+                if frame is None:
+                    break
+                captured_at = time.perf_counter()
+                with self._cond:
+                    if len(self._queue) >= self.queue_size:
+                        self._queue.popleft()
+                        self._drop(1, "queue_full")
+                    self._queue.append((captured_at, frame))
+                    self.captured += 1
+                    self._cond.notify()
+        except Exception as e:
+            self.error = str(e)
+            self.status = FAILED
+        finally:
+            self.source.close()
+            with self._cond:
+                self._source_done = True
+                self._cond.notify_all()
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._queue and not self._source_done and not self._stop.is_set():
+                self._cond.wait(0.5)
+            if self._stop.is_set():
+                return None
+            count = min(len(self._queue), self.batch_size)
+            if not count:
+                return None
+            return [self._queue.popleft() for _ in range(count)]
+
+    def _analyze_loop(self):
+        try:
+            extractors = [cls() for cls in EXTRACTORS.values()]
+            for extractor in extractors:
+                extractor.reset(self.source.fps)
+            tracker = FaceTracker(FACE_BOX)
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    break
+                now = time.perf_counter()
+                fresh = [(t, frame) for t, frame in batch if now - t <= self.max_latency]
+                if len(fresh) < len(batch):
+                    self._drop(len(batch) - len(fresh), "stale")
+                if fresh:
+                    self._analyze(extractors, tracker, fresh)
+            if self.status == RUNNING:
+                self.status = FINISHED
+        except Exception as e:
+            self.error = str(e)
+            self.status = FAILED
+        finally:
+            self._stop.set()
+
+    def _analyze(self, extractors, tracker, batch):
+        captured_at = np.array([t for t, _ in batch])
+        frames = []
+        for _, frame in batch:
+            scale = ANALYSIS_WIDTH / frame.shape[1]
+            if scale < 1:
+                frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            frames.append(frame)
+        frames = np.stack(frames)
+        grays = np.stack([cv2.cvtColor(f, cv2.COLOR_BGR2GRAY) for f in frames])
+        faces, _ = tracker.crops(grays)
+        columns = {f"{e.name}.{c}": [] for e in extractors for c in e.columns}
+        run_extractors(extractors, frames, grays, faces, columns)
+        features = {name: parts[0] for name, parts in columns.items()}
+        latencies = time.perf_counter() - captured_at
+
+        on_content = on_content_mask(features)
+        confused = (features[CONFUSION_AU] > AU_ACTIVE_THRESHOLD) & (features["va.valence"] < 0)
+        seconds = captured_at - self.started_at
+        with self._lock:
+            self._rolling.extend(zip(seconds, on_content, confused))
+            while self._rolling and self._rolling[0][0] < seconds[-1] - self.window_seconds:
+                self._rolling.popleft()
+            self._latencies.extend(latencies)
+            self.analyzed += len(batch)
+        for latency in latencies:
+            registry.observe("live_frame_latency_seconds", float(latency))
+        registry.count("live_frames_total", len(batch), result="analyzed")
+
+    def _publish_loop(self):
+        while not self._stop.wait(self.refresh_seconds):
+            self.history.append(self.indicators())
+            if self._expired():
+                self.stop()
+        self.history.append(self.indicators())
+
+    def indicators(self):
+        """
+        Rolling engagement and confusion (share of frames over the last window_seconds)
+        plus latency and drop statistics of the session so far.
+        """
+        with self._lock:
+            rolling = np.array(self._rolling, dtype=np.float64).reshape(-1, 3)
+            latencies = np.array(self._latencies)
+        elapsed = time.perf_counter() - self.started_at if self.started_at else 0.0
+        span = float(rolling[-1, 0] - rolling[0, 0]) if len(rolling) > 1 else 0.0
+        return {
+            "elapsed_seconds": round(elapsed, 2),
+            "engagement": round(float(rolling[:, 1].mean()), 3) if len(rolling) else None,
+            "confusion": round(float(rolling[:, 2].mean()), 3) if len(rolling) else None,
+            "analyzed_fps": round((len(rolling) - 1) / span, 1) if span > 0 else 0.0,
+            "latency_p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 1) if len(latencies) else None,
+            "latency_p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 1) if len(latencies) else None,
+            "captured": self.captured,
+            "analyzed": self.analyzed,
+            "dropped": self.dropped,
+            "drop_rate": round(self.dropped / self.captured, 3) if self.captured else 0.0,
+        }
+
+
+def start_session(spec, speed=1.0, **options):
+    return LiveSession(open_source(spec, speed), **options).start()
+
+
+def allowed_sources(email):
+    """
+    Frame sources a user may start a session on, as {label: spec}: the configured
+    LIVE_SOURCES and real-time replays of the user's own videos.
+    """
+    sources = {f"Live: {spec}": spec for spec in LIVE_SOURCES}
+    names = access_map.display_names(email)
+    for video in access_map.videos_for(email):
+        path = os.path.join(VIDEO_DIR, video)
+        if os.path.isfile(path):
+            label = f"Replay: {names.get(video, video)}"
+            # Two uploads can share a name; fall back to the stored one
+            sources[label if label not in sources else f"Replay: {video}"] = path
+    return sources
+
+
+_user_sessions = {}
+_user_sessions_lock = threading.Lock()
+
+
+def start_user_session(email, spec):
+    """
+    Starts a leased session for a user on one of their allowed sources, stopping the
+    user's previous session. Raises PermissionError for any other source.
+    """
+    if not email or spec not in allowed_sources(email).values():
+        raise PermissionError("This frame source is not available to you.")
+    with _user_sessions_lock:
+        previous = _user_sessions.pop(email, None)
+        if previous is not None:
+            previous.stop()
+        session = start_session(spec, lease_seconds=LIVE_LEASE_SECONDS, max_seconds=LIVE_MAX_SECONDS)
+        _user_sessions[email] = session
+    return session
+
+
+def user_session(email):
+    with _user_sessions_lock:
+        return _user_sessions.get(email)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: python live.py <camera index | stream URL | video file>")
+        sys.exit(1)
+    session = start_session(sys.argv[1])
+    try:
+        while session.status == RUNNING:
+            time.sleep(session.refresh_seconds)
+            print(session.indicators())
+    except KeyboardInterrupt:
+        session.stop()
+    session.join(5)
+    print(session.status, session.error or "", session.indicators())
@@ -0,0 +1,286 @@
+"""
+Lightweight media server for files in videos/.
+
+Streamlit's st.video/st.image on a local path read the whole file into the page on
+every rerun. Embedding a URL from this server instead lets the browser fetch only the
+byte ranges it needs when seeking, and revalidate repeat views with ETag /
+Last-Modified instead of downloading the file again.
+
+Student videos are private: every URL is signed for one file and expires (see
+media_url, which only signs files of a video the user has access to), and
+responses may only be cached by the user's own browser. The server listens on
+127.0.0.1. A browser on another machine reaches it through a reverse proxy that
+forwards one path (e.g. /scope-media/ on the app's own origin) and SCOPE_MEDIA_URL
+set to that path; without one, media_url returns None and the app falls back to
+Streamlit's own file serving.
+
+GET /metrics returns the pipeline metrics in Prometheus text format (see metrics.py),
+to local clients that are not behind the proxy or with the SCOPE_METRICS_TOKEN bearer token.
+"""
+import os
+import re
+import hmac
+import mmap
+import time
+import errno
+import hashlib
+import threading
+import mimetypes
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import quote, unquote, urlsplit, parse_qs
+
+from access_map import access_map
+
+MEDIA_ROOT = "videos"
+MEDIA_HOST = os.environ.get("SCOPE_MEDIA_HOST", "127.0.0.1")
+MEDIA_PORT = int(os.environ.get("SCOPE_MEDIA_PORT", "8502"))
+# URL the browser uses to reach the server, e.g. "/scope-media" proxied on the app's
+# origin. Unset, only browsers on this machine are given media URLs.
+MEDIA_URL = os.environ.get("SCOPE_MEDIA_URL", "")
+# Signed URLs stay valid between MEDIA_URL_TTL and twice that long; within one
+# period a file keeps the same URL, so reruns do not make the browser reload it
+MEDIA_URL_TTL = int(os.environ.get("SCOPE_MEDIA_URL_TTL", "3600"))
+MEDIA_KEY_PATH = "data/media.key"
+METRICS_TOKEN = os.environ.get("SCOPE_METRICS_TOKEN", "")
+
+CHUNK_SIZE = 256 * 1024
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+_LOOPBACK = ("127.0.0.1", "::1", "localhost")
+
+_key = None
+_key_lock = threading.Lock()
+
+
+def _signing_key():
+    """
+    Secret the URLs are signed with: SCOPE_MEDIA_SECRET, or a random key kept in
+    MEDIA_KEY_PATH so that every process of the deployment shares it.
+    """
+    global _key
+    with _key_lock:
+        if _key is None:
+            secret = os.environ.get("SCOPE_MEDIA_SECRET")
+            if secret:
+                _key = secret.encode("utf-8")
+            else:
+                os.makedirs(os.path.dirname(MEDIA_KEY_PATH), exist_ok=True)
+                try:
+                    fd = os.open(MEDIA_KEY_PATH, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+                    with os.fdopen(fd, "w") as f:
+                        f.write(os.urandom(32).hex())
+                except FileExistsError:
+                    pass
+                with open(MEDIA_KEY_PATH, "r") as f:
+                    _key = f.read().strip().encode("utf-8")
+        return _key
+
+
+def _signature(filename, expires):
+    return hmac.new(_signing_key(), f"{filename}\n{expires}".encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+class MediaRequestHandler(BaseHTTPRequestHandler):
+    root = MEDIA_ROOT
+
+    def log_message(self, format, *args):
+        pass
+
+    def _resolve(self):
+        """
+        Path of the requested file and the seconds its URL stays valid, or None if
+        the URL is not a valid, unexpired signed URL of an existing file.
+        """
+        url = urlsplit(self.path)
+        path = unquote(url.path)
+        if not path.startswith("/media/"):
+            return None
+        filename = path[len("/media/"):]
+        query = parse_qs(url.query)
+        try:
+            expires = int(query["expires"][0])
+            signature = query["signature"][0]
+        except (KeyError, ValueError):
+            return None
+        remaining = expires - int(time.time())
+        if remaining <= 0 or not hmac.compare_digest(signature, _signature(filename, expires)):
+            return None
+        root = os.path.realpath(self.root)
+        full_path = os.path.realpath(os.path.join(root, filename))
+        if not full_path.startswith(root + os.sep) or not os.path.isfile(full_path):
+            return None
+        return full_path, remaining
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        if urlsplit(self.path).path == "/metrics":
+            self._serve_metrics()
+            return
+        self._serve(send_body=True)
+
+    def _metrics_allowed(self):
+        if METRICS_TOKEN:
+            return hmac.compare_digest(self.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}")
+        # Proxied requests come from the proxy's loopback address too, but carry its headers
+        return self.client_address[0] in _LOOPBACK and "X-Forwarded-For" not in self.headers
+
+    def _serve_metrics(self):
+        from metrics import prometheus_text
+
+        if not self._metrics_allowed():
+            self.send_error(403)
+            return
+
+        body = prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _serve(self, send_body):
+        resolved = self._resolve()
+        if resolved is None:
+            self.send_error(404)
+            return
+        full_path, max_age = resolved
+        stat = os.stat(full_path)
+        size = stat.st_size
+        etag = f'"{size:x}-{stat.st_mtime_ns:x}"'
+        last_modified = formatdate(stat.st_mtime, usegmt=True)
+
+        if self._not_modified(etag, stat.st_mtime):
+            self.send_response(304)
+            self._send_cache_headers(etag, last_modified, max_age)
+            self.end_headers()
+            return
+
+        start, end = 0, size - 1
+        range_header = self.headers.get("Range")
+        # A stale If-Range means the client's partial copy is outdated: send everything
+        if range_header and self.headers.get("If-Range", etag) == etag:
+            match = _RANGE.match(range_header.strip())
+            if match is None or match.groups() == ("", ""):
+                self._send_unsatisfiable(size)
+                return
+            first, last = match.groups()
+            if first:
+                start, end = int(first), min(int(last), size - 1) if last else size - 1
+            else:
+                start, end = max(size - int(last), 0), size - 1
+            if start > end or start >= size:
+                self._send_unsatisfiable(size)
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+
+        length = end - start + 1 if size else 0
+        self.send_header("Content-Type", mimetypes.guess_type(full_path)[0] or "application/octet-stream")
+        self.send_header("Content-Length", str(length))
+        self.send_header("Accept-Ranges", "bytes")
+        self._send_cache_headers(etag, last_modified, max_age)
+        self.end_headers()
+        if not send_body or length == 0:
+            return
+
+        with open(full_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            position = start
+            try:
+                while position <= end:
+                    next_position = min(position + CHUNK_SIZE, end + 1)
+                    self.wfile.write(mapped[position:next_position])
+                    position = next_position
+            except (BrokenPipeError, ConnectionResetError):
+                # The browser dropped the request, e.g. after seeking elsewhere
+                pass
+
+    def _not_modified(self, etag, mtime):
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            return etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since:
+            try:
+                return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def _send_cache_headers(self, etag, last_modified, max_age):
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", last_modified)
+        # Only the user's browser may keep a copy, and not beyond the URL's lifetime
+        self.send_header("Cache-Control", f"private, max-age={max_age}")
+
+    def _send_unsatisfiable(self, size):
+        self.send_response(416)
+        self.send_header("Content-Range", f"bytes */{size}")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_media_server(host=MEDIA_HOST, port=MEDIA_PORT):
+    """
+    Starts the media server in a daemon thread once per process.
+    If the port is already taken, e.g. by another worker of the same deployment, that
+    server is assumed to serve the same directory with the same signing key.
+    """
+    global _server
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((host, port), MediaRequestHandler)
+            except OSError as e:
+                if e.errno != errno.EADDRINUSE:
+                    raise
+                return
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="scope-media-server", daemon=True).start()
+
+
+def media_base_url(browser_host=None):
+    """
+    Base URL under which the browser reaches the media server: SCOPE_MEDIA_URL, or the
+    server itself when the browser runs on this machine (browser_host is the Host
+    header of the page request). None when neither applies.
+    """
+    if MEDIA_URL:
+        return MEDIA_URL.rstrip("/")
+    hostname = urlsplit(f"//{browser_host}").hostname if browser_host else None
+    if hostname in _LOOPBACK:
+        return f"http://{hostname}:{MEDIA_PORT}"
+    return None
+
+
+def media_url(filename, video, email, browser_host=None):
+    """
+    Signed, expiring browser URL of a file in videos/ that belongs to `video` (the
+    video itself or one of its derived files), starting the server on first use.
+    Raises PermissionError unless email has access to the video. Returns None if the
+    browser cannot reach the server (see media_base_url).
+    """
+    video_id = os.path.splitext(os.path.basename(video))[0]
+    if not access_map.has_access(email, video) or video_id not in os.path.basename(filename):
+        raise PermissionError(f"{email or 'anonymous'} has no access to {filename}")
+    base_url = media_base_url(browser_host)
+    if base_url is None:
+        return None
+    start_media_server()
+    expires = (int(time.time()) // MEDIA_URL_TTL + 2) * MEDIA_URL_TTL
+    return (f"{base_url}/media/{quote(filename)}"
+            f"?expires={expires}&signature={_signature(filename, expires)}")
+
+
+if __name__ == "__main__":
+    start_media_server()
+    print(f"Serving signed URLs for {MEDIA_ROOT}/ on {MEDIA_HOST}:{MEDIA_PORT}")
+    threading.Event().wait()
@@ -0,0 +1,321 @@
+"""
+Process-wide counters and latency histograms for the analysis path.
+
+    from metrics import timed, count
+
+    @timed("read_full_report")            # or: with timed("analyze_video", mode="fast"):
+    def read_full_report(...): ...
+
+    count("uploads_total", duplicate="yes")
+
+Every process (the Streamlit server and each analysis worker) keeps its own registry
+and writes a snapshot to data/metrics/<pid>.json on flush(). While it lives, the process
+holds a lock on data/metrics/<pid>.lock; snapshots whose lock can be taken belong to
+processes that have exited and are removed, so their counters drop out of the totals
+(a counter reset, as after a restart). The media server's /metrics endpoint serves
+the merged snapshots in Prometheus text format, and with SCOPE_METRICS_JSONL set every
+flush also appends the snapshot to that JSONL file.
+
+Profiling: SCOPE_PROFILE=analyze_video (comma-separated timer names) runs the next
+call of each named timer in this process under cProfile and writes
+data/profiles/<name>-<time>-<pid>.prof. To profile a single analysis in-process,
+which also suits py-spy (py-spy record -- python metrics.py profile ...):
+
+    python metrics.py profile videos/1100021003.mp4 [mode]
+    python metrics.py show        # merged metrics in Prometheus text format
+"""
+import os
+import sys
+import json
+import time
+import fcntl
+import cProfile
+import threading
+from contextlib import ContextDecorator
+
+METRICS_DIR = "data/metrics"
+PROFILE_DIR = "data/profiles"
+METRICS_JSONL = os.environ.get("SCOPE_METRICS_JSONL", "")
+
+# Upper bounds (seconds) of the latency histogram buckets; the last bucket is +Inf
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+class Registry:
+    """
+    Counters and histograms keyed by (name, labels). Thread-safe.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._counters = {}
+        self._histograms = {}  # key -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def count(self, name, amount=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        key = _key(name, labels)
+        index = next((i for i, bound in enumerate(self.buckets) if seconds <= bound), len(self.buckets))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            histogram[index] += 1
+            histogram[-1] += seconds
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "time": time.time(),
+                "buckets": list(self.buckets),
+                "counters": [[name, dict(labels), value] for (name, labels), value in self._counters.items()],
+                "histograms": [[name, dict(labels), list(values)] for (name, labels), values in self._histograms.items()],
+            }
+
+
+registry = Registry()
+_profile_next = set(filter(None, os.environ.get("SCOPE_PROFILE", "").split(",")))
+_profile_lock = threading.Lock()
+
+
+def count(name, amount=1, **labels):
+    registry.count(name, amount, **labels)
+
+
+def profile_next(name):
+    """
+    Runs the next call of the timer `name` in this process under cProfile.
+    """
+    with _profile_lock:
+        _profile_next.add(name)
+
+
+class timed(ContextDecorator):
+    """
+    Times a block or function into the histogram "<name>_seconds" and counts calls
+    that raise in "<name>_errors_total".
+    """
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+        self._local = threading.local()
+
+    def __enter__(self):
+        profiler = None
+        if _profile_next:
+            with _profile_lock:
+                if self.name in _profile_next:
+                    _profile_next.discard(self.name)
+                    profiler = cProfile.Profile()
+        # Per thread, so one decorated function can be timed from several sessions at once
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append((time.perf_counter(), profiler))
+        if profiler is not None:
+            profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        start, profiler = self._local.stack.pop()
+        seconds = time.perf_counter() - start
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            profiler.dump_stats(os.path.join(PROFILE_DIR, f"{self.name}-{int(time.time())}-{os.getpid()}.prof"))
+        registry.observe(f"{self.name}_seconds", seconds, **self.labels)
+        if exc_type is not None:
+            registry.count(f"{self.name}_errors_total", **self.labels)
+        return False
+
+
+_owner_locks = {}  # metrics_dir -> (pid, open lock file held for the life of the process)
+
+
+def _hold_owner_lock(metrics_dir):
+    """
+    Takes this process's lock on <metrics_dir>/<pid>.lock, once per process, so that
+    readers can tell its snapshot from the one of an exited process.
+    """
+    held = _owner_locks.get(metrics_dir)
+    if held is not None and held[0] == os.getpid():
+        return
+    path = os.path.join(metrics_dir, f"{os.getpid()}.lock")
+    while True:
+        lock_file = open(path, "a")
+        fcntl.flock(lock_file, fcntl.LOCK_SH)
+        # A reader may have removed the file of a dead process with the same pid meanwhile
+        try:
+            if os.stat(path).st_ino == os.fstat(lock_file.fileno()).st_ino:
+                break
+        except FileNotFoundError:
+            pass
+        lock_file.close()
+    _owner_locks[metrics_dir] = (os.getpid(), lock_file)
+
+
+def _remove_if_exited(metrics_dir, pid):
+    """
+    Removes the snapshot of process pid if that process has exited. Returns True if it did.
+    """
+    lock_path = os.path.join(metrics_dir, f"{pid}.lock")
+    try:
+        lock_file = open(lock_path, "r")
+    except FileNotFoundError:
+        lock_file = None
+    try:
+        if lock_file is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+        for path in (os.path.join(metrics_dir, f"{pid}.json"), lock_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        return True
+    finally:
+        if lock_file is not None:
+            lock_file.close()
+
+
+def flush(metrics_dir=METRICS_DIR, jsonl_path=None):
+    """
+    Writes this process's snapshot to <metrics_dir>/<pid>.json, and appends it to
+    the JSONL export if one is configured.
+    """
+    snapshot = registry.snapshot()
+    os.makedirs(metrics_dir, exist_ok=True)
+    _hold_owner_lock(metrics_dir)
+    path = os.path.join(metrics_dir, f"{snapshot['pid']}.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(snapshot, f)
+    os.replace(path + ".tmp", path)
+    jsonl_path = jsonl_path or METRICS_JSONL
+    if jsonl_path:
+        with open(jsonl_path, "a") as f:
+            f.write(json.dumps(snapshot) + "\n")
+    return path
+
+
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def start_flusher(interval=60.0):
+    """
+    Flushes this process's metrics every `interval` seconds from a daemon thread,
+    started once per process.
+    """
+    global _flusher
+    with _flusher_lock:
+        if _flusher is None:
+            def run():
+                while True:
+                    time.sleep(interval)
+                    flush()
+            _flusher = threading.Thread(target=run, name="scope-metrics-flusher", daemon=True)
+            _flusher.start()
+
+
+def merged_snapshots(metrics_dir=METRICS_DIR):
+    """
+    This process's live registry plus the last flushed snapshot of every other live
+    process. Snapshots of exited processes are removed.
+    """
+    snapshots = [registry.snapshot()]
+    if os.path.isdir(metrics_dir):
+        for name in os.listdir(metrics_dir):
+            if name.endswith(".json") and name != f"{os.getpid()}.json":
+                if _remove_if_exited(metrics_dir, name[:-len(".json")]):
+                    continue
+                try:
+                    with open(os.path.join(metrics_dir, name), "r") as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+    return snapshots
+
+
+def _label_value(value):
+    # Escaping of the text exposition format: backslash, double quote and line feed
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels_text(labels, extra=None):
+    items = sorted(labels.items()) + (extra or [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_label_value(v)}"' for k, v in items) + "}"
+
+
+def prometheus_text(metrics_dir=METRICS_DIR, prefix="scope_"):
+    """
+    Merged metrics of all processes in the Prometheus text exposition format.
+    """
+    counters, histograms = {}, {}
+    for snapshot in merged_snapshots(metrics_dir):
+        for name, labels, value in snapshot["counters"]:
+            key = _key(name, labels)
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, values in snapshot["histograms"]:
+            if snapshot["buckets"] != list(LATENCY_BUCKETS):
+                continue
+            key = _key(name, labels)
+            merged = histograms.setdefault(key, [0] * len(values))
+            histograms[key] = [a + b for a, b in zip(merged, values)]
+
+    lines = []
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f"# TYPE {prefix}{name} counter")
+        for (key_name, labels), value in sorted(counters.items()):
+            if key_name == name:
+                lines.append(f"{prefix}{name}{_labels_text(dict(labels))} {value}")
+    for name in sorted({name for name, _ in histograms}):
+        lines.append(f"# TYPE {prefix}{name} histogram")
+        for (key_name, labels), values in sorted(histograms.items()):
+            if key_name != name:
+                continue
+            labels = dict(labels)
+            cumulative = 0
+            for bound, bucket in zip(list(LATENCY_BUCKETS) + ["+Inf"], values[:-1]):
+                cumulative += bucket
+                lines.append(f"{prefix}{name}_bucket{_labels_text(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{prefix}{name}_sum{_labels_text(labels)} {values[-1]:.6f}")
+            lines.append(f"{prefix}{name}_count{_labels_text(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+def _profile_analysis(video_path, mode="full"):
+    import pstats
+    from utils import analyze_video
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    analyze_video(video_path, mode=mode)
+    profiler.disable()
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"analyze_video-{int(time.time())}-{os.getpid()}.prof")
+    profiler.dump_stats(path)
+    pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+    print(f"Profile written to {path}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 3 and sys.argv[1] == "profile":
+        _profile_analysis(sys.argv[2], *sys.argv[3:4])
+    elif len(sys.argv) == 2 and sys.argv[1] == "show":
+        print(prometheus_text(), end="")
+    else:
+        print("usage: python metrics.py profile <video> [mode] | show")
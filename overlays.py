@@ -0,0 +1,231 @@
+"""
+AU, blink and gaze overlays drawn from the stored per-frame features instead of one
+re-encoded annotated video per modality.
+
+Analysis writes a compact annotation track per video (a few KB of JSON) to
+videos/previews/overlays/: face boxes and gaze vectors sampled at OVERLAY_RATE, plus
+the active intervals of every AU and the blink events. At view time the original
+video (or its preview rendition) plays unchanged and a canvas on top of it draws the
+overlay of the current playback position in the browser.
+
+    python overlays.py                 # build tracks for every analyzed video in videos/
+    python overlays.py 1100021003.mp4
+"""
+import os
+import sys
+import json
+
+import numpy as np
+import cv2
+
+from analysis import ANALYZER_VERSION, FACE_BOX, FACE_COLUMNS, feature_path, load_features
+from report_synthesis import (
+    AU_NAMES, AU_ACTIVE_THRESHOLD, BLINK_CLOSED_RATIO, BLINK_MAX_SECONDS, run_lengths, sample_interval,
+)
+
+VIDEO_DIR = "videos"
+OVERLAY_DIR = os.path.join(VIDEO_DIR, "previews", "overlays")
+# Face boxes and gaze vectors are kept at this many samples per second
+OVERLAY_RATE = 10
+# Width of the page's main column in Streamlit's centered layout, used to size the player
+OVERLAY_VIEW_WIDTH = 704
+
+
+def _intervals(timestamps, mask, interval, max_seconds=None):
+    starts, lengths = run_lengths(mask)
+    if max_seconds is not None:
+        keep = lengths * interval <= max_seconds + 1e-6
+        starts, lengths = starts[keep], lengths[keep]
+    begin = timestamps[starts]
+    end = timestamps[starts + lengths - 1] + interval
+    return [[round(float(b), 2), round(float(e), 2)] for b, e in zip(begin, end)]
+
+
+def _frame_size(video_filename):
+    capture = cv2.VideoCapture(os.path.join(VIDEO_DIR, os.path.basename(video_filename)))
+    try:
+        return int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)) or 16, int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)) or 9
+    finally:
+        capture.release()
+
+
+def annotation_track(features, rate=OVERLAY_RATE, frame_size=(16, 9)):
+    """
+    Compact overlay data of one video: face boxes (per mille of the frame) and gaze
+    vectors (hundredths) at up to `rate` samples per second, AU active intervals and
+    blink events in seconds.
+    """
+    timestamps = np.asarray(features["timestamp"], dtype=np.float64)
+    interval = sample_interval(features)
+    step = max(1, int(round(1.0 / (rate * interval))))
+    sampled = slice(None, None, step)
+    if FACE_COLUMNS[0] in features:
+        boxes = np.stack([features[column] for column in FACE_COLUMNS], axis=1)
+    else:
+        # Features of analyzer versions before the face tracker
+        x0, y0, x1, y1 = FACE_BOX
+        boxes = np.tile([x0, y0, x1 - x0, y1 - y0], (len(timestamps), 1))
+    gaze = np.stack([features["gaze.gaze_x"], features["gaze.gaze_y"]], axis=1)
+    openness = features["blink.eye_openness"]
+    return {
+        "version": ANALYZER_VERSION,
+        "width": int(frame_size[0]),
+        "height": int(frame_size[1]),
+        "duration": round(float(features["total_frames"] / features["fps"]), 2),
+        "t": np.round(timestamps[sampled], 2).tolist(),
+        "face": np.round(boxes[sampled] * 1000).astype(int).tolist(),
+        "gaze": np.round(gaze[sampled] * 100).astype(int).tolist(),
+        "au": {
+            AU_NAMES[column]: _intervals(timestamps, features[column] > AU_ACTIVE_THRESHOLD, interval)
+            for column in AU_NAMES if column in features
+        },
+        "blink": _intervals(timestamps, openness < np.median(openness) * BLINK_CLOSED_RATIO, interval,
+                            BLINK_MAX_SECONDS) if len(openness) else [],
+    }
+
+
+def overlay_path(video_filename, version=ANALYZER_VERSION):
+    stem = os.path.splitext(os.path.basename(video_filename))[0]
+    return os.path.join(OVERLAY_DIR, f"{stem}.{version}.json")
+
+
+def overlay_for(video_filename):
+    """
+    Name (relative to videos/) of the annotation track of an analyzed video, building
+    it from the stored features if it is missing or older than the features.
+    Returns None if the video has no full-rate features.
+    """
+    source = feature_path(video_filename)
+    if not os.path.exists(source):
+        return None
+    path = overlay_path(video_filename)
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(source):
+        track = annotation_track(load_features(video_filename), frame_size=_frame_size(video_filename))
+        os.makedirs(OVERLAY_DIR, exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            json.dump(track, f, separators=(",", ":"))
+        os.replace(path + ".tmp", path)
+    return os.path.relpath(path, VIDEO_DIR)
+
+
+def load_track(name):
+    with open(os.path.join(VIDEO_DIR, name), "r") as f:
+        return json.load(f)
+
+
+def player_height(track, width=OVERLAY_VIEW_WIDTH):
+    return int(round(width * track["height"] / track["width"])) + 10
+
+
+_PLAYER = """
+<div style="position: relative; width: 100%; font-family: sans-serif;">
+  <video id="video" src="__SRC__" controls playsinline style="width: 100%; display: block;"></video>
+  <canvas id="overlay" style="position: absolute; left: 0; top: 0; pointer-events: none;"></canvas>
+</div>
+<script>
+const track = __TRACK__;
+const kind = "__KIND__";
+const video = document.getElementById("video");
+const canvas = document.getElementById("overlay");
+const ctx = canvas.getContext("2d");
+
+// Last sample at or before t
+function sampleAt(t) {
+  let lo = 0, hi = track.t.length - 1;
+  if (hi < 0 || t < track.t[0]) return -1;
+  while (lo < hi) {
+    const mid = (lo + hi + 1) >> 1;
+    if (track.t[mid] <= t) lo = mid; else hi = mid - 1;
+  }
+  return lo;
+}
+
+function within(intervals, t) {
+  return intervals.some(([start, end]) => start <= t && t < end);
+}
+
+function label(text, x, y, color) {
+  ctx.font = "bold 14px sans-serif";
+  const width = ctx.measureText(text).width;
+  ctx.fillStyle = "rgba(0, 0, 0, 0.6)";
+  ctx.fillRect(x, y - 15, width + 8, 19);
+  ctx.fillStyle = color;
+  ctx.fillText(text, x + 4, y);
+}
+
+function draw() {
+  // Content rectangle of the video inside its element (letterboxing excluded)
+  const w = video.clientWidth, h = video.clientHeight;
+  const scale = Math.min(w / (video.videoWidth || track.width), h / (video.videoHeight || track.height));
+  const cw = (video.videoWidth || track.width) * scale, ch = (video.videoHeight || track.height) * scale;
+  const ox = (w - cw) / 2, oy = (h - ch) / 2;
+  if (canvas.width !== w || canvas.height !== h) {
+    canvas.width = w;
+    canvas.height = h;
+  }
+  ctx.clearRect(0, 0, w, h);
+  const t = video.currentTime;
+  const i = sampleAt(t);
+  if (i >= 0) {
+    const [fx, fy, fw, fh] = track.face[i].map(v => v / 1000);
+    const x = ox + fx * cw, y = oy + fy * ch, bw = fw * cw, bh = fh * ch;
+    ctx.lineWidth = 2;
+    if (kind === "au") {
+      ctx.strokeStyle = "#1a73e8";
+      ctx.strokeRect(x, y, bw, bh);
+      let row = 0;
+      for (const [name, intervals] of Object.entries(track.au)) {
+        if (within(intervals, t)) label(name, x + 4, y + 20 + 22 * row++, "#ffd54f");
+      }
+    } else if (kind === "blink") {
+      const closed = within(track.blink, t);
+      ctx.strokeStyle = closed ? "#e53935" : "#43a047";
+      ctx.strokeRect(x, y + 0.30 * bh, bw, 0.15 * bh);
+      const blinks = track.blink.filter(([start]) => start <= t).length;
+      label((closed ? "BLINK  " : "") + "Blinks: " + blinks, x, y - 6, closed ? "#ff8a80" : "#ffffff");
+    } else if (kind === "gaze") {
+      const [gx, gy] = track.gaze[i].map(v => v / 100);
+      const cx = x + bw / 2, cy = y + 0.375 * bh;
+      const ex = cx + gx * bw * 0.5, ey = cy + gy * bh * 0.5;
+      ctx.strokeStyle = "#00e676";
+      ctx.beginPath();
+      ctx.moveTo(cx, cy);
+      ctx.lineTo(ex, ey);
+      ctx.stroke();
+      ctx.beginPath();
+      ctx.arc(ex, ey, 4, 0, 2 * Math.PI);
+      ctx.fillStyle = "#00e676";
+      ctx.fill();
+    }
+  }
+  requestAnimationFrame(draw);
+}
+requestAnimationFrame(draw);
+</script>
+"""
+
+
+def overlay_html(video_url, track, kind):
+    """
+    HTML of a player for video_url with the `kind` ("au", "blink" or "gaze") overlay
+    of an annotation track drawn on a canvas over it, for st.iframe.
+    """
+    return (_PLAYER.replace("__SRC__", video_url)
+            .replace("__KIND__", kind)
+            .replace("__TRACK__", json.dumps(track, separators=(",", ":"))))
+
+
+def main(filenames):
+    filenames = filenames or sorted(
+        f for f in os.listdir(VIDEO_DIR) if f.endswith(".mp4") and os.path.exists(feature_path(f))
+    )
+    for filename in filenames:
+        name = overlay_for(filename)
+        if name is None:
+            print(f"{filename}: not analyzed")
+        else:
+            print(f"{os.path.join(VIDEO_DIR, name)} ({os.path.getsize(os.path.join(VIDEO_DIR, name)) / 1024:.1f} KB)")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
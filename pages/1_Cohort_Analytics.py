@@ -0,0 +1,77 @@
+import streamlit as st
+import numpy as np
+import pandas as pd
+from cohort import load_table
+from utils import get_user_videos
+from access_map import access_map
+from analysis import uses_placeholders
+from report_synthesis import PLACEHOLDER_NOTICE
+
+
+# =================== 页面设置 ====================
+st.set_page_config(page_title="SCOPE: Cohort Analytics", layout="wide")
+
+# =================== 数据表（列式、内存映射；报告库变化时重建） ====================
+@st.cache_resource(ttl=30, show_spinner="Loading cohort tables...")
+def cohort_table():
+    return load_table()
+
+st.title("Cohort Analytics")
+email = st.session_state.get("email", "")
+if not email:
+    st.warning("Please log in on the main page first.")
+    st.stop()
+
+table = cohort_table()
+if uses_placeholders():
+    st.warning(PLACEHOLDER_NOTICE, icon="⚠️")
+if len(table) == 0:
+    st.info("No analyzed sessions yet.")
+    st.stop()
+
+# =================== 范围选择（工作人员可看全部会话） ====================
+scope = f"Videos of {email}"
+if access_map.is_staff(email):
+    scope = st.radio("Sessions", [scope, "All sessions"], horizontal=True)
+mask = table.mask(videos=get_user_videos(email)) if scope != "All sessions" else None
+
+# =================== 总览 ====================
+summary = table.student_summary(mask)
+sessions = int(summary["sessions"].sum())
+col1, col2, col3 = st.columns(3)
+col1.metric("Sessions", sessions)
+col2.metric("Students", len(summary["student"]))
+col3.metric("Mean engagement", f"{np.nanmean(summary['engagement']) * 100:.0f}%" if sessions else "-")
+
+# =================== 学生汇总 ====================
+st.markdown("#### Students")
+students = pd.DataFrame(summary).sort_values("sessions", ascending=False)
+st.dataframe(
+    students,
+    hide_index=True,
+    column_config={
+        "engagement": st.column_config.NumberColumn("Engagement", format="%.2f"),
+        "engagement_trend": st.column_config.NumberColumn("Trend / session", format="%+.3f"),
+        "blink_rate": st.column_config.NumberColumn("Blinks / min", format="%.1f"),
+        "valence_mean": st.column_config.NumberColumn("Valence", format="%.2f"),
+        "arousal_mean": st.column_config.NumberColumn("Arousal", format="%.2f"),
+        "curated": st.column_config.NumberColumn("Curated", format="percent"),
+    },
+)
+st.caption("Curated: share of sessions whose values are taken from hand-written reports, not measured by the analyzer.")
+
+# =================== 单个学生的趋势 ====================
+if len(students):
+    student = st.selectbox("Student", students["student"].tolist())
+    trend = table.engagement_trend(student, mask)
+    st.markdown(f"#### Engagement across sessions of {student}")
+    st.line_chart(pd.DataFrame(
+        {"engagement": trend["engagement"], "valence": trend["valence_mean"], "arousal": trend["arousal_mean"]},
+        index=pd.Index(trend["session"], name="session"),
+    ))
+
+# =================== AU 出现率 ====================
+st.markdown("#### AU prevalence")
+prevalence = pd.DataFrame(table.au_prevalence(mask)).T
+st.bar_chart(prevalence["mean_active_pct"])
+st.dataframe(prevalence)
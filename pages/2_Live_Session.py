@@ -0,0 +1,77 @@
+import streamlit as st
+import pandas as pd
+from live import (allowed_sources, start_user_session, user_session, LIVE_REFRESH_SECONDS, LIVE_WINDOW_SECONDS,
+                  RUNNING)
+from analysis import uses_placeholders
+from report_synthesis import PLACEHOLDER_NOTICE
+from metrics import start_flusher
+
+
+# =================== 页面设置 ====================
+st.set_page_config(page_title="SCOPE: Live Session", layout="centered")
+start_flusher()
+
+if 'live_session' not in st.session_state:
+    st.session_state.live_session = None
+
+st.title("Live Session")
+st.markdown(f"Rolling indicators over the last {LIVE_WINDOW_SECONDS:.0f} seconds, "
+            f"refreshed every {LIVE_REFRESH_SECONDS:g} s. Frames are dropped when analysis falls behind, "
+            "so the indicators stay close to real time.")
+if uses_placeholders():
+    st.warning(PLACEHOLDER_NOTICE, icon="⚠️")
+
+# =================== 登录检查 ====================
+email = st.session_state.get("email", "")
+if not email:
+    st.warning("Log in with your email on the main page to start a live session.")
+    st.stop()
+
+# 刷新或重新打开页面后，之前页面启动的会话已无人查看：停止它
+registered = user_session(email)
+if registered is not None and registered is not st.session_state.live_session:
+    registered.stop()
+
+# =================== 帧来源（管理员配置的摄像头/视频流，或回放自己的视频） ====================
+sources = allowed_sources(email)
+if not sources:
+    st.info("No frame sources are available to you. Ask the admin to configure a camera or stream.")
+    st.stop()
+source = st.selectbox("Frame source", list(sources),
+                      help="A camera or stream set up by the admin, or one of your videos replayed in real time.")
+
+session = st.session_state.live_session
+col1, col2 = st.columns(2)
+if col1.button("Start", disabled=session is not None and session.status == RUNNING):
+    try:
+        st.session_state.live_session = session = start_user_session(email, sources[source])
+    except (ValueError, PermissionError) as e:
+        st.error(str(e))
+if col2.button("Stop", disabled=session is None or session.status != RUNNING):
+    session.stop()
+
+# =================== 实时指标（固定频率刷新） ====================
+@st.fragment(run_every=LIVE_REFRESH_SECONDS)
+def live_view():
+    session = st.session_state.live_session
+    if session is None:
+        st.info("Start a session to see live indicators.")
+        return
+    # 页面仍在查看：续租，否则会话到期自动停止
+    session.touch()
+    snapshot = session.indicators()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Engagement", "-" if snapshot["engagement"] is None else f"{snapshot['engagement'] * 100:.0f}%")
+    col2.metric("Confusion", "-" if snapshot["confusion"] is None else f"{snapshot['confusion'] * 100:.0f}%")
+    col3.metric("Latency p95", "-" if snapshot["latency_p95_ms"] is None else f"{snapshot['latency_p95_ms']:.0f} ms")
+    col4.metric("Dropped", f"{snapshot['drop_rate'] * 100:.1f}%")
+    history = list(session.history)
+    if history:
+        st.line_chart(pd.DataFrame(history).set_index("elapsed_seconds")[["engagement", "confusion"]])
+    st.caption(f"{session.status.capitalize()} · {snapshot['captured']} frames captured, "
+               f"{snapshot['analyzed']} analyzed ({snapshot['analyzed_fps']:g} fps), {snapshot['dropped']} dropped · "
+               f"latency p50 {snapshot['latency_p50_ms'] or 0:.0f} ms")
+    if session.error:
+        st.error(f"Live session failed: {session.error}")
+
+live_view()
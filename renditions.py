@@ -0,0 +1,172 @@
+"""
+Lightweight derivatives for the video library: low-bitrate preview renditions and
+sprite strips, written to videos/previews/.
+
+    python renditions.py            # every .mp4 in videos/
+    python renditions.py 1100021003.mp4
+"""
+import os
+import sys
+import shutil
+import subprocess
+
+import numpy as np
+import cv2
+
+VIDEO_DIR = "videos"
+PREVIEW_DIR = os.path.join(VIDEO_DIR, "previews")
+
+# Rendition ladder: label -> (height, video bitrate). The first one is shown by default;
+# every rung costs an encode per video, so only add one the UI lets users pick
+RENDITIONS = {
+    "240p": (240, "250k"),
+}
+SPRITE_FRAMES = 10
+SPRITE_HEIGHT = 90
+
+
+def ffmpeg_exe():
+    """
+    System ffmpeg if installed, otherwise the binary bundled with imageio-ffmpeg.
+    """
+    path = shutil.which("ffmpeg")
+    if path:
+        return path
+    import imageio_ffmpeg
+    return imageio_ffmpeg.get_ffmpeg_exe()
+
+
+def _stem(video_filename):
+    return os.path.splitext(os.path.basename(video_filename))[0]
+
+
+def rendition_path(video_filename, label):
+    return os.path.join(PREVIEW_DIR, f"{_stem(video_filename)}.{label}.mp4")
+
+
+def sprite_path(video_filename):
+    return os.path.join(PREVIEW_DIR, f"{_stem(video_filename)}.sprite.jpg")
+
+
+def _up_to_date(target, source):
+    return os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(source)
+
+
+def _write_atomic_image(path, image):
+    tmp_path = path + ".tmp.jpg"
+    cv2.imwrite(tmp_path, image, [cv2.IMWRITE_JPEG_QUALITY, 80])
+    os.replace(tmp_path, path)
+
+
+def make_rendition(source, target, height, bitrate):
+    tmp_path = target + ".tmp.mp4"
+    subprocess.run(
+        [
+            ffmpeg_exe(), "-y", "-loglevel", "error", "-i", source,
+            "-vf", f"scale=-2:'min({height},ih)'",
+            "-c:v", "libx264", "-preset", "veryfast", "-b:v", bitrate, "-maxrate", bitrate,
+            "-bufsize", bitrate, "-pix_fmt", "yuv420p",
+            "-c:a", "aac", "-b:a", "64k",
+            # moov atom first so playback starts before the download finishes
+            "-movflags", "+faststart",
+            tmp_path,
+        ],
+        check=True,
+    )
+    os.replace(tmp_path, target)
+
+
+def _read_frames(source, positions):
+    capture = cv2.VideoCapture(source)
+    try:
+        total = int(capture.get(cv2.CAP_PROP_FRAME_COUNT)) or 1
+        frames = []
+        for position in positions:
+            capture.set(cv2.CAP_PROP_POS_FRAMES, min(int(position * total), total - 1))
+            ok, frame = capture.read()
+            if ok:
+                frames.append(frame)
+        return frames
+    finally:
+        capture.release()
+
+
+def _resize_to_height(frame, height):
+    scale = height / frame.shape[0]
+    return cv2.resize(frame, (max(1, int(frame.shape[1] * scale)), height), interpolation=cv2.INTER_AREA)
+
+
+def make_sprite(source, target, count=SPRITE_FRAMES):
+    frames = _read_frames(source, [(i + 0.5) / count for i in range(count)])
+    if frames:
+        _write_atomic_image(target, np.hstack([_resize_to_height(f, SPRITE_HEIGHT) for f in frames]))
+
+
+def generate_derivatives(video_filename):
+    """
+    Creates any missing or outdated preview renditions and sprite strip for a file
+    in videos/. Returns the paths that were (re)generated.
+    """
+    source = os.path.join(VIDEO_DIR, os.path.basename(video_filename))
+    os.makedirs(PREVIEW_DIR, exist_ok=True)
+    generated = []
+    for label, (height, bitrate) in RENDITIONS.items():
+        target = rendition_path(video_filename, label)
+        if not _up_to_date(target, source):
+            make_rendition(source, target, height, bitrate)
+            generated.append(target)
+    target = sprite_path(video_filename)
+    if not _up_to_date(target, source):
+        make_sprite(source, target)
+        generated.append(target)
+    return generated
+
+
+def derivative_sources(video_filename):
+    """
+    A source video and every derived video named in its report entry (AU, blink,
+    gaze) that exists, sorted. The app submits derivatives jobs with this list, so a
+    finished job is reused only while no new derived video has appeared.
+    """
+    from report_store import report_db
+
+    video_filename = os.path.basename(video_filename)
+    entry = report_db.get(video_filename) or {}
+    return sorted({video_filename} | {
+        entry[field] for field in ("AU_video", "Eyeblink_video", "Gaze_tracking")
+        if entry.get(field) and os.path.exists(os.path.join(VIDEO_DIR, entry[field]))
+    })
+
+
+def generate_video_derivatives(video_path, progress=None, sources=None):
+    """
+    Generates derivatives for the files in sources (by default derivative_sources of
+    video_path). Used as the "derivatives" job task.
+    """
+    filenames = sources or derivative_sources(video_path)
+    generated = []
+    for i, filename in enumerate(filenames):
+        generated.extend(generate_derivatives(filename))
+        if progress is not None:
+            progress((i + 1) / len(filenames), "Generating previews")
+    return generated
+
+
+def preview_for(video_filename, label=None):
+    """
+    Name (relative to videos/) of the preview rendition of a video, or None if it has
+    not been generated yet.
+    """
+    path = rendition_path(video_filename, label or next(iter(RENDITIONS)))
+    return os.path.relpath(path, VIDEO_DIR) if os.path.exists(path) else None
+
+
+def main(filenames):
+    filenames = filenames or sorted(f for f in os.listdir(VIDEO_DIR) if f.endswith(".mp4"))
+    for filename in filenames:
+        for path in generate_derivatives(filename):
+            print(path)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,144 @@
+import os
+import csv
+import fcntl
+import hashlib
+import threading
+from contextlib import contextmanager
+
+from metrics import timed, count
+
+CSV_PATH = "data/output_report.csv"
+ARCHIVE_PATH = "data/output_report.parquet"
+COLUMNS = ["email", "original_video", "analyzed_video", "report"]
+
+# Rebuild the columnar archive after this many new rows
+COMPACT_EVERY = int(os.environ.get("SCOPE_REPORT_COMPACT_EVERY", "50"))
+
+
+def report_hash(report):
+    return hashlib.sha1(report.encode("utf-8")).hexdigest()
+
+
+class ReportSink:
+    """
+    Serialized, deduplicating writer for data/output_report.csv.
+    Appends are serialized by a thread lock plus an flock on a sidecar lock file, so
+    neither sessions of one server nor separate processes interleave rows. A row whose
+    (email, video, report hash) is already in the file is not written again.
+    The CSV is periodically compacted into a deduplicated Parquet archive for
+    cohort-level queries.
+    """
+
+    def __init__(self, csv_path=CSV_PATH, archive_path=ARCHIVE_PATH, compact_every=COMPACT_EVERY):
+        self.csv_path = csv_path
+        self.archive_path = archive_path
+        self.compact_every = compact_every
+        self._lock = threading.Lock()
+        self._keys = set()
+        self._signature = None
+        self._appended_since_compact = 0
+        self._compacting = False
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            os.makedirs(os.path.dirname(self.csv_path) or ".", exist_ok=True)
+            with open(self.csv_path + ".lock", "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _file_signature(self):
+        if not os.path.exists(self.csv_path):
+            return None
+        stat = os.stat(self.csv_path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _read_rows(self):
+        if not os.path.exists(self.csv_path):
+            return []
+        with open(self.csv_path, "r", newline="", encoding="utf-8") as f:
+            rows = [row for row in csv.reader(f) if len(row) == len(COLUMNS)]
+        # Older files were written without a header row
+        if rows and rows[0] == COLUMNS:
+            rows = rows[1:]
+        return rows
+
+    def _refresh_keys(self):
+        # Only re-read the CSV when another process has written to it
+        signature = self._file_signature()
+        if signature != self._signature:
+            self._keys = {(row[0], row[1], report_hash(row[3])) for row in self._read_rows()}
+            self._signature = signature
+
+    @timed("save_report")
+    def append(self, email, original_video, analyzed_video, report):
+        """
+        Appends one row unless an identical (email, video, report) row exists.
+        Returns True if the row was written.
+        """
+        key = (email, original_video, report_hash(report))
+        with self._locked():
+            self._refresh_keys()
+            if key in self._keys:
+                count("report_rows_total", result="duplicate")
+                return False
+            is_new = not os.path.exists(self.csv_path)
+            with open(self.csv_path, "a", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                if is_new:
+                    writer.writerow(COLUMNS)
+                writer.writerow([email, original_video, analyzed_video, report])
+            self._keys.add(key)
+            count("report_rows_total", result="saved")
+            self._signature = self._file_signature()
+            self._appended_since_compact += 1
+            should_compact = self._appended_since_compact >= self.compact_every and not self._compacting
+            if should_compact:
+                self._appended_since_compact = 0
+                self._compacting = True
+        if should_compact:
+            threading.Thread(target=self._compact_in_background, daemon=True).start()
+        return True
+
+    def _compact_in_background(self):
+        try:
+            self.compact()
+        finally:
+            self._compacting = False
+
+    def compact(self):
+        """
+        Rewrites the Parquet archive from the CSV, deduplicated on
+        (email, video, report hash). Returns the number of archived rows.
+        """
+        import pandas as pd
+
+        with self._locked():
+            rows = self._read_rows()
+        df = pd.DataFrame(rows, columns=COLUMNS)
+        df["report_hash"] = [report_hash(r) for r in df["report"]]
+        df = df.drop_duplicates(subset=["email", "original_video", "report_hash"], ignore_index=True)
+        tmp_path = self.archive_path + ".tmp"
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, self.archive_path)
+        return len(df)
+
+    def load_archive(self):
+        """
+        Returns the compacted reports as a DataFrame, building the archive if missing.
+        """
+        import pandas as pd
+
+        if not os.path.exists(self.archive_path):
+            self.compact()
+        return pd.read_parquet(self.archive_path)
+
+
+report_sink = ReportSink()
+
+
+def save_report_row(email, original_video, analyzed_video, report):
+    return report_sink.append(email, original_video, analyzed_video, report)
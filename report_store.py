@@ -0,0 +1,239 @@
+import os
+import sys
+import json
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+REPORT_JSON_PATH = "data/report.json"
+REPORT_DB_PATH = "data/reports.db"
+# Parsed entries kept in memory per process, least recently used evicted first
+REPORT_CACHE_ENTRIES = int(os.environ.get("SCOPE_REPORT_CACHE_ENTRIES", "1024"))
+
+
+class ReportDB:
+    """
+    Report storage keyed by video filename, backed by an SQLite table.
+    Point lookups go through the primary-key index, so latency stays flat as the
+    corpus grows, and adding or updating one video only rewrites that row.
+    The legacy data/report.json is imported the first time the table is opened and
+    again whenever the file changes (see _sync_legacy), as AccessMap does with
+    data/user_videos.json.
+
+    get() answers repeated lookups from a process-wide LRU cache of parsed entries
+    (at most cache_entries), with hit/miss counters in cache_stats(). The cache is
+    dropped whenever anything commits to the database, in this process or another.
+    """
+
+    def __init__(self, db_path=REPORT_DB_PATH, legacy_json=REPORT_JSON_PATH, cache_entries=REPORT_CACHE_ENTRIES):
+        self.db_path = db_path
+        self.legacy_json = legacy_json
+        self.cache_entries = cache_entries
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+        self._synced_signature = None
+        self._cache = OrderedDict()  # video -> parsed entry or None
+        self._cache_lock = threading.Lock()
+        self._watch = None
+        self._data_version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            # One connection per thread: Streamlit runs each session in its own thread
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        if not self._initialized:
+            self._initialize(conn)
+        self._sync_legacy(conn)
+        return conn
+
+    def _initialize(self, conn):
+        with self._init_lock:
+            if self._initialized:
+                return
+            with conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS reports ("
+                    " video TEXT PRIMARY KEY,"
+                    " data TEXT NOT NULL,"
+                    " updated_at REAL NOT NULL DEFAULT (strftime('%s', 'now')))"
+                )
+                conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self._initialized = True
+
+    def _sync_legacy(self, conn):
+        """
+        Re-imports the legacy JSON when its mtime or size differs from the last import.
+        Entries added or edited in the file since then are written; entries removed
+        from it are deleted unless the stored entry has changed since it was imported.
+        """
+        try:
+            stat = os.stat(self.legacy_json) if self.legacy_json else None
+        except FileNotFoundError:
+            stat = None
+        signature = f"{stat.st_mtime_ns}:{stat.st_size}" if stat else None
+        if signature is None or signature == self._synced_signature:
+            return
+        with self._init_lock:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'legacy_json_signature'").fetchone()
+            if row is None or row[0] != signature:
+                self._migrate(conn, self.legacy_json, signature)
+            self._synced_signature = signature
+
+    def _migrate(self, conn, json_path, signature=None):
+        with open(json_path, "r") as f:
+            data = json.load(f)
+        rows = {video: json.dumps(entry) for video, entry in data.items()}
+        with conn:
+            if signature is None:
+                conn.executemany("INSERT OR REPLACE INTO reports (video, data) VALUES (?, ?)", rows.items())
+            else:
+                # Apply only the difference to the previous import of the legacy file
+                row = conn.execute("SELECT value FROM meta WHERE key = 'legacy_json_entries'").fetchone()
+                previous = json.loads(row[0]) if row else {}
+                current = {video: hashlib.sha1(text.encode()).hexdigest() for video, text in rows.items()}
+                for video in previous.keys() - current.keys():
+                    stored = conn.execute("SELECT data FROM reports WHERE video = ?", (video,)).fetchone()
+                    if stored is not None and hashlib.sha1(stored[0].encode()).hexdigest() == previous[video]:
+                        conn.execute("DELETE FROM reports WHERE video = ?", (video,))
+                conn.executemany(
+                    "INSERT OR REPLACE INTO reports (video, data, updated_at) VALUES (?, ?, strftime('%s', 'now'))",
+                    [(video, rows[video]) for video in current if previous.get(video) != current[video]],
+                )
+                conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", [
+                    ("legacy_json_entries", json.dumps(current)),
+                    ("legacy_json_signature", signature),
+                ])
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('legacy_json_migrated', ?)",
+                (os.path.abspath(json_path),),
+            )
+        return len(data)
+
+    def migrate_from_json(self, json_path=None):
+        """
+        Imports (or re-imports) every entry of a report.json-style file.
+        Returns the number of entries written.
+        """
+        conn = self._conn()
+        return self._migrate(conn, json_path or self.legacy_json)
+
+    def _check_cache(self):
+        """
+        Clears the cache if the database changed since the last check and returns the
+        data version it is valid for. PRAGMA data_version, read on a connection of its
+        own, changes with every commit made through any other connection.
+        """
+        with self._cache_lock:
+            if self._watch is None:
+                self._watch = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            version = self._watch.execute("PRAGMA data_version").fetchone()[0]
+            if version != self._data_version:
+                self._data_version = version
+                self._cache.clear()
+            return version
+
+    def get(self, video_filename):
+        conn = self._conn()
+        version = self._check_cache()
+        with self._cache_lock:
+            if video_filename in self._cache:
+                self._cache.move_to_end(video_filename)
+                self.hits += 1
+                entry = self._cache[video_filename]
+                # A shallow copy, so callers can add or replace fields
+                return None if entry is None else dict(entry)
+            self.misses += 1
+        row = conn.execute("SELECT data FROM reports WHERE video = ?", (video_filename,)).fetchone()
+        entry = json.loads(row[0]) if row else None
+        with self._cache_lock:
+            # Not if the database changed (and the cache was cleared) since the read began
+            if version == self._data_version and self.cache_entries > 0:
+                self._cache[video_filename] = entry
+                while len(self._cache) > self.cache_entries:
+                    self._cache.popitem(last=False)
+                    self.evictions += 1
+        return None if entry is None else dict(entry)
+
+    def cache_stats(self):
+        with self._cache_lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "entries": len(self._cache)}
+
+    def put(self, video_filename, entry):
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO reports (video, data, updated_at) VALUES (?, ?, strftime('%s', 'now'))",
+                (video_filename, json.dumps(entry)),
+            )
+
+    def update(self, video_filename, **fields):
+        """
+        Merges fields into a video's entry, creating it if needed, and returns the result.
+        """
+        conn = self._conn()
+        with conn:
+            # BEGIN IMMEDIATE takes the write lock before the read, so concurrent
+            # updates of the same video cannot lose each other's fields
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT data FROM reports WHERE video = ?", (video_filename,)).fetchone()
+            entry = json.loads(row[0]) if row else {}
+            entry.update(fields)
+            conn.execute(
+                "INSERT OR REPLACE INTO reports (video, data, updated_at) VALUES (?, ?, strftime('%s', 'now'))",
+                (video_filename, json.dumps(entry)),
+            )
+        return entry
+
+    def delete(self, video_filename):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM reports WHERE video = ?", (video_filename,))
+
+    def videos(self):
+        return [row[0] for row in self._conn().execute("SELECT video FROM reports ORDER BY video")]
+
+    def iter_entries(self):
+        """
+        Yields (video, entry, updated_at) for every report, in video order.
+        """
+        for video, data, updated_at in self._conn().execute(
+                "SELECT video, data, updated_at FROM reports ORDER BY video"):
+            yield video, json.loads(data), updated_at
+
+    def signature(self):
+        """
+        Cheap fingerprint of the table's content, for derived data to detect changes.
+        """
+        return list(self._conn().execute(
+            "SELECT COUNT(*), MAX(updated_at), SUM(LENGTH(data)) FROM reports").fetchone())
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM reports").fetchone()[0]
+
+
+report_db = ReportDB()
+
+
+def cache_stats():
+    return report_db.cache_stats()
+
+
+if __name__ == "__main__":
+    # python report_store.py migrate [path/to/report.json]
+    if len(sys.argv) >= 2 and sys.argv[1] == "migrate":
+        source = sys.argv[2] if len(sys.argv) > 2 else REPORT_JSON_PATH
+        count = report_db.migrate_from_json(source)
+        print(f"Imported {count} report entries from {source} into {REPORT_DB_PATH}")
+    else:
+        print("usage: python report_store.py migrate [report.json]")
@@ -0,0 +1,359 @@
+"""
+Report synthesis from per-frame feature columns.
+
+Every statistic is computed with whole-array NumPy operations: rolling windows via
+cumulative sums, run-length encoding for blinks and gaze fixations, and
+np.add.reduceat for per-segment means and variances. A full report for an hour of
+video (~100k frames) takes milliseconds.
+"""
+import numpy as np
+
+from analysis import ANALYZER_VERSION, uses_placeholders
+
+AU_NAMES = {
+    "au.au03": "AU3 (Brow Lowerer)",
+    "au.au05": "AU5 (Upper Lid Raiser / Cheek Raiser)",
+    "au.au22": "AU22 (Lips Part)",
+}
+AU_ACTIVE_THRESHOLD = 0.2
+
+# A frame is "eyes closed" when openness drops below this fraction of the video's median
+BLINK_CLOSED_RATIO = 0.6
+# Closures longer than this are eyes kept shut, not blinks
+BLINK_MAX_SECONDS = 0.5
+# Gaze inside this normalized box counts as looking at the learning content
+GAZE_CONTENT_BOX = 0.5
+# Shorter stretches of gaze on the content are not counted as fixations
+FIXATION_MIN_SECONDS = 0.3
+
+# Shown with everything derived from placeholder extractors (see analysis.Extractor)
+PLACEHOLDER_NOTICE = ("Placeholder data: computed by stand-in extractors (image statistics), not trained models. "
+                      "It is not a clinical or educational assessment of the student.")
+
+# Window summary fields averaged (weighted by frames) into the running report of a stream
+RUNNING_MEANS = tuple(AU_NAMES) + ("va.valence", "va.arousal", "gaze_on_content")
+
+# VA is smoothed over this window before judging how much it fluctuates
+SMOOTHING_SECONDS = 1.0
+VALENCE_FLUCTUATION = 0.1
+AROUSAL_STABILITY = 0.25
+# The clip is split into these consecutive segments for the VA description
+VA_SEGMENTS = ("beginning", "middle", "end")
+
+
+def sampling_info(features, mode="full"):
+    analyzed = int(len(features["frame_index"]))
+    total = int(features.get("total_frames", analyzed)) or 1
+    return {
+        "mode": mode,
+        "frames_analyzed": analyzed,
+        "frames_total": total,
+        "sampling_rate": round(analyzed / total, 4),
+    }
+
+
+def sample_interval(features):
+    """
+    Seconds between consecutive analyzed frames (larger for subsampled runs).
+    """
+    fps = float(features.get("fps", 30.0)) or 30.0
+    frame_index = features["frame_index"]
+    step = float(np.median(np.diff(frame_index))) if len(frame_index) > 1 else 1.0
+    return max(step, 1.0) / fps
+
+
+def run_lengths(mask):
+    """
+    Run-length encoding of a boolean array: (starts, lengths) of its runs of True values.
+    """
+    padded = np.concatenate(([0], np.asarray(mask, dtype=np.int8), [0]))
+    edges = np.flatnonzero(np.diff(padded))
+    starts, ends = edges[0::2], edges[1::2]
+    return starts, ends - starts
+
+
+def count_runs(mask):
+    """
+    Number of runs of consecutive True values in a boolean array.
+    """
+    return int(len(run_lengths(mask)[0]))
+
+
+def rolling_mean(values, window):
+    """
+    Means over every run of `window` consecutive values (len(values) - window + 1 of
+    them), computed from one cumulative sum.
+    """
+    window = max(1, min(window, len(values)))
+    sums = np.cumsum(np.concatenate(([0.0], np.asarray(values, dtype=np.float64))))
+    return (sums[window:] - sums[:-window]) / window
+
+
+def rolling_std(values, window):
+    values = np.asarray(values, dtype=np.float64)
+    mean = rolling_mean(values, window)
+    return np.sqrt(np.maximum(rolling_mean(values ** 2, window) - mean ** 2, 0.0))
+
+
+def segment_stats(values, segments=len(VA_SEGMENTS)):
+    """
+    Means and variances of values split into `segments` consecutive, near-equal parts.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    segments = max(1, min(segments, len(values)))
+    starts = np.linspace(0, len(values), segments + 1).astype(int)[:-1]
+    counts = np.diff(np.append(starts, len(values)))
+    means = np.add.reduceat(values, starts) / counts
+    variances = np.maximum(np.add.reduceat(values ** 2, starts) / counts - means ** 2, 0.0)
+    return means, variances
+
+
+def au_statistics(features, interval):
+    stats = {}
+    for column in AU_NAMES:
+        if column in features and len(features[column]):
+            active = features[column] > AU_ACTIVE_THRESHOLD
+            _, lengths = run_lengths(active)
+            stats[column] = {
+                "active_pct": round(float(active.mean() * 100), 2),
+                "longest_active_seconds": round(float(lengths.max(initial=0) * interval), 2),
+            }
+    return stats
+
+
+def va_statistics(features, interval):
+    valence, arousal = features["va.valence"], features["va.arousal"]
+    if not len(valence):
+        return {}
+    window = int(round(SMOOTHING_SECONDS / interval))
+    valence_means, valence_vars = segment_stats(valence)
+    arousal_means, arousal_vars = segment_stats(arousal)
+    return {
+        "valence_mean": round(float(valence.mean()), 3),
+        "arousal_mean": round(float(arousal.mean()), 3),
+        # Spread of the smoothed signal: slow swings, not frame-to-frame noise
+        "valence_fluctuation": round(float(rolling_mean(valence, window).std()), 3),
+        "arousal_fluctuation": round(float(rolling_mean(arousal, window).std()), 3),
+        "valence_local_std": round(float(np.median(rolling_std(valence, window))), 3),
+        "segments": [
+            {
+                "valence_mean": round(float(vm), 3), "valence_var": round(float(vv), 4),
+                "arousal_mean": round(float(am), 3), "arousal_var": round(float(av), 4),
+            }
+            for vm, vv, am, av in zip(valence_means, valence_vars, arousal_means, arousal_vars)
+        ],
+    }
+
+
+def blink_statistics(features, interval):
+    openness = features["blink.eye_openness"]
+    if not len(openness):
+        return {}
+    _, lengths = run_lengths(openness < np.median(openness) * BLINK_CLOSED_RATIO)
+    durations = lengths * interval
+    blinks = durations[durations <= BLINK_MAX_SECONDS + 1e-6]
+    minutes = len(openness) * interval / 60
+    return {
+        "count": int(len(blinks)),
+        "rate_per_minute": round(len(blinks) / minutes, 2) if minutes else 0.0,
+        "mean_duration_ms": round(float(blinks.mean() * 1000), 1) if len(blinks) else 0.0,
+        "long_closures": int(len(durations) - len(blinks)),
+    }
+
+
+def on_content_mask(features):
+    return (np.abs(features["gaze.gaze_x"]) < GAZE_CONTENT_BOX) & (np.abs(features["gaze.gaze_y"]) < GAZE_CONTENT_BOX)
+
+
+def gaze_statistics(features, interval):
+    if not len(features["gaze.gaze_x"]):
+        return {}
+    on_content = on_content_mask(features)
+    _, lengths = run_lengths(on_content)
+    fixations = lengths[lengths * interval >= FIXATION_MIN_SECONDS - 1e-6] * interval
+    _, away = run_lengths(~on_content)
+    return {
+        "on_content_ratio": round(float(on_content.mean()), 3),
+        "fixations": int(len(fixations)),
+        "mean_fixation_seconds": round(float(fixations.mean()), 2) if len(fixations) else 0.0,
+        "longest_fixation_seconds": round(float(fixations.max(initial=0)), 2),
+        "glances_away": int(len(away)),
+    }
+
+
+def temporal_statistics(features):
+    """
+    All numeric statistics behind a report, grouped by modality.
+    """
+    interval = sample_interval(features)
+    return {
+        "duration_seconds": round(len(features["frame_index"]) * interval, 2),
+        "au": au_statistics(features, interval),
+        "va": va_statistics(features, interval),
+        "blink": blink_statistics(features, interval),
+        "gaze": gaze_statistics(features, interval),
+    }
+
+
+def au_report(stats):
+    lines = [
+        f"{AU_NAMES[column]} - Active in {au['active_pct']:.2f}% of frames"
+        + (f" (longest stretch {au['longest_active_seconds']:.1f} s)." if au["active_pct"] else ".")
+        for column, au in stats["au"].items()
+    ]
+    return "\n".join(lines) or "No AU data available."
+
+
+def _segment_phrase(segment):
+    valence = "positive" if segment["valence_mean"] > 0.05 else "negative" if segment["valence_mean"] < -0.05 else "neutral"
+    arousal = "high" if segment["arousal_mean"] > 0 else "low"
+    return f"{valence} valence with {arousal} arousal"
+
+
+def va_report(stats):
+    va = stats["va"]
+    if not va:
+        return "No VA data available."
+    valence_trend = "fluctuates across the clip" if va["valence_fluctuation"] > VALENCE_FLUCTUATION else "remains stable across the clip"
+    arousal_level = "high" if va["arousal_mean"] > 0 else "low"
+    arousal_trend = "consistently" if va["arousal_fluctuation"] < AROUSAL_STABILITY else "mostly"
+    text = f"Valence {valence_trend}, while Arousal remains {arousal_trend} {arousal_level}."
+    if len(va["segments"]) == len(VA_SEGMENTS):
+        phrases = [f"{_segment_phrase(s)} {'in the' if name == 'middle' else 'at the'} {name}"
+                   for name, s in zip(VA_SEGMENTS, va["segments"])]
+        text += " The clip shows " + ", ".join(phrases[:-1]) + " and " + phrases[-1] + "."
+    return text
+
+
+def blink_report(stats):
+    blink = stats["blink"]
+    if not blink:
+        return "No blink data available."
+    text = "1 eye blink was observed" if blink["count"] == 1 else f"{blink['count']} eye blinks were observed"
+    if blink["count"]:
+        text += f" ({blink['rate_per_minute']:.1f} per minute, mean duration {blink['mean_duration_ms']:.0f} ms)"
+    return text + "."
+
+
+def gaze_report(stats):
+    gaze = stats["gaze"]
+    if not gaze:
+        return "No gaze data available."
+    return (f"Gaze on learning content in ~{gaze['on_content_ratio'] * 100:.0f}% of frames, "
+            f"with {gaze['fixations']} fixations (mean {gaze['mean_fixation_seconds']:.1f} s) "
+            f"and {gaze['glances_away']} glances away.")
+
+
+def window_summary(features):
+    """
+    Per-window aggregates for the streaming analysis: time span, AU activation (% of
+    frames), mean valence and arousal, blink count and gaze-on-content ratio.
+    """
+    timestamps = features["timestamp"]
+    stats = temporal_statistics(features)
+    summary = {
+        "start": round(float(timestamps[0]), 2) if len(timestamps) else 0.0,
+        "end": round(float(timestamps[-1]), 2) if len(timestamps) else 0.0,
+        "frames": int(len(timestamps)),
+    }
+    for column, au in stats["au"].items():
+        summary[column] = au["active_pct"]
+    summary["va.valence"] = stats["va"].get("valence_mean")
+    summary["va.arousal"] = stats["va"].get("arousal_mean")
+    summary["blinks"] = stats["blink"].get("count", 0)
+    summary["gaze_on_content"] = stats["gaze"].get("on_content_ratio", 0.0)
+    return summary
+
+
+def engagement_level(on_content_ratio):
+    return "high" if on_content_ratio >= 0.7 else "moderate" if on_content_ratio >= 0.4 else "low"
+
+
+def add_to_running(totals, summary):
+    """
+    Folds one window summary into the running totals of a streaming analysis:
+    frames, blinks, end time and frame-weighted sums of RUNNING_MEANS.
+    """
+    totals["frames"] = totals.get("frames", 0) + summary["frames"]
+    totals["blinks"] = totals.get("blinks", 0) + summary["blinks"]
+    totals["end"] = summary["end"]
+    for key in RUNNING_MEANS:
+        if summary.get(key) is not None:
+            totals[f"{key}.sum"] = totals.get(f"{key}.sum", 0.0) + summary[key] * summary["frames"]
+            totals[f"{key}.frames"] = totals.get(f"{key}.frames", 0) + summary["frames"]
+    return totals
+
+
+def running_report(totals):
+    """
+    Report of a streaming analysis in progress, from its running totals alone, so it
+    costs the same after every window. Blinks are counted per window; the final
+    report is built from all frames once the analysis finishes.
+    """
+    def mean(key):
+        frames = totals.get(f"{key}.frames")
+        return totals[f"{key}.sum"] / frames if frames else None
+
+    minutes = totals.get("end", 0.0) / 60
+    valence, arousal, ratio = mean("va.valence"), mean("va.arousal"), mean("gaze_on_content")
+    entry = {
+        "AU_report": "\n".join(f"{name} - Active in {mean(column):.2f}% of frames."
+                               for column, name in AU_NAMES.items() if mean(column) is not None)
+                     or "No AU data available.",
+        "VA_report": "No VA data available." if valence is None else
+                     f"Mean valence {valence:+.2f} and mean arousal {arousal:+.2f} so far.",
+        "Eyeblink_report": f"{totals.get('blinks', 0)} eye blinks observed so far"
+                           + (f" ({totals['blinks'] / minutes:.1f} per minute)." if minutes else "."),
+        "Gaze_reprot": "No gaze data available." if ratio is None else
+                       f"Gaze on learning content in ~{ratio * 100:.0f}% of frames so far.",
+    }
+    summary = (f"Running result for the first {totals.get('end', 0.0):.0f} s ({totals.get('frames', 0)} frames). "
+               f"Overall, the student shows {engagement_level(ratio or 0.0)} engagement so far.")
+    placeholder = uses_placeholders()
+    entry["text_report"] = "\n\n".join(([PLACEHOLDER_NOTICE] if placeholder else []) + [
+        summary,
+        " - The facial action analysis shows:\n" + entry["AU_report"],
+        " - " + entry["VA_report"],
+        " - " + entry["Eyeblink_report"],
+        " - " + entry["Gaze_reprot"],
+    ])
+    if placeholder:
+        entry["placeholder"] = True
+    return entry
+
+
+def build_report(features, mode="full"):
+    """
+    Builds a report entry with the same fields as the entries in the report store
+    (AU_report, VA_report, Eyeblink_report, Gaze_reprot, text_report) from per-frame
+    feature columns, tagged with the analyzer version, the sampling used and the
+    underlying statistics. Entries built by placeholder extractors are marked
+    "placeholder" and their text starts with PLACEHOLDER_NOTICE.
+    """
+    sampling = sampling_info(features, mode)
+    stats = temporal_statistics(features)
+    entry = {
+        "AU_report": au_report(stats),
+        "VA_report": va_report(stats),
+        "Eyeblink_report": blink_report(stats),
+        "Gaze_reprot": gaze_report(stats),
+    }
+    engagement = engagement_level(stats["gaze"].get("on_content_ratio", 0.0))
+    summary = f"Overall, the student shows {engagement} engagement throughout this video clip."
+    if mode != "full":
+        summary = (f"Preliminary result ({sampling['frames_analyzed']} of {sampling['frames_total']} frames analyzed). "
+                   + summary)
+    placeholder = uses_placeholders()
+    entry["text_report"] = "\n\n".join(([PLACEHOLDER_NOTICE] if placeholder else []) + [
+        summary,
+        " - The facial action analysis shows:\n" + entry["AU_report"],
+        " - " + entry["VA_report"],
+        " - " + entry["Eyeblink_report"],
+        " - " + entry["Gaze_reprot"],
+    ])
+    entry["analyzer_version"] = ANALYZER_VERSION
+    if placeholder:
+        entry["placeholder"] = True
+    entry["sampling"] = sampling
+    entry["statistics"] = stats
+    return entry
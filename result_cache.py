@@ -0,0 +1,191 @@
+import os
+import re
+import json
+import fcntl
+import shutil
+import hashlib
+import threading
+
+from analysis import ANALYZER_VERSION
+
+RESULT_CACHE_DIR = "data/cache/results"
+# Budget for the large derived .mp4 files; features and reports are tiny and always kept
+MAX_VIDEO_BYTES = int(os.environ.get("SCOPE_RESULT_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+
+# Report fields that name derived artifacts stored in videos/
+ARTIFACT_FIELDS = ("AU_video", "VA_plot", "Eyeblink_video", "Gaze_tracking", "Overlay_track")
+
+# Uploads are already stored under their SHA-256 (see uploads.store_upload)
+_SHA256_NAME = re.compile(r"^[0-9a-f]{64}$")
+
+_hash_memo = {}
+_hash_lock = threading.Lock()
+
+
+def content_hash(path, chunk_size=1024 * 1024):
+    """
+    SHA-256 of a file's content, memoized per (path, mtime, size) so an unchanged
+    video is hashed once per process.
+    """
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if _SHA256_NAME.match(stem):
+        return stem
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    with _hash_lock:
+        if key in _hash_memo:
+            return _hash_memo[key]
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    with _hash_lock:
+        _hash_memo[key] = digest.hexdigest()
+    return _hash_memo[key]
+
+
+def link_or_copy(src, dst):
+    """
+    Atomically places src at dst, as a hard link when the filesystem allows it.
+    """
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        return
+    tmp = dst + ".tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copy2(src, tmp)
+    os.replace(tmp, dst)
+
+
+class ResultCache:
+    """
+    Persistent analysis results keyed by video content hash, analyzer version and
+    mode. Each entry holds the feature file, the report entry and the derived
+    artifacts (annotated videos, VA plot, overlay track). Entries of other analyzer versions are
+    never read and are removed by prune(); derived .mp4 files are evicted least
+    recently used first once they exceed max_video_bytes.
+    """
+
+    def __init__(self, cache_dir=RESULT_CACHE_DIR, version=ANALYZER_VERSION, max_video_bytes=MAX_VIDEO_BYTES):
+        self.cache_dir = cache_dir
+        self.version = version
+        self.max_video_bytes = max_video_bytes
+        self._lock = threading.Lock()
+        self._pruned = False
+
+    def _entry_dir(self, digest, mode):
+        return os.path.join(self.cache_dir, self.version, f"{digest}.{mode}")
+
+    def get(self, digest, mode="full"):
+        """
+        Returns {"features": path, "report": dict or None, "artifacts": {name: path}}
+        or None on a miss, where name is the artifact's path relative to videos/.
+        A hit marks the entry as recently used.
+        """
+        entry_dir = self._entry_dir(digest, mode)
+        meta_path = os.path.join(entry_dir, "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        os.utime(meta_path)
+        artifacts = {
+            name: os.path.join(entry_dir, os.path.basename(name))
+            for name in meta.get("artifacts", {}).values()
+            if os.path.exists(os.path.join(entry_dir, os.path.basename(name)))
+        }
+        return {
+            "features": os.path.join(entry_dir, "features.npz"),
+            "report": meta.get("report"),
+            "artifacts": artifacts,
+        }
+
+    def put(self, digest, feature_file, report=None, artifact_dir="videos", mode="full"):
+        if not self._pruned:
+            # Results of an older analyzer version are dead weight once it changes
+            self.prune()
+            self._pruned = True
+        entry_dir = self._entry_dir(digest, mode)
+        os.makedirs(entry_dir, exist_ok=True)
+        link_or_copy(feature_file, os.path.join(entry_dir, "features.npz"))
+        artifacts = {}
+        for field in ARTIFACT_FIELDS:
+            name = (report or {}).get(field)
+            if name and os.path.exists(os.path.join(artifact_dir, name)):
+                link_or_copy(os.path.join(artifact_dir, name), os.path.join(entry_dir, os.path.basename(name)))
+                artifacts[field] = name
+        meta = {"version": self.version, "mode": mode, "report": report, "artifacts": artifacts}
+        tmp_path = os.path.join(entry_dir, "meta.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(entry_dir, "meta.json"))
+        self.evict()
+
+    @staticmethod
+    def _cache_only_videos(entry_dir):
+        """
+        (path, size) of the entry's .mp4 files that are not also linked from videos/.
+        A hard-linked file frees nothing when its cache link is removed.
+        """
+        videos = []
+        for name in os.listdir(entry_dir):
+            if name.endswith(".mp4"):
+                try:
+                    stat = os.stat(os.path.join(entry_dir, name))
+                except FileNotFoundError:
+                    continue
+                if stat.st_nlink == 1:
+                    videos.append((os.path.join(entry_dir, name), stat.st_size))
+        return videos
+
+    def evict(self):
+        """
+        Deletes derived .mp4 files of the least recently used entries until the
+        bytes held only by the cache are within max_video_bytes. Runs under a file
+        lock, as every worker process evicts after its own put(). Returns the number
+        of bytes freed.
+        """
+        version_dir = os.path.join(self.cache_dir, self.version)
+        if not os.path.isdir(version_dir):
+            return 0
+        with self._lock, open(os.path.join(version_dir, ".evict.lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            entries = []
+            total = 0
+            for name in os.listdir(version_dir):
+                meta_path = os.path.join(version_dir, name, "meta.json")
+                try:
+                    used_at = os.path.getmtime(meta_path)
+                    videos = self._cache_only_videos(os.path.join(version_dir, name))
+                except (FileNotFoundError, NotADirectoryError):
+                    continue
+                total += sum(size for _, size in videos)
+                entries.append((used_at, videos))
+            freed = 0
+            for _, videos in sorted(entries, key=lambda e: e[0]):
+                if total - freed <= self.max_video_bytes:
+                    break
+                for path, size in videos:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        continue
+                    freed += size
+            return freed
+
+    def prune(self):
+        """
+        Removes the entries of every analyzer version other than the current one.
+        """
+        if not os.path.isdir(self.cache_dir):
+            return []
+        removed = [v for v in os.listdir(self.cache_dir) if v != self.version]
+        for version in removed:
+            shutil.rmtree(os.path.join(self.cache_dir, version), ignore_errors=True)
+        return removed
+
+
+result_cache = ResultCache()
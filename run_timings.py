@@ -0,0 +1,119 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from metrics import registry
+
+TIMINGS_DB_PATH = "data/timings.db"
+
+_local = threading.local()
+
+
+def _conn(db_path=TIMINGS_DB_PATH):
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(db_path)
+    if conn is None:
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        conn = sqlite3.connect(db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS runs ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " kind TEXT NOT NULL,"
+                " video TEXT NOT NULL,"
+                " started_at REAL NOT NULL,"
+                " total_seconds REAL NOT NULL,"
+                " stages TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS runs_video ON runs (video, started_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS runs_kind ON runs (kind, started_at)")
+        conns[db_path] = conn
+    return conn
+
+
+class RunTimer:
+    """
+    Collects the duration of each pipeline stage of one run (decode, per-modality
+    extraction, report synthesis, persistence...) and saves them as one record.
+    Stages timed more than once, e.g. once per frame batch, are summed.
+    """
+
+    def __init__(self, kind, video, db_path=TIMINGS_DB_PATH):
+        self.kind = kind
+        self.video = video
+        self.db_path = db_path
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.stages = {}
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def save(self):
+        total = time.perf_counter() - self._start
+        registry.observe("run_seconds", total, kind=self.kind)
+        for stage, seconds in self.stages.items():
+            registry.observe("stage_seconds", seconds, kind=self.kind, stage=stage)
+        conn = _conn(self.db_path)
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO runs (kind, video, started_at, total_seconds, stages) VALUES (?, ?, ?, ?, ?)",
+                (self.kind, self.video, self.started_at, total,
+                 json.dumps({k: round(v, 6) for k, v in self.stages.items()})),
+            )
+        return cursor.lastrowid
+
+
+def query_runs(kind=None, video=None, limit=50, db_path=TIMINGS_DB_PATH):
+    """
+    Most recent timing records, newest first, optionally filtered by kind and video.
+    """
+    query, args = "SELECT * FROM runs WHERE 1 = 1", []
+    if kind:
+        query += " AND kind = ?"
+        args.append(kind)
+    if video:
+        query += " AND video = ?"
+        args.append(video)
+    rows = _conn(db_path).execute(query + " ORDER BY started_at DESC LIMIT ?", (*args, limit)).fetchall()
+    return [dict(row, stages=json.loads(row["stages"])) for row in rows]
+
+
+def stage_summary(kind=None, limit=1000, db_path=TIMINGS_DB_PATH):
+    """
+    Per-stage count, mean and p95 duration (seconds) over the most recent runs.
+    """
+    per_stage = {}
+    for run in query_runs(kind, limit=limit, db_path=db_path):
+        per_stage.setdefault("total", []).append(run["total_seconds"])
+        for stage, seconds in run["stages"].items():
+            per_stage.setdefault(stage, []).append(seconds)
+    summary = {}
+    for stage, values in per_stage.items():
+        values.sort()
+        summary[stage] = {
+            "count": len(values),
+            "mean": sum(values) / len(values),
+            "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+        }
+    return summary
+
+
+if __name__ == "__main__":
+    for stage, stats in stage_summary().items():
+        print(f"{stage:<24} n={stats['count']:<6} mean={stats['mean'] * 1000:9.2f} ms  p95={stats['p95'] * 1000:9.2f} ms")
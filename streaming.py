@@ -0,0 +1,118 @@
+"""
+Streaming analysis of long recordings.
+
+The video is analyzed in fixed time windows (analysis.extract_features_windowed).
+After every window the per-window aggregates, the running report and the VA plot
+are republished to data/features/<video_id>.windows/partial.json, so the first
+results of a classroom session are available after one window instead of at the
+end of the whole recording. Each window is folded into running totals and a
+downsampled plot series once, so publishing costs the same after every window.
+"""
+import os
+import json
+import math
+import time
+
+import numpy as np
+
+from analysis import window_dir, extract_features_windowed
+from report_synthesis import window_summary, add_to_running, running_report
+from va_plot import PLOT_SIZE, lttb, render_va_plot
+
+VIDEO_DIR = "videos"
+
+
+def partial_path(video_filename):
+    return os.path.join(window_dir(video_filename), "partial.json")
+
+
+def live_va_plot_name(video_filename):
+    """
+    Name (relative to videos/) of the VA plot redrawn after every window.
+    """
+    stem = os.path.splitext(os.path.basename(video_filename))[0]
+    return f"previews/{stem}.va_live.png"
+
+
+class PartialPublisher:
+    """
+    Partial result of one streaming analysis. add_window() folds a finished window in:
+    its summary into the running totals, and its VA points, downsampled to the
+    window's share of the plot width, into the plotted series.
+    """
+
+    def __init__(self, video_filename):
+        self.video_filename = video_filename
+        self.summaries = []
+        self.totals = {}
+        self.series = ([], [], [])  # timestamps, valence, arousal
+        self.duration = None
+
+    def add_window(self, window):
+        summary = window_summary(window)
+        self.summaries.append(summary)
+        add_to_running(self.totals, summary)
+        total_frames = int(window["total_frames"])
+        self.duration = total_frames / float(window["fps"])
+        timestamps, valence, arousal = window["timestamp"], window["va.valence"], window["va.arousal"]
+        # Two points per pixel column of the window's share of the time axis, for each curve
+        budget = max(3, math.ceil(2 * PLOT_SIZE[0] * len(timestamps) / max(total_frames, 1)))
+        kept = np.union1d(lttb(timestamps, valence, budget), lttb(timestamps, arousal, budget))
+        for values, column in zip(self.series, (timestamps, valence, arousal)):
+            values.append(np.asarray(column)[kept])
+
+    def publish(self, total_windows):
+        """
+        Rewrites partial.json and the live VA plot from the windows added so far.
+        """
+        plot = live_va_plot_name(self.video_filename)
+        timestamps, valence, arousal = (np.concatenate(values) for values in self.series)
+        render_va_plot(timestamps, valence, arousal, os.path.join(VIDEO_DIR, plot), duration=self.duration)
+        partial = {
+            "completed": len(self.summaries),
+            "total": total_windows,
+            "windows": self.summaries,
+            "report": running_report(self.totals),
+            "va_plot": plot,
+            "updated_at": time.time(),
+        }
+        path = partial_path(self.video_filename)
+        with open(path + ".tmp", "w") as f:
+            json.dump(partial, f)
+        os.replace(path + ".tmp", path)
+        return partial
+
+
+def load_partial(video_filename):
+    """
+    Latest partial result of a streaming analysis in progress, or None.
+    """
+    try:
+        with open(partial_path(video_filename), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def extract_streaming(video_path, window_seconds=None, progress=None, batch_size=None, num_threads=None,
+                      timer=None):
+    """
+    extract_features_windowed with a partial result published after every window.
+    """
+    publisher = PartialPublisher(os.path.basename(video_path))
+
+    def publish(windows, total_windows):
+        # Only windows not seen yet; a resumed run passes its checkpointed ones first
+        for window in windows[len(publisher.summaries):]:
+            publisher.add_window(window)
+        publisher.publish(total_windows)
+
+    def on_window(windows, total_windows):
+        if timer is None:
+            publish(windows, total_windows)
+        else:
+            with timer.stage("partial_report"):
+                publish(windows, total_windows)
+
+    return extract_features_windowed(video_path, window_seconds, on_window=on_window, progress=progress,
+                                     batch_size=batch_size, num_threads=num_threads, timer=timer)
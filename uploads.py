@@ -0,0 +1,51 @@
+import os
+import hashlib
+import tempfile
+
+from metrics import timed, count
+
+UPLOAD_DIR = "videos"
+CHUNK_SIZE = 1024 * 1024  # 1 MB
+
+
+@timed("store_upload")
+def store_upload(fileobj, original_name, dest_dir=UPLOAD_DIR, chunk_size=CHUNK_SIZE):
+    """
+    Copies an uploaded file to disk chunk by chunk, hashing it while writing, then
+    atomically renames it to a content-addressed name (<sha256><ext>) in dest_dir, so
+    an identical upload is never stored twice. The original name is not kept here:
+    callers record it with the user's access (AccessMap.grant's display_name).
+    Returns (stored_filename, sha256_hex, is_duplicate).
+    """
+    ext = os.path.splitext(original_name)[1].lower() or ".mp4"
+    os.makedirs(dest_dir, exist_ok=True)
+    digest = hashlib.sha256()
+
+    # The temp file lives in dest_dir so the final rename stays on one filesystem
+    fd, tmp_path = tempfile.mkstemp(dir=dest_dir, prefix=".upload-", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = fileobj.read(chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+            out.flush()
+            os.fsync(out.fileno())
+
+        sha256 = digest.hexdigest()
+        stored_filename = sha256 + ext
+        final_path = os.path.join(dest_dir, stored_filename)
+        is_duplicate = os.path.exists(final_path)
+        count("uploads_total", duplicate="yes" if is_duplicate else "no")
+        count("upload_bytes_total", os.path.getsize(tmp_path))
+        if is_duplicate:
+            os.remove(tmp_path)
+            return stored_filename, sha256, True
+        os.replace(tmp_path, final_path)
+        return stored_filename, sha256, False
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -1,35 +1,170 @@
 import os
-import json
+from report_store import report_db
+from access_map import access_map
+from run_timings import RunTimer
+from metrics import timed, count
 
-def get_user_videos(email):
-    with open("data/user_videos.json", "r") as f:
-        user_map = json.load(f)
-    return user_map.get(email, [])
+# The analysis stack (NumPy, OpenCV, the models) is imported by the functions that
+# need it, so pages that only list videos and read reports start without it.
 
-def analyze_video(video_path):
-    # TODO: Replace this with actual video analysis logic
-    return video_path  # Placeholder: return original video
+@timed("get_user_videos")
+def get_user_videos(email, offset=0, limit=None):
+    return access_map.videos_for(email, offset, limit)
 
-def generate_report(video_path):
-    # TODO: Replace this with actual report generation logic
-    return f"Analysis report for {os.path.basename(video_path)}: content is clear, engagement is high, no issues detected."
+def count_user_videos(email):
+    return access_map.count_videos(email)
 
+# Subsampling used by the quick preliminary analysis modes
+FAST_STRIDE = 10
+KEYFRAME_THRESHOLD = 4.0
+
+@timed("analyze_video")
+def analyze_video(video_path, progress=None, batch_size=None, num_threads=None, mode="full"):
+    """
+    Decodes the video once, runs every modality extractor (AU, VA, blink, gaze) on
+    batches of batch_size frames and writes the per-frame results to
+    data/features/<video_id>.npz. Returns the path of the analyzed video.
+
+    mode="fast" analyzes every FAST_STRIDE-th frame and mode="keyframes" only
+    scene-change frames, for a preliminary result within seconds; their features are
+    stored separately and never replace the full-rate ones.
+
+    mode="stream" produces the same full-rate result, but analyzes the video in
+    fixed time windows and publishes a partial report and VA plot after each one
+    (see streaming.py). An interrupted stream job resumes after its last finished window.
+    """
+    from analysis import extract_features, save_features, clear_windows
+    from streaming import extract_streaming, live_va_plot_name
+    from va_plot import va_plot_for
+    from overlays import overlay_for
+    from result_cache import result_cache, content_hash
+    from report_synthesis import build_report
+
+    video_filename = os.path.basename(video_path)
+    timer = RunTimer(f"analyze.{mode}", video_filename)
+    # Streaming is a way of computing the full-rate result, stored as such
+    storage_mode = "full" if mode == "stream" else mode
+
+    def report_progress(fraction, message=""):
+        if progress is not None:
+            progress(fraction, message)
+
+    with timer.stage("hash"):
+        digest = content_hash(video_path)
+    with timer.stage("cache_lookup"):
+        cached = result_cache.get(digest, storage_mode)
+    count("analysis_cache_lookups_total", mode=storage_mode, result="miss" if cached is None else "hit")
+    if cached is not None:
+        # Same content already analyzed by this analyzer version: restore, don't recompute
+        with timer.stage("persist.restore_cache"):
+            restore_cached_result(video_filename, cached, storage_mode)
+        timer.save()
+        report_progress(1.0, "Loaded cached analysis")
+        return video_path
+
+    stride = FAST_STRIDE if mode == "fast" else 1
+    scene_threshold = KEYFRAME_THRESHOLD if mode == "keyframes" else None
+    # Extraction is ~90% of the work; the remaining stages share the rest of the bar
+    extraction_progress = lambda f, m="": report_progress(0.9 * f, m)
+    if mode == "stream":
+        features = extract_streaming(video_path, progress=extraction_progress, batch_size=batch_size,
+                                     num_threads=num_threads, timer=timer)
+    else:
+        features = extract_features(video_path, progress=extraction_progress,
+                                    batch_size=batch_size, num_threads=num_threads,
+                                    stride=stride, scene_threshold=scene_threshold, timer=timer)
+    with timer.stage("persist.features"):
+        feature_file = save_features(video_path, features, mode=storage_mode)
+
+    report = None
+    if storage_mode == "full":
+        # Generated entries carry analyzer_version; curated entries (imported from
+        # report.json) do not and are never overwritten by the analysis
+        report_progress(0.92, "Synthesizing report")
+        existing = report_db.get(video_filename)
+        if existing is None or "analyzer_version" in existing:
+            with timer.stage("report_synthesis"):
+                existing = build_report(features)
+            with timer.stage("render.va_plot"):
+                existing["VA_plot"] = va_plot_for(video_filename)
+            with timer.stage("render.overlay"):
+                # AU, blink and gaze are drawn over the original video at view time
+                existing["Overlay_track"] = overlay_for(video_filename)
+            with timer.stage("persist.report"):
+                if existing.get("placeholder"):
+                    # Placeholder output is shown labelled but never stored as the
+                    # video's report, nor kept from an earlier analysis
+                    if report_db.get(video_filename) is not None:
+                        report_db.delete(video_filename)
+                else:
+                    report_db.put(video_filename, existing)
+        report = existing
+    report_progress(0.96, "Saving results")
+    with timer.stage("persist.cache"):
+        result_cache.put(digest, feature_file, report, mode=storage_mode)
+    if mode == "stream":
+        clear_windows(video_path)
+        live_plot = os.path.join("videos", live_va_plot_name(video_filename))
+        if os.path.exists(live_plot):
+            os.remove(live_plot)
+    timer.save()
+    report_progress(1.0, "Analysis complete")
+    return video_path
+
+def restore_cached_result(video_filename, cached, mode="full"):
+    """
+    Puts a cached result back in place: the feature file, any missing derived
+    artifacts in videos/, and the report entry if the video has none yet.
+    """
+    from analysis import feature_path
+    from result_cache import link_or_copy
+
+    target = feature_path(video_filename, mode=mode)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    link_or_copy(cached["features"], target)
+    for name, path in cached["artifacts"].items():
+        destination = os.path.join("videos", name)
+        if not os.path.exists(destination):
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            link_or_copy(path, destination)
+    report = cached["report"]
+    if mode == "full" and report is not None and not report.get("placeholder") \
+            and report_db.get(video_filename) is None:
+        report_db.put(video_filename, report)
+
+def generate_report(video_path, mode="full"):
+    """
+    Builds a report entry (AU, VA, blink, gaze, text) from the stored features of a
+    video analyzed in the given mode, tagged with its sampling rate.
+    Returns an empty dict if the video has not been analyzed in that mode.
+    """
+    from analysis import load_features
+    from report_synthesis import build_report
+
+    features = load_features(video_path, mode=mode)
+    if features is None:
+        return {}
+    return build_report(features, mode)
+
+@timed("read_report_text")
 def read_report_text(video_filename):
+    """
+    The text report of a video. Without a stored report, the text built from its
+    features, which starts with the placeholder notice when stand-in extractors made it.
+    """
     try:
-        with open("data/report.json", "r") as f:
-            data = json.load(f)
-        return data.get(video_filename, {}).get("text_report", "No report found for this video.")
+        entry = report_db.get(video_filename) or generate_report(video_filename)
+        return entry.get("text_report", "No report found for this video.")
     except Exception as e:
         return f"Error reading report: {e}"
-    
+
+@timed("read_full_report")
 def read_full_report(video_filename):
     """
     Reads the full multimodal report entry (AU, VA, blink, gaze, text) for a given video filename.
     Returns a dictionary or empty dict if not found.
     """
     try:
-        with open("data/report.json", "r") as f:
-            data = json.load(f)
-        return data.get(video_filename, {})
+        return report_db.get(video_filename) or {}
     except Exception as e:
-        return {"error": str(e)}
\ No newline at end of file
+        return {"error": str(e)}
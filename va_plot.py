@@ -0,0 +1,121 @@
+"""
+Valence-arousal plot images rendered from the stored per-frame features.
+
+Long recordings are downsampled with LTTB to two points per pixel column before
+drawing, and rendered plots are cached in videos/previews/va/ keyed by
+(video, analyzer version, resolution), so the VA tab of any analyzed video is a
+static file served by the media server rather than a figure drawn on every rerun.
+"""
+import os
+
+import numpy as np
+import cv2
+
+from analysis import ANALYZER_VERSION, feature_path, load_features
+
+VIDEO_DIR = "videos"
+VA_PLOT_DIR = os.path.join(VIDEO_DIR, "previews", "va")
+
+# Width and height in pixels
+PLOT_SIZE = (800, 300)
+# BGR line colours
+VALENCE_COLOR = (200, 120, 30)
+AROUSAL_COLOR = (40, 60, 220)
+AXIS_COLOR = (90, 90, 90)
+GRID_COLOR = (225, 225, 225)
+
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling. Returns the indices of `threshold`
+    points of (x, y): the first and last point, and from each bucket in between the
+    point forming the largest triangle with the previously kept point and the mean
+    of the next bucket, which keeps peaks and troughs that plain decimation drops.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    counts = np.diff(edges)
+    # Mean point of every bucket, plus the last point as the "next bucket" of the last one
+    mean_x = np.append(np.add.reduceat(x[:n - 1], edges[:-1]) / counts, x[-1])
+    mean_y = np.append(np.add.reduceat(y[:n - 1], edges[:-1]) / counts, y[-1])
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        areas = np.abs(
+            (x[previous] - mean_x[bucket + 1]) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (mean_y[bucket + 1] - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        kept[bucket + 1] = previous
+    return kept
+
+
+def render_va_plot(timestamps, valence, arousal, path, duration=None, size=PLOT_SIZE):
+    """
+    Draws valence and arousal (range -1..1) against time and writes a PNG to path.
+    With duration set, the time axis spans the whole video, so a plot of the first
+    minutes of a recording fills in from the left as the analysis progresses.
+    """
+    width, height = size
+    left, right, top, bottom = 45, width - 15, 30, height - 30
+    image = np.full((height, width, 3), 255, dtype=np.uint8)
+    font = cv2.FONT_HERSHEY_SIMPLEX
+
+    for value in (1.0, 0.5, 0.0, -0.5, -1.0):
+        y = int(round(top + (1 - value) / 2 * (bottom - top)))
+        cv2.line(image, (left, y), (right, y), AXIS_COLOR if value == 0 else GRID_COLOR, 1)
+        cv2.putText(image, f"{value:g}", (5, y + 4), font, 0.4, AXIS_COLOR, 1, cv2.LINE_AA)
+    cv2.line(image, (left, top), (left, bottom), AXIS_COLOR, 1)
+
+    end = duration or (float(timestamps[-1]) if len(timestamps) else 0.0) or 1.0
+    cv2.putText(image, "0 s", (left, height - 10), font, 0.4, AXIS_COLOR, 1, cv2.LINE_AA)
+    cv2.putText(image, f"{end:.0f} s", (right - 40, height - 10), font, 0.4, AXIS_COLOR, 1, cv2.LINE_AA)
+    for i, (label, color) in enumerate((("Valence", VALENCE_COLOR), ("Arousal", AROUSAL_COLOR))):
+        x = left + 10 + i * 110
+        cv2.line(image, (x, 15), (x + 20, 15), color, 2)
+        cv2.putText(image, label, (x + 25, 19), font, 0.45, color, 1, cv2.LINE_AA)
+
+    if len(timestamps):
+        timestamps = np.asarray(timestamps, dtype=np.float32)
+        for values, color in ((valence, VALENCE_COLOR), (arousal, AROUSAL_COLOR)):
+            values = np.asarray(values, dtype=np.float32)
+            # Two points per pixel column keep the drawn shape of a dense series
+            kept = lttb(timestamps, values, 2 * (right - left))
+            xs = left + timestamps[kept] / end * (right - left)
+            ys = top + (1 - np.clip(values[kept], -1, 1)) / 2 * (bottom - top)
+            points = np.round(np.stack([xs, ys], axis=1)).astype(np.int32)
+            cv2.polylines(image, [points], False, color, 1, cv2.LINE_AA)
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp.png"
+    cv2.imwrite(tmp_path, image)
+    os.replace(tmp_path, path)
+    return path
+
+
+def va_plot_path(video_filename, size=PLOT_SIZE, version=ANALYZER_VERSION):
+    stem = os.path.splitext(os.path.basename(video_filename))[0]
+    return os.path.join(VA_PLOT_DIR, f"{stem}.{version}.{size[0]}x{size[1]}.png")
+
+
+def va_plot_for(video_filename, size=PLOT_SIZE):
+    """
+    Name (relative to videos/) of the VA plot of an analyzed video, rendering it from
+    the stored features if it is not cached yet or older than the features.
+    Returns None if the video has no full-rate features.
+    """
+    source = feature_path(video_filename)
+    if not os.path.exists(source):
+        return None
+    path = va_plot_path(video_filename, size)
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(source):
+        features = load_features(video_filename)
+        render_va_plot(features["timestamp"], features["va.valence"], features["va.arousal"], path,
+                       duration=float(features["total_frames"] / features["fps"]), size=size)
+    return os.path.relpath(path, VIDEO_DIR)